@@ -1,20 +1,34 @@
 import os
-from supabase import create_client, Client
-from fastapi import FastAPI, HTTPException, status
+import asyncio
+import hashlib
+import importlib
+import time
+from fastapi import FastAPI, HTTPException, status, UploadFile, File, Form, BackgroundTasks, Request, Query
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Literal
 import cleaning
 import querycheck
 import graphgen
+import codecheck
+import planner
 import texanswer
+import datastore
+import llm
+import workers
+import sandbox
+import profiling
+import cubes
+import resultcache
+import memory
+import tracing
+import figures
 import pandas as pd
 import json
-import tempfile
 from cleaning import agent_cleaning
-import plotly.graph_objects as go
 from dotenv import load_dotenv
-import numpy as np 
 
 load_dotenv()
 
@@ -23,20 +37,74 @@ url: str = os.getenv("SUPABASE_URL")
 key: str = os.getenv("SUPABASE_KEY")
 if not url or not key:
     raise ValueError("Supabase URL and Key must be set in environment variables.")
-supabase: Client = create_client(url, key)
+# The one database client of the process, an async supabase client created on
+# startup so DB round-trips do not block the event loop. Modules that need the
+# database get it passed in, e.g. memory.history(supabase, c_id).
+supabase = None
+
+# Model clients, plotly and the sandbox workers load in the background after
+# startup, so a new worker accepts requests at once and /health/ready reports
+# when it is warm. WARM_UP=0 leaves them to load on first use. A warm-up that
+# failed, e.g. because the sandbox workers could not start, is started again
+# by the next readiness check, which reports the error meanwhile.
+WARM_UP = os.getenv("WARM_UP", "1") != "0"
+# Seconds the readiness check waits for the database
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))
+
+# Datasets at least this large are handed to AI cleaning through Parquet files (0 = never)
+AI_CLEANING_FILE_ROWS = int(os.getenv("AI_CLEANING_FILE_ROWS", "0"))
 
 app = FastAPI()
 
+_warm = {"seconds": None, "task": None}
+
+def warm_up():
+    """Load what the first requests would otherwise wait for"""
+    started = time.perf_counter()
+    llm.warm_up()
+    importlib.import_module("plotly.express")
+    sandbox.start()
+    _warm["seconds"] = round(time.perf_counter() - started, 3)
+
+def start_warm_up():
+    _warm["task"] = asyncio.create_task(run_in_threadpool(warm_up))
+
 @app.on_event("startup")
 async def startup_event():
+    global supabase
+    if supabase is None:
+        from supabase import acreate_client
+        supabase = await acreate_client(url, key)
+    if WARM_UP:
+        start_warm_up()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    sandbox.stop()
+
+@app.get("/health")
+async def health():
+    """Liveness: the process serves requests"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def ready():
+    """Readiness: warm-up has finished and the database answers"""
+    checks = {"warm_up": _warm["seconds"] is not None or not WARM_UP, "database": False}
+    task = _warm["task"]
+    if task is not None and task.done() and task.exception() is not None:
+        checks["warm_up_error"] = str(task.exception()) or type(task.exception()).__name__
+        start_warm_up()
     try:
-       
-        supabase.table('Chat').select('*', head=True).execute()
+        if supabase is not None:
+            await asyncio.wait_for(supabase.table('Chat').select('c_id', head=True).execute(), READY_TIMEOUT)
+            checks["database"] = True
     except Exception as e:
-        print("Error connecting to Supabase or finding 'Chat' table:")
-        print(e)
-
-
+        checks["database_error"] = str(e) or type(e).__name__
+    is_ready = checks["warm_up"] and checks["database"]
+    return JSONResponse({"status": "ready" if is_ready else "starting", "warm_up_seconds": _warm["seconds"], **checks},
+                        status_code=200 if is_ready else 503)
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,6 +113,8 @@ app.add_middleware(
     allow_methods=["*"],  
     allow_headers=["*"],  
 )
+# Added last so it is the outermost middleware and its timings cover CORS handling too
+app.add_middleware(tracing.Middleware)
 
 class ContactForm(BaseModel):
     name: str
@@ -56,16 +126,24 @@ class ProcessRequest(BaseModel):
     dictionary: Dict[str, Any]
     c_id: str
 
+class DatasetRequest(BaseModel):
+    data: List[Dict[str, Any]]
+    c_id: str
+
 class QueryRequest(BaseModel):
     query: str
-    df: List[Dict[str, Any]]
+    df: List[Dict[str, Any]] | None = None
+    dataset_id: str | None = None
 
 class TextRequest(BaseModel):
     query: str
-    df: List[Dict[str, Any]]
+    df: List[Dict[str, Any]] | None = None
+    dataset_id: str | None = None
     c_id: str
     user_id: str | None = None
     filename: str | None = None
+    # Engine for text answers, see texanswer.TEXT_ENGINE
+    engine: Literal["auto", "pandas", "sql"] | None = None
 
 class ChatName(BaseModel):
     name: str
@@ -84,7 +162,7 @@ async def create_chat(chat_name: ChatName):
         insert_data = {"name": chat_name.name}
         if chat_name.user_id:
             insert_data["userid"] = chat_name.user_id
-        response = supabase.table('Chat').insert(insert_data).execute()
+        response = await supabase.table('Chat').insert(insert_data).execute()
         if response.data:
             return {"c_id": response.data[0]['c_id']}
         else:
@@ -93,29 +171,144 @@ async def create_chat(chat_name: ChatName):
         print(e)
         raise HTTPException(status_code=500, detail=f"Error creating chat: {e}")
 
+# Listing pages, newest first. Lists carry metadata only; figures are
+# fetched by id when they are shown. Pages are keyed on the last row seen
+# (`before`), so deep pages cost the same as the first one.
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = 200
+CHAT_COLUMNS = "c_id,name,created_at"
+MESSAGE_COLUMNS = "id,created_at,user_message,type:response->>type"
+GRAPH_COLUMNS = "id,created_at,chat_id,name"
+# Fields of GraphRecord
+GRAPH_RECORD_COLUMNS = "id,created_at,chat_id,graph_data,name"
+
+def not_modified(request, etag, immutable=False):
+    """304 response if the request's If-None-Match has etag, else None"""
+    matches = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in matches or "*" in matches:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag, immutable))
+    return None
+
+def cache_headers(etag, immutable):
+    headers = {"ETag": etag}
+    if immutable:
+        headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return headers
+
+def json_response(request, payload, etag=None, immutable=False):
+    """JSON response with an ETag, or 304 when the client already has this version"""
+    body = json.dumps(payload, default=str).encode()
+    etag = etag or '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    return not_modified(request, etag, immutable) or Response(
+        body, media_type="application/json", headers=cache_headers(etag, immutable))
+
+def page(rows, key, limit, tie=None):
+    """A listing page with the cursor of the next one; `tie` breaks ties of `key` in the cursor"""
+    body = {"items": rows, "next_before": rows[-1][key] if len(rows) == limit else None}
+    if tie:
+        body["next_before_id"] = rows[-1][tie] if len(rows) == limit else None
+    return body
+
 @app.get("/chats/{user_id}")
-async def get_user_chats(user_id: str):
+async def get_user_chats(user_id: str, request: Request):
     """
     Fetches all chats associated with a specific user ID.
     """
     try:
-        response = supabase.table('Chat').select("*").eq('userid', user_id).order('created_at').execute()
-        return response.data
+        response = await supabase.table('Chat').select("*").eq('userid', user_id).order('created_at').execute()
+        return json_response(request, response.data)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/chats/{user_id}/page")
+async def get_user_chats_page(user_id: str, request: Request, before: str | None = None,
+                              before_id: str | None = None,
+                              limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    """A page of a user's chats (id, name, creation time) after the cursor (`before`, `before_id`).
+
+    The cursor is the creation time (URL-encoded) and id of the last chat of
+    the previous page; ids order chats created at the same time.
+    """
+    def chats():
+        return supabase.table('Chat').select(CHAT_COLUMNS).eq('userid', user_id)
+
+    try:
+        if not before:
+            queries = [chats()]
+        elif not before_id:
+            queries = [chats().lt('created_at', before)]
+        else:
+            # Chats created at the cursor's time with smaller ids, then older ones
+            queries = [chats().eq('created_at', before).lt('c_id', before_id),
+                       chats().lt('created_at', before)]
+        responses = await asyncio.gather(*(
+            query.order('created_at', desc=True).order('c_id', desc=True).limit(limit).execute()
+            for query in queries))
+        rows = [row for response in responses for row in response.data][:limit]
+        return json_response(request, page(rows, "created_at", limit, tie="c_id"))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/chat/{c_id}/messages")
-async def get_chat_messages(c_id: str):
+async def get_chat_messages(c_id: str, request: Request):
+    try:
+        response = await supabase.table('messages').select("*").eq('c_id', c_id).order('created_at').execute()
+        return json_response(request, response.data)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/chat/{c_id}/messages/page")
+async def get_chat_messages_page(c_id: str, request: Request, before: int | None = None,
+                                 limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    """A page of a chat's messages with ids below `before`.
+
+    Text answers are included; plot answers only carry their type and are
+    fetched with /message/{id} when shown.
+    """
     try:
-        response = supabase.table('messages').select("*").eq('c_id', c_id).order('created_at').execute()
-        return response.data
+        listing = supabase.table('messages').select(MESSAGE_COLUMNS).eq('c_id', c_id)
+        # Text rows of the page are among the newest `limit` text rows in the
+        # same range, so both queries can run at once
+        texts = supabase.table('messages').select("id,response").eq('c_id', c_id).eq('response->>type', 'text')
+        if before is not None:
+            listing = listing.lt('id', before)
+            texts = texts.lt('id', before)
+        response, text_response = await asyncio.gather(
+            listing.order('id', desc=True).limit(limit).execute(),
+            texts.order('id', desc=True).limit(limit).execute(),
+        )
+        rows = response.data
+        responses = {row["id"]: row["response"] for row in text_response.data}
+        for row in rows:
+            if row["id"] in responses:
+                row["response"] = responses[row["id"]]
+        return json_response(request, page(rows, "id", limit))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/message/{message_id}")
+async def get_message(message_id: int, request: Request):
+    """A full message, including its figure. Messages never change once stored."""
+    etag = f'"message-{message_id}"'
+    try:
+        # Only the id first, so a cached message is not fetched but an unknown one is still a 404
+        response = await supabase.table('messages').select("id").eq('id', message_id).limit(1).execute()
+        if not response.data:
+            raise HTTPException(status_code=404, detail=f"Unknown message: {message_id}")
+        cached = not_modified(request, etag, immutable=True)
+        if cached:
+            return cached
+        response = await supabase.table('messages').select("*").eq('id', message_id).limit(1).execute()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return json_response(request, response.data[0], etag, immutable=True)
 
 @app.post("/contact")
 async def handle_contact_form(contact_form: ContactForm):
     try:
-        response = supabase.table('query').insert(contact_form.dict()).execute()
+        response = await supabase.table('query').insert(contact_form.dict()).execute()
         if response.data:
             return {"message": "Form submitted successfully"}
         else:
@@ -125,29 +318,18 @@ async def handle_contact_form(contact_form: ContactForm):
 
 @app.post("/process")
 async def process_data(content: ProcessRequest):
-    print("Received data:", len(content.data), "rows")
-    print("Received dictionary:", content.dictionary)
-    
-    cleaned_data = content.data.copy()
-    
     try:
         if content.dictionary.get('aiMagic', 0) == 1:
-            print("AI Magic mode activated - applying intelligent data cleaning")
-            
-            df = pd.DataFrame(content.data)
-            
-            temp_fd, temp_path = tempfile.mkstemp(suffix=".csv")
-            os.close(temp_fd)
+            df = await workers.run(pd.DataFrame, content.data)
             
             try:
-                df.to_csv(temp_path, index=False)
-                
                 ai_instruction = content.dictionary.get('aiInstruction', '')
-                cleaned_df = cleaning.agent_cleaning(temp_path, instruction=ai_instruction)
-                cleaned_df = cleaned_df.replace({np.nan: None})
-                cleaned_data = cleaned_df.to_dict('records')
-                
-                os.unlink(temp_path)
+                file_backed = AI_CLEANING_FILE_ROWS > 0 and len(df) >= AI_CLEANING_FILE_ROWS
+                with tracing.span("cleaning.ai", rows=len(df), file_backed=file_backed) as attrs:
+                    # Mostly waiting on the model, so use the request threadpool rather than the bounded executor
+                    cleaned_df = await run_in_threadpool(cleaning.agent_cleaning, df, instruction=ai_instruction, file_backed=file_backed)
+                    cleaned_data = await workers.run(cleaning.to_records, cleaned_df)
+                    attrs["cleaned_rows"] = len(cleaned_data)
                 
                 return {
                     "status": "success", 
@@ -159,9 +341,8 @@ async def process_data(content: ProcessRequest):
                 }
             except Exception as e:
                 print(f"AI Magic error: {e}")
-                if os.path.exists(temp_path):
-                    os.unlink(temp_path)
-                cleaned_data = apply_ai_magic(content.data)
+                with tracing.span("cleaning.fallback", rows=len(content.data)):
+                    cleaned_data = await workers.run(apply_ai_magic, content.data)
                 return {
                     "status": "success", 
                     "message": f"AI Magic processed {len(cleaned_data)} rows (fallback mode)",
@@ -171,42 +352,9 @@ async def process_data(content: ProcessRequest):
                     "ai_magic_applied": True
                 }
         
-        if content.dictionary.get('removeDuplicates', 0) == 1:
-            seen = set()
-            unique_data = []
-            for row in cleaned_data:
-                row_tuple = tuple(sorted(row.items()))
-                if row_tuple not in seen:
-                    seen.add(row_tuple)
-                    unique_data.append(row)
-            cleaned_data = unique_data
-            print(f"Removed {len(content.data) - len(cleaned_data)} duplicate rows")
-        
-        if content.dictionary.get('handleMissing', 0) == 1:
-            missing_strategy = content.dictionary.get('missingStrategy', 'fill')
-            if missing_strategy == 'remove':
-                cleaned_data = [row for row in cleaned_data if not has_missing_values(row)]
-                print(f"Removed rows with missing values. Remaining: {len(cleaned_data)} rows")
-            else:
-                for row in cleaned_data:
-                    for key, value in row.items():
-                        if value is None or value == '' or (isinstance(value, str) and value.strip() == ''):
-                            row[key] = '0'
-                print("Filled missing values with '0'")
-
-        if content.dictionary.get('standardizeFormats', 0) == 1:
-            for row in cleaned_data:
-                for key, value in row.items():
-                    if isinstance(value, str):
-                        row[key] = value.strip().title()
-            print("Standardized text formats")
-
-        if content.dictionary.get('removeOutliers', 0) == 1:
-            print("Outlier removal selected (basic implementation)")
-        
-        final_df = pd.DataFrame(cleaned_data)
-        final_df = final_df.replace({np.nan: None})
-        final_cleaned_data = final_df.to_dict('records')
+        with tracing.span("cleaning.manual", rows=len(content.data)) as attrs:
+            final_cleaned_data = await workers.run(cleaning.manual_cleaning, content.data, content.dictionary)
+            attrs["cleaned_rows"] = len(final_cleaned_data)
         return {
             "status": "success", 
             "message": f"Processed {len(final_cleaned_data)} rows",
@@ -218,16 +366,44 @@ async def process_data(content: ProcessRequest):
         print(f"Error processing data: {e}")
         return {"status": "error", "message": str(e)}
 
-def has_missing_values(row):
-    """Check if a row has any missing values"""
-    for value in row.values():
-        if value is None or value == '' or (isinstance(value, str) and value.strip() == ''):
-            return True
-    return False
+@app.post("/process/stream")
+def process_stream(file: UploadFile = File(...), dictionary: str = Form("{}"),
+                   c_id: str | None = Form(None), output: str = Form("ndjson")):
+    """Clean a CSV/NDJSON upload chunk by chunk with bounded memory.
+
+    output="ndjson" streams the cleaned rows back as NDJSON, output="dataset"
+    stores them as the chat's registered dataset and returns its handle.
+    """
+    try:
+        options = json.loads(dictionary)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid dictionary: {e}")
+    if options.get('aiMagic', 0) == 1:
+        raise HTTPException(status_code=400, detail="AI Magic is not available in streaming mode")
+    name = (file.filename or "").lower()
+    fmt = "csv" if name.endswith(".csv") or file.content_type == "text/csv" else "ndjson"
+    chunks = cleaning.stream_cleaning(file.file, fmt, options)
+
+    if output == "dataset":
+        if not c_id:
+            raise HTTPException(status_code=400, detail="c_id is required when output is 'dataset'")
+        try:
+            dataset_id, rows = datastore.register_chunks(c_id, chunks)
+        except Exception as e:
+            print(f"Error processing stream: {e}")
+            return {"status": "error", "message": str(e)}
+        return {"status": "success", "message": f"Processed {rows} rows",
+                "dataset_id": dataset_id, "cleaned_count": rows}
+
+    def ndjson_lines():
+        for chunk in chunks:
+            for record in cleaning.to_records(chunk.infer_objects()):
+                yield json.dumps(record, default=str) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
 
 def apply_ai_magic(data):
     """Apply intelligent AI-powered data cleaning"""
-    print("Applying AI Magic...")
     if not data:
         return data
     
@@ -269,121 +445,274 @@ def apply_ai_magic(data):
             seen.add(row_tuple)
             unique_data.append(row)
     
-    print(f"AI Magic: Removed {len(cleaned_data) - len(unique_data)} duplicate rows")
     return unique_data
 
+@app.post("/datasets", status_code=status.HTTP_201_CREATED)
+async def upload_dataset(request: DatasetRequest):
+    try:
+        df = await workers.run(pd.DataFrame, request.data)
+        dataset_id = await workers.run(datastore.register, request.c_id, df)
+        return {"dataset_id": dataset_id, "rows": df.shape[0], "columns": list(df.columns)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error storing dataset: {e}")
+
+def load_dataframe(rows, dataset_id):
+    """Resolve the request dataset from a registered handle or inline rows"""
+    if dataset_id:
+        try:
+            return datastore.load(dataset_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Unknown dataset_id: {dataset_id}")
+    if rows is None:
+        raise HTTPException(status_code=400, detail="Either dataset_id or df must be provided")
+    return pd.DataFrame(rows)
+
 @app.post("/query")
 async def check_query(request: QueryRequest):
+    df = await workers.run(load_dataframe, request.df, request.dataset_id)
     try:
-        result = querycheck.handle_query(request.query, pd.DataFrame(request.df))
+        result = querycheck.handle_query(request.query, df)
         return {"status": "success", "result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/analytics")
-async def generate_graph(request: TextRequest):
+async def rename_chat(c_id, name):
     try:
-        df = pd.DataFrame(request.df)
-        query = request.query
-        c_id = request.c_id
-        user_id = request.user_id
-
-        # checking if the chat have a message if not will update the chat name
-        messages_response = supabase.table('messages').select('id').eq('c_id', c_id).limit(1).execute()
-        if not messages_response.data:
-            if request.filename:
-                supabase.table('Chat').update({'name': request.filename}).eq('c_id', c_id).execute()
-
-        # fetching last 5 messages for context
-        history_response = supabase.table('messages').select("*").eq('c_id', c_id).order('created_at', desc=True).limit(5).execute()
-        raw_history = history_response.data
-        raw_history.reverse() # Reverses to have the oldest message first
-        
-        chat_history = []
-        for message in raw_history:
-            user_msg = message.get('user_message')
-            response_data = message.get('response')
-            
-            # Simple summarization for token efficiency
-            if user_msg:
-                chat_history.append({"role": "user", "content": user_msg})
-                
-            if response_data and isinstance(response_data, dict):
-                response_type = response_data.get('type')
-                response_content = response_data.get('data')
-                
-                ai_msg = ""
-                if response_type == 'text':
-                    # Truncate long text answers
-                    text_content = str(response_content)
-                    ai_msg = text_content[:200] + "..." if len(text_content) > 200 else text_content
-                elif response_type == 'plot':
-                    # For a plot, extract the title or a generic description
-                    plot_title = None
-                    if isinstance(response_content, dict) and "layout" in response_content and "title" in response_content["layout"]:
-                        title_obj = response_content["layout"]["title"]
-                        plot_title = title_obj.get("text") if isinstance(title_obj, dict) else title_obj
-                    
-                    ai_msg = f"Generated a plot (type: {response_type}): {plot_title or 'No title available'}"
-                
-                if ai_msg:
-                    chat_history.append({"role": "assistant", "content": ai_msg})
+        with tracing.span("db.rename_chat"):
+            await supabase.table('Chat').update({'name': name}).eq('c_id', c_id).execute()
+    except Exception as e:
+        print(f"Error renaming chat {c_id}: {e}")
+
+async def store_message(insert_data):
+    try:
+        # Plot responses are stored as the same JSON that was sent to the client
+        insert_data["response"] = await workers.run(figures.plain, insert_data["response"])
+        with tracing.span("db.insert_message"):
+            response = await supabase.table('messages').insert(insert_data).execute()
+        message_id = response.data[0].get("id") if response.data else None
+        memory.record(insert_data["c_id"], insert_data["user_message"], insert_data["response"], message_id)
+    except Exception as e:
+        print(f"Error storing message for chat {insert_data.get('c_id')}: {e}")
 
-        # checking for chat history
-        print(f"Passing history with {len(chat_history)} messages for context.")
+@app.get("/classifier/stats")
+async def classifier_stats():
+    return querycheck.stats()
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return resultcache.stats()
 
+@app.get("/memory/stats")
+async def memory_stats():
+    return memory.stats()
 
-        is_graph = querycheck.pool(query,chat_history)
-        
-        response_data = None
-        if is_graph == "yes":
-            fig = None
-            error_feedback = None
-            max_retries = 3
-
-            for attempt in range(max_retries):
-                try:
-                    
-                    print(f"Graph generation attempt {attempt + 1}")
-                    graph_code = graphgen.visualize(df, query, error_feedback=error_feedback, chat_history=chat_history)
-                    
-                    exec_globals = {'pd': pd, 'df': df, 'go': None, 'px': None, 'fig': None}
-                    exec(graph_code, exec_globals)
-                    fig = exec_globals.get('fig')
-                    
-                    if fig:
-                        print("Graph generated successfully.")
-                        break 
-                    else:
-                        raise ValueError("Error occured during generation.")
-
-                except Exception as e:
-                    print(f"Attempt {attempt + 1} failed: {e}")
-                    error_feedback = str(e)
-                    if attempt == max_retries - 1:
-                        response_data = {"type": "text", "data": "I'm sorry, I was unable to generate a valid visualization for your request."}
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: request and stage latency histograms, token, retry and event counters"""
+    return PlainTextResponse(tracing.metrics(), media_type="text/plain; version=0.0.4")
+
+async def answer_graph(df, query, chat_history, graph_code=None):
+    """Generate and render a chart, retrying with the error as feedback.
+
+    graph_code, when given, is tried first (see planner.plan). Returns the
+    response and the code that produced it, or None for the code when no
+    valid chart could be generated.
+    """
+    async for event in answer_graph_stream(df, query, chat_history, graph_code):
+        if event["event"] == "answer":
+            return event["response"], event["code"]
+
+async def answer_graph_stream(df, query, chat_history, graph_code=None):
+    """Like answer_graph(), but yield progress events while the chart is made.
+
+    Yields {"event": "code"} for every attempt, {"event": "retry"} with the
+    error when an attempt fails and another follows, {"event": "executed"}
+    once a chart has rendered, and finally {"event": "answer"} with the
+    response and the code.
+    """
+    response_data = None
+    code = None
+    rendered = None
+    error_feedback = None
+    max_retries = 3
+    cube = await workers.run(cubes.for_frame, df)
+
+    for attempt in range(max_retries):
+        if attempt:
+            tracing.RETRIES.inc("graph")
+        try:
             
-            if fig:
-                response_data = {"type": "plot", "data": json.loads(fig.to_json())}
+            if attempt or graph_code is None:
+                graph_code = await graphgen.visualize(df, query, error_feedback=error_feedback, chat_history=chat_history)
+            # Bad names are repaired here, broken code goes straight back to the model
+            graph_code = codecheck.repair(graph_code, df, cube)
+            yield {"event": "code", "engine": "pandas", "code": graph_code}
+            rendered = await sandbox.run("graph", graph_code, df, cube)
             
+            if rendered:
+                break 
+            else:
+                raise ValueError("Error occured during generation.")
+
+        except Exception as e:
+            print(f"Attempt {attempt + 1} failed: {e}")
+            error_feedback = str(e)
+            if attempt == max_retries - 1:
+                response_data = {"type": "text", "data": "I'm sorry, I was unable to generate a valid visualization for your request."}
+            else:
+                yield {"event": "retry", "attempt": attempt + 1, "error": error_feedback}
+    
+    if rendered:
+        figure, reduced = rendered
+        tracing.payload("figure", len(figure.text))
+        response_data = {"type": "plot", "data": figure}
+        if reduced:
+            # Traces too dense to send whole, see figures.reduce
+            response_data["meta"] = {"reduced": reduced}
+        code = graph_code
+        yield {"event": "executed", "reduced": reduced or []}
+
+    yield {"event": "answer", "response": response_data, "code": code}
+
+async def route_query(df, query, chat_history, engine=None):
+    """Return ("yes" | "no", code), "yes" meaning a chart.
+
+    In combined mode one model call also writes the code, otherwise code is
+    None and is written once the route is known.
+    """
+    if planner.ANALYTICS_MODE == "combined" and texanswer.choose_engine(df, engine) == "pandas":
+        try:
+            return await planner.plan(df, query, chat_history)
+        except ValueError as e:
+            print(f"Planner failed, routing separately: {e}")
+    return await querycheck.pool(query,chat_history), None
+
+async def answer_query(df, query, chat_history, engine=None):
+    """Route a question to a chart or a text answer.
+
+    Returns the response and the code that produced it, or None for the
+    code when no valid answer could be generated.
+    """
+    is_graph, code = await route_query(df, query, chat_history, engine)
+    
+    if is_graph == "yes":
+        return await answer_graph(df, query, chat_history, code)
+
+    text_answer, code = await texanswer.analyze(df,query,chat_history,engine,code)
+    return {"type": "text", "data": text_answer}, code
+
+async def prepare_analytics(request, background_tasks):
+    """Load the dataset and the chat history of an /analytics request"""
+    dataset_id = request.dataset_id
+    if dataset_id is None and request.df is None:
+        dataset_id = datastore.handle_for(request.c_id)
+
+    # The history usually comes from memory; when the chat has to be loaded, do it alongside the dataset
+    df, chat_history = await asyncio.gather(
+        tracing.traced("dataset.load", workers.run(load_dataframe, request.df, dataset_id)),
+        memory.history(supabase, request.c_id),
+    )
+
+    # An empty history means this is the chat's first message, name the chat after the file
+    if not chat_history and request.filename:
+        background_tasks.add_task(rename_chat, request.c_id, request.filename)
+
+    return df, chat_history
+
+def queue_message(request, response_data, background_tasks):
+    insert_data = {
+        "user_message": request.query,
+        "response": response_data,
+        "c_id": request.c_id
+    }
+    if request.user_id:
+        insert_data["user_id"] = request.user_id
+    # Stored after the response has been sent
+    background_tasks.add_task(store_message, insert_data)
+
+@app.post("/analytics")
+async def generate_graph(request: TextRequest, background_tasks: BackgroundTasks):
+    try:
+        query = request.query
+        df, chat_history = await prepare_analytics(request, background_tasks)
+
+        fingerprint = await workers.run(profiling.fingerprint, df)
+        schema = resultcache.schema_of(df)
+        cached = resultcache.lookup(fingerprint, schema, query)
+        if cached is not None:
+            tracing.event("result_cache_hit")
+            response_data = cached["response"]
         else:
-            text_answer = texanswer.analyze(df,query,chat_history)
-            response_data = {"type": "text", "data": text_answer}
+            response_data, code = await answer_query(df, query, chat_history, request.engine)
+            if code is not None:
+                resultcache.store(fingerprint, schema, query, code, response_data)
 
-        insert_data = {
-            "user_message": query,
-            "response": response_data,
-            "c_id": c_id
-        }
-        if user_id:
-            insert_data["user_id"] = user_id
-        supabase.table('messages').insert(insert_data).execute()
+        queue_message(request, response_data, background_tasks)
 
-        return response_data
+        # Plot figures are already JSON, send them without encoding them again
+        return Response(figures.dumps(response_data), media_type="application/json")
             
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+@app.post("/analytics/stream")
+async def stream_analytics(request: TextRequest, background_tasks: BackgroundTasks):
+    """Streaming variant of /analytics, one JSON event per line.
+
+    Events are "classified", then "code" and "executed" for the code that
+    answers the question, with a "retry" after each failed chart attempt,
+    a "token" per piece of a text answer as the model writes it, and
+    finally "response" with the same fields as the /analytics body.
+    Failures after the stream has started end it with an "error" event.
+    The message is stored once the stream has finished.
+    """
+    try:
+        df, chat_history = await prepare_analytics(request, background_tasks)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+    def line(event):
+        return figures.dumps(event) + "\n"
+
+    async def events():
+        query = request.query
+        try:
+            fingerprint = await workers.run(profiling.fingerprint, df)
+            schema = resultcache.schema_of(df)
+            cached = resultcache.lookup(fingerprint, schema, query)
+            if cached is not None:
+                tracing.event("result_cache_hit")
+                response_data, code = cached["response"], None
+                yield line({"event": "classified", "type": response_data["type"], "cached": True})
+            else:
+                is_graph, code = await route_query(df, query, chat_history, request.engine)
+                yield line({"event": "classified", "type": "plot" if is_graph == "yes" else "text"})
+                if is_graph == "yes":
+                    async for event in answer_graph_stream(df, query, chat_history, code):
+                        if event["event"] == "answer":
+                            response_data, code = event["response"], event["code"]
+                        else:
+                            yield line(event)
+                else:
+                    async for event in texanswer.analyze_stream(df, query, chat_history, request.engine, code):
+                        if event["event"] == "answer":
+                            response_data, code = {"type": "text", "data": event["data"]}, event["code"]
+                        else:
+                            yield line(event)
+                if code is not None:
+                    resultcache.store(fingerprint, schema, query, code, response_data)
+            # Background tasks added before the stream ends still run after it
+            queue_message(request, response_data, background_tasks)
+            yield line({"event": "response", **response_data})
+        except Exception as e:
+            print(f"Streaming answer failed: {e}")
+            yield line({"event": "error", "detail": str(e)})
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
     
 class GraphCreate(BaseModel):
     c_id: str      
@@ -398,9 +727,8 @@ class GraphRecord(BaseModel):
     name: str | None = None
 
 @app.post("/graphs", status_code=status.HTTP_201_CREATED)
-def save_graph(graph_data: GraphCreate):
+async def save_graph(graph_data: GraphCreate):
     try:
-        print(f"Saving graph for chat ID: {graph_data.c_id}")
         fig_dict = graph_data.graph_json
 
         graph_title = None  
@@ -413,16 +741,15 @@ def save_graph(graph_data: GraphCreate):
             
             fig_dict["layout"]["title"] = None
 
-        fig = go.Figure(fig_dict)
-        
         data_to_insert = {
             "chat_id": graph_data.c_id,
-            "graph_data": json.loads(fig.to_json()),
+            "graph_data": await workers.run(figures.compact, fig_dict),
             "userid": graph_data.user_id,
             "name": graph_title
         }
 
-        response = supabase.table("graphs").insert(data_to_insert).execute()
+        with tracing.span("db.insert_graph"):
+            response = await supabase.table("graphs").insert(data_to_insert).execute()
 
         if len(response.data) == 0:
             raise HTTPException(
@@ -431,8 +758,6 @@ def save_graph(graph_data: GraphCreate):
             )
         
         new_graph_record = response.data[0]
-        
-        print(f"Successfully saved graph with ID: {new_graph_record['id']}")
 
         return {
             "id": new_graph_record['id'],
@@ -448,16 +773,42 @@ def save_graph(graph_data: GraphCreate):
         )
     
 @app.get("/graphs/{user_id}", response_model=List[GraphRecord])
-def get_saved_graphs(user_id: str):
+async def get_saved_graphs(user_id: str, request: Request):
     try:
-        response = supabase.table("graphs").select("*").eq("userid", user_id).execute()
-        print(f"Found {len(response.data)} graphs for user ID: {user_id}")
-        print(response.data)
-        return response.data
+        response = await supabase.table("graphs").select(GRAPH_RECORD_COLUMNS).eq("userid", user_id).execute()
+        return json_response(request, response.data)
 
     except Exception as e:
         print(f"An error occurred while fetching graphs: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@app.get("/graphs/{user_id}/page")
+async def get_saved_graphs_page(user_id: str, request: Request, before: int | None = None,
+                                limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    """A page of a user's saved graphs (id, chat, name, creation time) with ids below `before`"""
+    try:
+        query = supabase.table("graphs").select(GRAPH_COLUMNS).eq("userid", user_id)
+        if before is not None:
+            query = query.lt("id", before)
+        response = await query.order("id", desc=True).limit(limit).execute()
+        return json_response(request, page(response.data, "id", limit))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/graph/{graph_id}", response_model=GraphRecord)
+async def get_saved_graph(graph_id: int, request: Request):
+    """A saved graph with its figure. Saved graphs never change."""
+    etag = f'"graph-{graph_id}"'
+    cached = not_modified(request, etag, immutable=True)
+    if cached:
+        return cached
+    try:
+        response = await supabase.table("graphs").select(GRAPH_RECORD_COLUMNS).eq("id", graph_id).limit(1).execute()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not response.data:
+        raise HTTPException(status_code=404, detail=f"Unknown graph: {graph_id}")
+    return json_response(request, response.data[0], etag, immutable=True)
@@ -0,0 +1,5 @@
+"""Entry point kept for `python benchmark.py <command>`; the benchmarks live in benchmarks/."""
+from benchmarks.__main__ import main
+
+if __name__ == "__main__":
+    main()
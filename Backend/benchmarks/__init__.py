@@ -0,0 +1,21 @@
+"""Offline benchmarks for the backend pipelines, one module per area.
+
+Usage:
+    python -m benchmarks process --rows 10000 100000 1000000
+    python -m benchmarks stream --rows 1000000
+    python -m benchmarks llm --calls 50
+    python -m benchmarks analytics --concurrency 1 8 32 --llm-latency 0.5 [--stream]
+    python -m benchmarks classifier
+    python -m benchmarks sandbox --rows 1000000 --runaway 0.1
+    python -m benchmarks figures --points 10000 100000 1000000
+    python -m benchmarks cubes --rows 1000000
+    python -m benchmarks engines --rows 100000 1000000
+    python -m benchmarks results --rows 1000000
+    python -m benchmarks listings --chats 300 --messages 20
+    python -m benchmarks memory --turns 200 --plot-kb 200
+    python -m benchmarks planner --requests 40 --llm-latency 0.4
+    python -m benchmarks codecheck --rows 1000000 --llm-latency 2
+    python -m benchmarks tracing --spans 100000 --requests 200
+    python -m benchmarks startup --runs 5 --budget 1.5
+    python -m benchmarks load --rows 1000 100000 1000000 --concurrency 1 8 32 [--output load.json] [--baseline load.json]
+"""
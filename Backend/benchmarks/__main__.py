@@ -0,0 +1,19 @@
+import argparse
+
+import benchmarks
+from benchmarks import execution, models, payloads, processing, service
+
+AREAS = [processing, models, execution, payloads, service]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=benchmarks.__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for area in AREAS:
+        area.register(sub)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Synthetic data, timing helpers and the in-process fake service shared by the benchmarks."""
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+import fakes
+import llm
+import figures
+
+
+def synthetic_records(rows, seed=0):
+    rng = random.Random(seed)
+    names = [" alice ", "BOB", "carol smith", "", "   ", None, "dave"]
+    cities = ["new york", "  paris", "LONDON ", None, "tokyo"]
+    records = []
+    for i in range(rows):
+        records.append({
+            "id": i % (rows // 2 or 1),
+            "name": rng.choice(names),
+            "city": rng.choice(cities),
+            "amount": rng.choice([rng.randint(0, 1000), rng.random() * 100, None]),
+            "active": rng.choice([True, False, None]),
+        })
+    return records
+
+
+def synthetic_sales(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "order_id": np.arange(rows),
+        "region": rng.choice(["north", "south", "east", "west"], rows),
+        "product": rng.choice([f"product {i}" for i in range(40)], rows),
+        "channel": rng.choice(["web", "store", "phone", None], rows),
+        "ordered": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 3 * 365 * 86400, rows), unit="s"),
+        "quantity": rng.integers(1, 20, rows),
+        "sales": np.where(rng.random(rows) < 0.02, np.nan, rng.gamma(2.0, 50.0, rows)),
+    })
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def fake_analytics_backends(llm_latency, db_latency, input_token_latency=0.0, output_token_latency=0.0):
+    """Point app at an in-memory Supabase and canned model responses.
+
+    Model calls take llm_latency seconds plus the per-token latencies, see fakes.FakeChatModel.
+    """
+    os.environ.setdefault("SUPABASE_URL", "http://localhost")
+    os.environ.setdefault("SUPABASE_KEY", "offline")
+    import app
+
+    app.supabase = fakes.FakeSupabase(latency=db_latency)
+    graph_code = "import plotly.express as px\nfig = px.histogram(df, x='city', y='amount')"
+    query_code = "result = df['amount'].mean()"
+    latencies = (llm_latency, input_token_latency, output_token_latency)
+    llm.use_fake("classifier", lambda prompt: "yes" if "User query: plot" in prompt else "no", *latencies)
+    llm.use_fake("graph", graph_code, *latencies)
+    llm.use_fake("analysis", lambda prompt: query_code if "Analytica-AI" in prompt
+                 else "The average amount is about 170.", *latencies)
+    llm.use_fake("planner", lambda prompt: json.dumps(
+        {"route": "plot", "code": graph_code} if "User Query:** plot" in prompt
+        else {"route": "text", "code": query_code}), *latencies)
+    return app
+
+
+async def asgi_request(asgi_app, method, path, payload=None, headers=()):
+    """Call an ASGI app directly and return status, headers, body and first/last byte times.
+
+    httpx's ASGI transport buffers the whole body, which hides streaming.
+    """
+    path, _, query_string = path.partition("?")
+    body = json.dumps(payload).encode() if payload is not None else b""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query_string.encode(),
+             "root_path": "", "headers": [(b"content-type", b"application/json"),
+                                          (b"content-length", str(len(body)).encode()),
+                                          *[(k.lower().encode(), v.encode()) for k, v in headers]],
+             "client": ("bench", 0), "server": ("bench", 80)}
+    start = time.perf_counter()
+    reply = {"body": b""}
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.Event().wait()
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            reply["status"] = message["status"]
+            reply["headers"] = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            if message.get("body"):
+                reply.setdefault("first", time.perf_counter() - start)
+                reply["body"] += message["body"]
+            if not message.get("more_body"):
+                reply["last"] = time.perf_counter() - start
+
+    await asgi_app(scope, receive, send)
+    reply.setdefault("first", reply["last"])
+    return reply
+
+
+async def drive(app, payloads, concurrency, stream=False):
+    """Post payloads to /analytics (or /analytics/stream), returning (elapsed, latencies, first byte times)"""
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    first_bytes = []
+
+    async def one(payload):
+        async with limit:
+            reply = await asgi_request(app.app, "POST", "/analytics/stream" if stream else "/analytics", payload)
+            if reply["status"] != 200:
+                raise RuntimeError(f"/analytics returned {reply['status']}")
+            first_bytes.append(reply["first"])
+            latencies.append(reply["last"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(payload) for payload in payloads))
+    return time.perf_counter() - start, latencies, first_bytes
+
+
+def seed_listings(db, user_id, chats, messages, plot_kb):
+    """Fill a fake database with chats whose messages alternate text and plot answers"""
+    import plotly.express as px
+
+    points = max(plot_kb * 1024 // 40, 10)
+    rng = np.random.default_rng(0)
+    figure = figures.plain({"data": figures.encode(px.scatter(x=rng.random(points), y=rng.random(points)))[0]})["data"]
+    for c in range(chats):
+        chat = db.new_row("Chat", {"name": f"chat {c}", "userid": user_id})
+        db.tables.setdefault("Chat", []).append(chat)
+        for m in range(messages):
+            response = {"type": "plot", "data": figure} if m % 2 else {"type": "text", "data": f"Answer {m}"}
+            db.tables.setdefault("messages", []).append(
+                db.new_row("messages", {"c_id": chat["c_id"], "user_message": f"question {m}", "response": response}))
+        db.tables.setdefault("graphs", []).append(
+            db.new_row("graphs", {"chat_id": chat["c_id"], "userid": user_id, "name": f"graph {c}", "graph_data": figure}))
+    return db.tables["Chat"][-1]["c_id"]
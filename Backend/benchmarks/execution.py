@@ -0,0 +1,181 @@
+"""Benchmarks of running generated code: the sandbox, rollups, SQL and the code check."""
+import asyncio
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+
+import cleaning
+import codecheck
+import cubes
+import sandbox
+from benchmarks.common import synthetic_records, synthetic_sales, timed
+
+
+SANDBOX_SNIPPET = "result = df.groupby('city')['amount'].mean()"
+
+
+def bench_sandbox(args):
+    """Overhead of the worker-process sandbox and its throughput when some snippets never finish"""
+    df = cleaning.clean_frame(pd.DataFrame(synthetic_records(args.rows)), {})
+    df["amount"] = pd.to_numeric(df["amount"], errors="coerce")
+    _, inline = timed(sandbox.query_task, SANDBOX_SNIPPET, df)
+    _, started = timed(sandbox.start)
+    _, first = timed(sandbox.execute, "query", SANDBOX_SNIPPET, df)
+    _, warm = timed(sandbox.execute, "query", SANDBOX_SNIPPET, df)
+    print(f"{args.rows} rows  in-process {inline * 1000:.1f} ms  pool start {started:.2f}s  "
+          f"sandbox first run {first * 1000:.1f} ms  warm {warm * 1000:.1f} ms")
+
+    async def batch():
+        async def one(i):
+            runaway = args.runaway > 0 and i % round(1 / args.runaway) == 0
+            code = "while True: pass" if runaway else SANDBOX_SNIPPET
+            try:
+                await sandbox.run("query", code, df, timeout=args.timeout)
+                return "ok"
+            except TimeoutError:
+                return "timeout"
+        return await asyncio.gather(*(one(i) for i in range(args.runs)))
+
+    replaced = sandbox._pool.replaced
+    results, elapsed = timed(asyncio.run, batch())
+    print(f"{args.runs} runs ({args.runaway:.0%} runaway, {args.timeout:g}s limit)  {elapsed:.2f}s  "
+          f"{results.count('ok') / elapsed:.1f} good runs/s  timeouts {results.count('timeout')}  "
+          f"workers replaced {sandbox._pool.replaced - replaced}")
+    sandbox.stop()
+
+
+# The same questions answered from raw rows and from the rollups
+CUBE_SNIPPETS = [
+    ("sum by region", "result = df.groupby('region')['sales'].sum()",
+     "result = cube.aggregate('region', 'sales', 'sum')"),
+    ("mean by region, product", "result = df.groupby(['region', 'product'])['sales'].mean()",
+     "result = cube.aggregate(['region', 'product'], 'sales', 'mean')"),
+    ("count by month", "result = df.groupby(df['ordered'].dt.to_period('M').dt.start_time).size()",
+     "result = cube.aggregate('ordered_month', func='size')"),
+    ("max quantity by channel", "result = df.groupby('channel')['quantity'].max()",
+     "result = cube.aggregate('channel', 'quantity', 'max')"),
+]
+
+
+def bench_cubes(args):
+    """Cube build time at registration and group-by answers from raw rows versus the rollups"""
+    df = synthetic_sales(args.rows)
+    cube, built = timed(cubes.build, df)
+    print(f"{args.rows} rows  cube build {built:.2f}s  {len(cube.tables)} tables  "
+          f"{sum(table.memory_usage().sum() for table in cube.tables.values()) / 1e6:.2f} MB")
+    def run(code, cube=None):
+        # query_task without compacting the result, so the values can be compared
+        env = {"pd": pd, "df": df, "cube": cube.bind(df) if cube is not None else None}
+        exec(code, env)
+        return env["result"]
+
+    for name, raw_code, cube_code in CUBE_SNIPPETS:
+        raw, raw_time = timed(run, raw_code)
+        answer, cube_time = timed(run, cube_code, cube)
+        same = np.allclose(pd.Series(raw).sort_index().astype(float), pd.Series(answer).sort_index().astype(float))
+        print(f"{name:<24} rows {raw_time * 1000:8.2f} ms   cube {cube_time * 1000:8.3f} ms   "
+              f"{raw_time / cube_time:7.0f}x  {'same result' if same else 'DIFFERENT RESULT'}")
+    if args.sandbox:
+        sandbox.start()
+        for name, raw_code, cube_code in CUBE_SNIPPETS:
+            sandbox.execute("query", raw_code, df)
+            _, raw_time = timed(sandbox.execute, "query", raw_code, df)
+            _, cube_time = timed(sandbox.execute, "query", cube_code, df, cube)
+            print(f"{name:<24} sandboxed rows {raw_time * 1000:8.2f} ms   cube {cube_time * 1000:8.2f} ms")
+        sandbox.stop()
+
+
+# Text-answer snippets for the pandas engine and their DuckDB SQL equivalents
+ENGINE_SNIPPETS = [
+    ("total sales", "result = df['sales'].sum()", 'SELECT SUM("sales") FROM df'),
+    ("mean by region, product", "result = df.groupby(['region', 'product'])['sales'].mean().reset_index()",
+     'SELECT "region", "product", AVG("sales") AS "sales" FROM df GROUP BY ALL ORDER BY ALL'),
+    ("top 5 orders", "result = df.nlargest(5, 'sales')[['order_id', 'sales']].reset_index(drop=True)",
+     'SELECT "order_id", "sales" FROM df ORDER BY "sales" DESC LIMIT 5'),
+    ("distinct products per channel", "result = df.groupby('channel')['product'].nunique()",
+     'SELECT "channel", COUNT(DISTINCT "product") FROM df WHERE "channel" IS NOT NULL GROUP BY 1 ORDER BY 1'),
+    ("monthly quantity in 2023",
+     "result = df[df['ordered'].dt.year == 2023].groupby(df['ordered'].dt.month)['quantity'].sum()",
+     'SELECT month("ordered"), SUM("quantity") FROM df WHERE year("ordered") = 2023 GROUP BY 1 ORDER BY 1'),
+]
+
+
+def bench_engines(args):
+    """Text-answer execution time with the pandas engine versus DuckDB SQL"""
+    if sandbox.duckdb is None:
+        raise SystemExit("duckdb is not installed")
+    for rows in args.rows:
+        df = synthetic_sales(rows)
+        for name, pandas_code, sql_code in ENGINE_SNIPPETS:
+            sandbox.sql_task(sql_code, df)
+            _, pandas_time = timed(sandbox.query_task, pandas_code, df)
+            _, sql_time = timed(sandbox.sql_task, sql_code, df)
+            print(f"{rows:>8} rows  {name:<30} pandas {pandas_time * 1000:8.1f} ms   "
+                  f"sql {sql_time * 1000:8.1f} ms  {pandas_time / sql_time:5.1f}x")
+
+
+# Typical mistakes in generated code on synthetic_sales, and whether they can be repaired locally
+BROKEN_SNIPPETS = [
+    ("misspelled column", "graph", "import plotly.express as px\nfig = px.bar(df, x='Region', y='salse')"),
+    ("misspelled argument", "graph", "import plotly.express as px\nfig = px.histogram(df, x='region', colour='channel')"),
+    ("misspelled function", "graph", "import plotly.express as px\nfig = px.histgram(df, x='product')"),
+    ("grouped column typo", "query", "result = df.groupby('prodcut')['sales'].sum().nlargest(5)"),
+    ("wrong method late", "query", "result = df.groupby('product')['sales'].sum().sort_values().top(5)"),
+    ("missing column", "query", "result = df['profit'].mean()"),
+    ("forbidden call", "query", "import os\nresult = os.listdir('.')"),
+]
+
+
+def bench_codecheck(args):
+    """Time and model retries spent on broken generated code, with and without the local check"""
+    df = synthetic_sales(args.rows)
+    cube = cubes.build(df)
+
+    def attempt(task, code, check, dry_run):
+        sandbox.DRY_RUN_ROWS = sandbox.DRY_RUN_ROWS if dry_run else 0
+        try:
+            if check:
+                code = codecheck.check(code, df.columns, cube)[0]
+            sandbox.execute(task, code, df, cube)
+            return "ran"
+        except Exception as e:
+            return f"retry ({type(e).__name__})"
+
+    dry_run_rows = sandbox.DRY_RUN_ROWS
+    sandbox.start()
+    for name, task, code in BROKEN_SNIPPETS:
+        line = f"{name:<20}"
+        for label, check, dry_run in [("unchecked", False, False), ("checked", True, True)]:
+            sandbox.DRY_RUN_ROWS = dry_run_rows
+            with contextlib.redirect_stdout(io.StringIO()):
+                outcome, seconds = timed(attempt, task, code, check, dry_run)
+            # A retry costs another code generation call
+            total = seconds + (args.llm_latency if outcome != "ran" else 0)
+            line += f"   {label} {outcome:<24} {seconds * 1000:8.1f} ms, {total:5.2f} s with retries"
+        print(line)
+    sandbox.DRY_RUN_ROWS = dry_run_rows
+
+
+def register(sub):
+    sandbox_parser = sub.add_parser("sandbox", help="generated-code sandbox overhead and runaway isolation")
+    sandbox_parser.add_argument("--rows", type=int, default=100_000)
+    sandbox_parser.add_argument("--runs", type=int, default=100)
+    sandbox_parser.add_argument("--runaway", type=float, default=0.1, help="fraction of snippets that loop forever")
+    sandbox_parser.add_argument("--timeout", type=float, default=1.0)
+    sandbox_parser.set_defaults(func=bench_sandbox)
+
+    cubes_parser = sub.add_parser("cubes", help="pre-aggregated rollups versus group-by on raw rows")
+    cubes_parser.add_argument("--rows", type=int, default=1_000_000)
+    cubes_parser.add_argument("--sandbox", action="store_true", help="also time both through the worker pool")
+    cubes_parser.set_defaults(func=bench_cubes)
+
+    engines_parser = sub.add_parser("engines", help="pandas versus DuckDB SQL for text answers")
+    engines_parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    engines_parser.set_defaults(func=bench_engines)
+
+    codecheck_parser = sub.add_parser("codecheck", help="broken generated code with and without the local check")
+    codecheck_parser.add_argument("--rows", type=int, default=1_000_000)
+    codecheck_parser.add_argument("--llm-latency", type=float, default=2.0, help="seconds per code generation retry")
+    codecheck_parser.set_defaults(func=bench_codecheck)
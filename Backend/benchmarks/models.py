@@ -0,0 +1,146 @@
+"""Benchmarks of model calls: client pooling, local routing and the combined planner."""
+import asyncio
+import contextlib
+import io
+import time
+
+import pandas as pd
+
+import fakes
+import llm
+import querycheck
+import sandbox
+from benchmarks.common import synthetic_records, percentile, fake_analytics_backends, drive
+
+
+def bench_llm(args):
+    """Client construction overhead per call versus the shared pool.
+
+    Both sides answer through the same fake model, so only the cost of
+    building clients and prompts differs.
+    """
+    from langchain.prompts import PromptTemplate
+    from langchain_groq import ChatGroq
+
+    fake = fakes.FakeChatModel(respond=lambda prompt: "yes", latency=args.latency)
+    inputs = {"query": "plot sales by region", "chat_history": "No prior conversation."}
+
+    def per_call():
+        ChatGroq(model="llama-3.3-70b-versatile", temperature=0, max_tokens=5, groq_api_key="offline")
+        prompt = PromptTemplate(input_variables=["query", "chat_history"], template=querycheck.POOL_PROMPT.template)
+        return (prompt | fake).invoke(inputs).content
+
+    llm.use_client("classifier", fake)
+
+    def pooled():
+        return llm.invoke("classifier", querycheck.POOL_PROMPT, inputs)
+
+    for label, fn in (("per-call clients", per_call), ("shared pool", pooled)):
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            fn()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<17} {args.calls} calls  {elapsed:8.3f}s  {elapsed / args.calls * 1000:8.2f} ms/call")
+
+
+# Labeled queries for the local classifier tiers; "yes" means a chart is expected
+LABELED_QUERIES = [
+    ("plot sales by region", "yes"),
+    ("show me a bar chart of revenue per month", "yes"),
+    ("distribution of age", "yes"),
+    ("trend over time of monthly orders", "yes"),
+    ("visualize the correlation between price and rating", "yes"),
+    ("histogram of fare", "yes"),
+    ("scatter plot of height vs weight", "yes"),
+    ("make it a pie chart instead", "yes"),
+    ("compare monthly sales across regions", "yes"),
+    ("what is the relationship between age and income trend", "yes"),
+    ("breakdown of customers by country share", "yes"),
+    ("how does revenue grow over the years", "yes"),
+    ("sales trends by quarter", "yes"),
+    ("show the growth pattern of subscribers", "yes"),
+    ("how many rows are there", "no"),
+    ("what is the average price", "no"),
+    ("hello", "no"),
+    ("what can you do", "no"),
+    ("how many passengers survived", "no"),
+    ("what is the total revenue in 2023", "no"),
+    ("list all the columns", "no"),
+    ("which columns have missing values", "no"),
+    ("who is the top customer by revenue", "no"),
+    ("what was the maximum fare", "no"),
+    ("summarize the dataset", "no"),
+    ("describe the columns and their types", "no"),
+    ("count the number of unique cities", "no"),
+    ("thanks!", "no"),
+    ("what is the median age of survivors", "no"),
+    ("is there any null in the email column", "no"),
+    ("now do the same for 2022", None),
+    ("sales by region", None),
+]
+
+
+def bench_classifier(args):
+    """Coverage, accuracy and latency of the local tiers on the labeled query set"""
+    answered = correct = 0
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        results = [querycheck.classify_local(query) for query, _ in LABELED_QUERIES]
+    elapsed = time.perf_counter() - start
+    for (query, label), (answer, tier) in zip(LABELED_QUERIES, results):
+        if answer is not None:
+            answered += 1
+            correct += answer == label
+        elif args.verbose:
+            print(f"  -> llm    {query}")
+        if args.verbose and answer is not None and answer != label:
+            print(f"  WRONG {tier:<6} {query} -> {answer}")
+    per_query = elapsed / (args.repeat * len(LABELED_QUERIES)) * 1e6
+    print(f"{len(LABELED_QUERIES)} queries  answered locally {answered} ({answered / len(LABELED_QUERIES):.0%})  "
+          f"accuracy {correct}/{answered}  {per_query:.1f} us/query")
+
+
+def bench_planner(args):
+    """Model calls and latency per question with separate routing versus one combined call"""
+    app = fake_analytics_backends(args.llm_latency, 0, args.input_token_ms / 1000, args.output_token_ms / 1000)
+    import datastore
+    import planner
+    import resultcache
+    import texanswer
+
+    resultcache.RESULT_CACHE_MB = 0
+    sandbox.start()
+    dataset_id = datastore.register("bench", pd.DataFrame(synthetic_records(args.rows)))
+    # Half of the questions are ambiguous enough to need the model classifier in split mode
+    queries = ["plot amount by city", "what is the average amount", "plot amount for each city", "amount per city"]
+    models = [client for client in llm._clients.values() if isinstance(client, fakes.FakeChatModel)]
+    for mode, local in [("split", False), ("split", True), ("combined", False), ("combined", True)]:
+        planner.ANALYTICS_MODE, texanswer.LOCAL_ANSWERS = mode, local
+        payloads = [{"query": queries[i % len(queries)], "dataset_id": dataset_id, "c_id": f"chat-{i}"}
+                    for i in range(args.requests)]
+        calls = sum(model.calls for model in models)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, latencies, _ = asyncio.run(drive(app, payloads, 1))
+        calls = (sum(model.calls for model in models) - calls) / args.requests
+        print(f"{mode:<9} local answers {'on ' if local else 'off'}  {calls:4.2f} model calls/question  "
+              f"p50 {percentile(latencies, 50) * 1000:7.1f} ms  p95 {percentile(latencies, 95) * 1000:7.1f} ms")
+
+
+def register(sub):
+    llm_parser = sub.add_parser("llm", help="per-call LLM client construction versus the shared pool")
+    llm_parser.add_argument("--calls", type=int, default=50)
+    llm_parser.add_argument("--latency", type=float, default=0.0, help="simulated model latency in seconds")
+    llm_parser.set_defaults(func=bench_llm)
+
+    classifier = sub.add_parser("classifier", help="local classifier tiers on a labeled query set")
+    classifier.add_argument("--repeat", type=int, default=1000)
+    classifier.add_argument("--verbose", action="store_true")
+    classifier.set_defaults(func=bench_classifier)
+
+    planner_parser = sub.add_parser("planner", help="separate routing and code calls versus one combined call")
+    planner_parser.add_argument("--requests", type=int, default=40)
+    planner_parser.add_argument("--rows", type=int, default=10_000)
+    planner_parser.add_argument("--llm-latency", type=float, default=0.4, help="seconds per fake model call")
+    planner_parser.add_argument("--input-token-ms", type=float, default=0.01, help="fake cost per prompt token")
+    planner_parser.add_argument("--output-token-ms", type=float, default=5, help="fake cost per response token")
+    planner_parser.set_defaults(func=bench_planner)
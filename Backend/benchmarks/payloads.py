@@ -0,0 +1,94 @@
+"""Benchmarks of payload sizes: plot encoding and query results in prompts."""
+import json
+
+import numpy as np
+import pandas as pd
+
+import figures
+import results
+from benchmarks.common import synthetic_sales, timed
+
+
+def legacy_figure_pipeline(fig):
+    """Plot answer handling before compact encoding: response, message row and saved graph"""
+    import plotly.graph_objects as go
+    from fastapi.encoders import jsonable_encoder
+
+    data = json.loads(fig.to_json())
+    body = json.dumps(jsonable_encoder({"type": "plot", "data": data}))
+    json.dumps({"response": {"type": "plot", "data": data}})
+    client = json.loads(body)["data"]
+    json.dumps({"graph_data": json.loads(go.Figure(client).to_json())})
+    return body
+
+
+def figure_pipeline(fig, max_points):
+    figure, reduced = figures.encode(fig, max_points)
+    response = {"type": "plot", "data": figure}
+    if reduced:
+        response["meta"] = {"reduced": reduced}
+    body = figures.dumps(response)
+    json.dumps({"response": figures.plain(response)})
+    client = json.loads(body)["data"]
+    json.dumps({"graph_data": figures.compact(client)})
+    return body, reduced
+
+
+def bench_figures(args):
+    """Payload size and handling time of plot answers, legacy JSON versus compact encoding"""
+    import plotly.express as px
+
+    for points in args.points:
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            "x": rng.random(points),
+            "y": np.where(rng.random(points) < 0.01, np.nan, rng.normal(size=points)),
+            "when": pd.date_range("2020-01-01", periods=points, freq="min"),
+            "group": rng.choice(["a", "b", "c"], points),
+        })
+        for name, fig in [("scatter", px.scatter(df, x="x", y="y", color="group")),
+                          ("line", px.line(df, x="when", y="y"))]:
+            legacy, legacy_time = timed(legacy_figure_pipeline, fig)
+            (compact, reduced), compact_time = timed(figure_pipeline, fig, args.max_points)
+            kept = sum(trace["kept"] for trace in reduced) if reduced else points
+            print(f"{points:>8} points {name:<8} legacy {len(legacy) / 1e6:7.2f} MB {legacy_time * 1000:8.1f} ms   "
+                  f"compact {len(compact) / 1e6:7.2f} MB {compact_time * 1000:8.1f} ms  ({kept} points sent)")
+
+
+# Generated snippets whose results range from one value to most of the dataset
+RESULT_SNIPPETS = [
+    ("scalar", "result = df['sales'].mean()"),
+    ("grouped series", "result = df.groupby('region')['sales'].sum()"),
+    ("top 20 rows", "result = df.nlargest(20, 'sales')"),
+    ("filtered rows", "result = df[df['sales'] > 100]"),
+    ("long series", "result = df.set_index('order_id')['sales']"),
+]
+
+
+def bench_results(args):
+    """Size and preparation time of query results for the interpretation prompt, whole versus compacted"""
+    df = synthetic_sales(args.rows)
+    for name, code in RESULT_SNIPPETS:
+        local_env = {"pd": pd, "df": df}
+        exec(code, local_env)
+        value = local_env["result"]
+
+        def legacy():
+            return str(value.replace({np.nan: None}).to_dict() if hasattr(value, "to_dict") else value)
+
+        whole, whole_time = timed(legacy)
+        compacted, compact_time = timed(lambda: str(results.compact(value)))
+        print(f"{name:<16} whole {results.estimate_tokens(whole):>10} tokens {whole_time * 1000:9.1f} ms   "
+              f"compacted {results.estimate_tokens(compacted):>6} tokens {compact_time * 1000:7.1f} ms")
+
+
+def register(sub):
+    figures_parser = sub.add_parser("figures", help="plot payload size and encoding time")
+    figures_parser.add_argument("--points", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    figures_parser.add_argument("--max-points", type=int, default=figures.FIGURE_MAX_POINTS,
+                                help="downsample denser traces to this many points (0 = off)")
+    figures_parser.set_defaults(func=bench_figures)
+
+    results_parser = sub.add_parser("results", help="query result size in the interpretation prompt")
+    results_parser.add_argument("--rows", type=int, default=1_000_000)
+    results_parser.set_defaults(func=bench_results)
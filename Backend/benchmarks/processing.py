@@ -0,0 +1,110 @@
+"""Benchmarks of /process: manual cleaning and chunked streaming."""
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import cleaning
+from benchmarks.common import synthetic_records, timed, peak_rss_mb
+
+
+def legacy_process(data, options):
+    """Row-by-row implementation /process used before the columnar path"""
+    def is_blank(value):
+        return value is None or value == '' or (isinstance(value, str) and value.strip() == '')
+
+    cleaned_data = [row.copy() for row in data]
+    if options.get('removeDuplicates', 0) == 1:
+        seen = set()
+        unique_data = []
+        for row in cleaned_data:
+            row_tuple = tuple(sorted(row.items()))
+            if row_tuple not in seen:
+                seen.add(row_tuple)
+                unique_data.append(row)
+        cleaned_data = unique_data
+    if options.get('handleMissing', 0) == 1:
+        if options.get('missingStrategy', 'fill') == 'remove':
+            cleaned_data = [row for row in cleaned_data if not any(is_blank(v) for v in row.values())]
+        else:
+            for row in cleaned_data:
+                for key, value in row.items():
+                    if is_blank(value):
+                        row[key] = '0'
+    if options.get('standardizeFormats', 0) == 1:
+        for row in cleaned_data:
+            for key, value in row.items():
+                if isinstance(value, str):
+                    row[key] = value.strip().title()
+    final_df = pd.DataFrame(cleaned_data)
+    return final_df.replace({np.nan: None}).to_dict('records')
+
+
+# Records the frontend can send that a plain table does not have: list and dict
+# cells, and keys missing from some records
+EDGE_RECORDS = [
+    {"name": " alice ", "tags": ["a", "b"], "meta": {"k": 1}},
+    {"name": "", "tags": [], "meta": None},
+    {"name": "bob"},
+    {"name": "bob", "tags": None},
+    {"name": "bob"},
+    {"tags": ["a", "b"], "meta": "  "},
+]
+
+
+def bench_process(args):
+    options = {"removeDuplicates": 1, "handleMissing": 1, "standardizeFormats": 1,
+               "missingStrategy": args.strategy}
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Legacy fails on lists and dicts when hashing rows for duplicates
+        edge = [legacy_process(EDGE_RECORDS, {**options, "removeDuplicates": 0}) ==
+                cleaning.manual_cleaning(EDGE_RECORDS, {**options, "removeDuplicates": 0}),
+                legacy_process(EDGE_RECORDS[2:5], options) == cleaning.manual_cleaning(EDGE_RECORDS[2:5], options)]
+    print(f"edge cases (lists, dicts, missing keys)  {'match' if all(edge) else 'MISMATCH'}")
+    for rows in args.rows:
+        data = synthetic_records(rows)
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy, legacy_time = timed(legacy_process, data, options)
+            fast, fast_time = timed(cleaning.manual_cleaning, data, options)
+        same = "match" if legacy == fast else "MISMATCH"
+        print(f"{rows:>9} rows  legacy {legacy_time:8.3f}s  columnar {fast_time:8.3f}s  "
+              f"speedup {legacy_time / fast_time:5.1f}x  {same}")
+
+
+def bench_stream(args):
+    options = {"removeDuplicates": 1, "handleMissing": 1, "standardizeFormats": 1}
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        # Write the file in slices so generating it does not set the peak
+        step = 100_000
+        for start in range(0, args.rows, step):
+            pd.DataFrame(synthetic_records(min(step, args.rows - start), seed=start)).to_csv(
+                path, mode="a", header=start == 0, index=False)
+        baseline = peak_rss_mb()
+        rows = 0
+        start = time.perf_counter()
+        with open(path, "rb") as f, contextlib.redirect_stdout(io.StringIO()):
+            for chunk in cleaning.stream_cleaning(f, "csv", options, chunksize=args.chunksize):
+                rows += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"{args.rows:>9} rows in  {rows:>9} rows out  {elapsed:8.3f}s  "
+              f"peak RSS {peak_rss_mb():8.1f} MB (before {baseline:.1f} MB)")
+    finally:
+        os.unlink(path)
+
+
+def register(sub):
+    process = sub.add_parser("process", help="manual cleaning options of /process")
+    process.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    process.add_argument("--strategy", choices=["fill", "remove"], default="fill")
+    process.set_defaults(func=bench_process)
+
+    stream = sub.add_parser("stream", help="chunked CSV cleaning of /process/stream, one size per run")
+    stream.add_argument("--rows", type=int, default=1_000_000)
+    stream.add_argument("--chunksize", type=int, default=50_000)
+    stream.set_defaults(func=bench_stream)
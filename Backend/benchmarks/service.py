@@ -0,0 +1,365 @@
+"""Benchmarks of the HTTP service against fake backends: load, listings, memory, tracing and cold start."""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+import fakes
+import memory
+import sandbox
+import tracing
+from benchmarks.common import (
+    synthetic_records, timed, peak_rss_mb, percentile, fake_analytics_backends, asgi_request, drive, seed_listings,
+)
+
+
+def bench_analytics(args):
+    """Throughput of /analytics against stubbed LLM and DB backends at several concurrency levels"""
+    app = fake_analytics_backends(args.llm_latency, args.db_latency)
+    import datastore
+    import resultcache
+
+    if not args.result_cache:
+        # Repeated queries would otherwise be answered from the cache
+        resultcache.RESULT_CACHE_MB = 0
+    # Done by the app's startup event, which the ASGI transport does not run
+    sandbox.start()
+
+    dataset_id = datastore.register("bench", pd.DataFrame(synthetic_records(args.rows)))
+    queries = ["plot amount by city", "what is the average amount"]
+    for concurrency in args.concurrency:
+        payloads = [{"query": queries[i % 2], "dataset_id": dataset_id, "c_id": f"chat-{i % 16}"}
+                    for i in range(args.requests)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, latencies, first_bytes = asyncio.run(drive(app, payloads, concurrency, args.stream))
+        print(f"concurrency {concurrency:>4}  {args.requests} requests  {elapsed:8.3f}s  "
+              f"{args.requests / elapsed:7.1f} req/s  p50 {percentile(latencies, 50) * 1000:7.1f} ms  "
+              f"p95 {percentile(latencies, 95) * 1000:7.1f} ms  "
+              f"first byte p50 {percentile(first_bytes, 50) * 1000:7.1f} ms")
+
+
+def bench_tracing(args):
+    """Cost of a span, and /analytics latency with tracing on and off"""
+    def spans():
+        for _ in range(args.spans):
+            with tracing.span("bench") as attrs:
+                attrs["rows"] = 1
+
+    tracing.TRACING = True
+    _, elapsed = timed(spans)
+    print(f"span          {elapsed / args.spans * 1e6:7.2f} us each")
+
+    app = fake_analytics_backends(0, 0)
+    import datastore
+    import resultcache
+
+    resultcache.RESULT_CACHE_MB = 0
+    sandbox.start()
+    dataset_id = datastore.register("bench", pd.DataFrame(synthetic_records(1000)))
+    payloads = [{"query": "what is the average amount", "dataset_id": dataset_id, "c_id": "chat"}] * args.requests
+    for enabled in (False, True, False, True):
+        tracing.TRACING = enabled
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, latencies, _ = asyncio.run(drive(app, payloads, 1))
+        print(f"tracing {'on ' if enabled else 'off'}   /analytics p50 {percentile(latencies, 50) * 1000:7.2f} ms  "
+              f"p95 {percentile(latencies, 95) * 1000:7.2f} ms")
+
+
+def bench_listings(args):
+    """Sidebar, chat and dashboard listings, whole tables versus pages with lazy figures and ETags"""
+
+    app = fake_analytics_backends(0, 0)
+    app.supabase = fakes.FakeSupabase(latency=args.db_latency, bandwidth=args.bandwidth * 1e6)
+    chat_id = seed_listings(app.supabase, "bench-user", args.chats, args.messages, args.plot_kb)
+
+    async def fetch(path, etag=None):
+        reply = await asgi_request(app.app, "GET", path, headers=[("If-None-Match", etag)] if etag else ())
+        if reply["status"] not in (200, 304):
+            raise RuntimeError(f"{path} returned {reply['status']}: {reply['body'][:200]}")
+        return reply
+
+    async def run():
+        rows = []
+        for name, legacy, paged in [
+            ("chats", "/chats/bench-user", "/chats/bench-user/page"),
+            ("messages", f"/chat/{chat_id}/messages", f"/chat/{chat_id}/messages/page"),
+            ("graphs", "/graphs/bench-user", "/graphs/bench-user/page"),
+        ]:
+            whole = await fetch(legacy)
+            first = await fetch(paged)
+            again = await fetch(paged, first["headers"]["etag"])
+            rows.append((name, whole, first, again))
+        items = json.loads((await fetch("/graphs/bench-user/page"))["body"])["items"]
+        figure = await fetch(f"/graph/{items[0]['id']}")
+        revalidated = await fetch(f"/graph/{items[0]['id']}", figure["headers"]["etag"])
+        return rows, figure, revalidated
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows, figure, revalidated = asyncio.run(run())
+    for name, whole, first, again in rows:
+        print(f"{name:<9} whole {len(whole['body']) / 1e6:8.2f} MB {whole['last'] * 1000:8.1f} ms   "
+              f"page {len(first['body']) / 1e3:8.1f} KB {first['last'] * 1000:6.1f} ms   "
+              f"unchanged page {again['status']} {again['last'] * 1000:5.1f} ms")
+    print(f"one figure {len(figure['body']) / 1e3:.1f} KB {figure['last'] * 1000:.1f} ms   "
+          f"revalidated {revalidated['status']} {revalidated['last'] * 1000:.2f} ms")
+
+
+def bench_memory(args):
+    """Chat history per turn: last messages with their figures versus the conversation memory"""
+
+    db = fakes.FakeSupabase(latency=args.db_latency, bandwidth=args.bandwidth * 1e6)
+    chat_id = seed_listings(db, "bench-user", 1, args.messages, args.plot_kb)
+
+    async def legacy():
+        response = await db.table('messages').select("*").eq('c_id', chat_id) \
+            .order('created_at', desc=True).limit(memory.HISTORY_MESSAGES).execute()
+        history = []
+        for message in reversed(response.data):
+            answer = message["response"]
+            content = memory.plot_title(answer["data"]) if answer["type"] == "plot" else answer["data"]
+            history.extend(memory.condense(message["user_message"], answer["type"], content))
+        return history
+
+    async def run():
+        timings = {"fetch last messages": [], "memory miss": [], "memory hit": [], "hit, single worker": []}
+        for _ in range(args.turns):
+            start = time.perf_counter()
+            expected = await legacy()
+            timings["fetch last messages"].append(time.perf_counter() - start)
+            memory._chats.pop(chat_id, None)
+            start = time.perf_counter()
+            missed = await memory.history(db, chat_id)
+            timings["memory miss"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            hit = await memory.history(db, chat_id)
+            timings["memory hit"].append(time.perf_counter() - start)
+            memory.CHAT_MEMORY_CHECK, checked = False, memory.CHAT_MEMORY_CHECK
+            start = time.perf_counter()
+            unchecked = await memory.history(db, chat_id)
+            timings["hit, single worker"].append(time.perf_counter() - start)
+            memory.CHAT_MEMORY_CHECK = checked
+            if not expected == missed == hit == unchecked:
+                raise RuntimeError("memory history differs from the stored messages")
+        return timings
+
+    for name, values in asyncio.run(run()).items():
+        print(f"{name:<20} p50 {percentile(values, 50) * 1000:8.2f} ms   p95 {percentile(values, 95) * 1000:8.2f} ms")
+
+
+LOAD_ENDPOINTS = ["process", "analytics", "graphs", "chats"]
+
+
+async def run_load(asgi_app, calls, concurrency):
+    """Send (method, path, payload) calls, returning (elapsed, latencies, failed requests)"""
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    failed = 0
+
+    async def one(method, path, payload):
+        nonlocal failed
+        async with limit:
+            reply = await asgi_request(asgi_app, method, path, payload)
+            if reply["status"] >= 400 or b'"status":"error"' in reply["body"][:200]:
+                failed += 1
+            latencies.append(reply["last"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(*call) for call in calls))
+    return time.perf_counter() - start, latencies, failed
+
+
+def load_calls(endpoint, requests, dataset_id, records, chat_id, figure):
+    """The requests a load run sends to one endpoint"""
+    queries = ["plot amount by city", "what is the average amount"]
+    options = {"removeDuplicates": 1, "handleMissing": 1, "standardizeFormats": 1}
+    calls = []
+    for i in range(requests):
+        if endpoint == "process":
+            calls.append(("POST", "/process", {"data": records, "dictionary": options, "c_id": f"chat-{i}"}))
+        elif endpoint == "analytics":
+            calls.append(("POST", "/analytics", {"query": queries[i % 2], "dataset_id": dataset_id,
+                                                 "c_id": f"chat-{i % 16}"}))
+        elif endpoint == "graphs":
+            # Saving a graph and reading the dashboard alternate
+            calls.append(("POST", "/graphs", {"c_id": chat_id, "graph_json": figure, "user_id": "bench-user"})
+                         if i % 2 else ("GET", "/graphs/bench-user/page", None))
+        elif endpoint == "chats":
+            calls.append(("GET", "/chats/bench-user/page", None) if i % 2
+                         else ("GET", f"/chat/{chat_id}/messages/page", None))
+    return calls
+
+
+def bench_load(args):
+    """Latency percentiles, throughput and peak memory of the main endpoints against fake backends"""
+    import datastore
+    import resultcache
+
+    app = fake_analytics_backends(args.llm_latency, args.db_latency)
+    app.supabase = fakes.FakeSupabase(latency=args.db_latency)
+    chat_id = seed_listings(app.supabase, "bench-user", args.chats, 10, args.plot_kb)
+    figure = app.supabase.tables["graphs"][0]["graph_data"]
+    if not args.result_cache:
+        resultcache.RESULT_CACHE_MB = 0
+    sandbox.start()
+
+    measured = []
+    for rows in args.rows:
+        records = synthetic_records(rows)
+        dataset_id = datastore.register(f"bench-{rows}", pd.DataFrame(records))
+        # Posting a million records as JSON measures the client more than the server
+        process_records = records[:args.process_max_rows]
+        del records
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                calls = load_calls(endpoint, args.requests, dataset_id, process_records, chat_id, figure)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed, latencies, failed = asyncio.run(run_load(app.app, calls, concurrency))
+                result = {
+                    "endpoint": endpoint, "rows": len(process_records) if endpoint == "process" else rows,
+                    "concurrency": concurrency, "requests": len(calls), "failed": failed,
+                    "throughput": len(calls) / elapsed,
+                    **{f"p{q}_ms": percentile(latencies, q) * 1000 for q in (50, 95, 99)},
+                    "peak_rss_mb": peak_rss_mb(),
+                }
+                measured.append(result)
+                print(f"{endpoint:<10} {result['rows']:>9} rows  concurrency {concurrency:>3}  "
+                      f"{result['throughput']:8.1f} req/s  p50 {result['p50_ms']:8.1f} ms  "
+                      f"p95 {result['p95_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+                      f"failed {failed:>3}  peak RSS {result['peak_rss_mb']:7.0f} MB")
+        del process_records
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(measured, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(r["endpoint"], r["rows"], r["concurrency"]): r for r in json.load(f)}
+        regressions = []
+        for result in measured:
+            before = baseline.get((result["endpoint"], result["rows"], result["concurrency"]))
+            if before and result["p95_ms"] > before["p95_ms"] * (1 + args.tolerance):
+                regressions.append(result)
+                print(f"REGRESSION {result['endpoint']} {result['rows']} rows concurrency {result['concurrency']}: "
+                      f"p95 {before['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+        if regressions or any(result["failed"] for result in measured):
+            sys.exit(1)
+        print(f"no p95 regression beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+# Run in a fresh interpreter by bench_startup, with the fake database injected
+STARTUP_SCRIPT = """
+import asyncio, json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+import fakes
+app.supabase = fakes.FakeSupabase()
+
+async def main():
+    started = time.perf_counter() - imported
+    await app.startup_event()
+    serving = time.perf_counter() - started
+    while (await app.ready()).status_code != 200:
+        await asyncio.sleep(0.01)
+    return serving, time.perf_counter() - started
+
+serving, ready = asyncio.run(main())
+app.sandbox.stop()
+print(json.dumps({"import": imported, "serving": serving, "ready": ready}))
+"""
+
+
+def bench_startup(args):
+    """Cold start of a worker: importing app, serving requests and warm-up; fails over the import budget"""
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # Placeholder keys, without them building the model clients probes for cloud credentials
+    env = {"SUPABASE_URL": "http://localhost", "SUPABASE_KEY": "offline", "GROQ_API_KEY": "offline",
+           "google_api_key": "offline", "GOOGLE_MODEL_NAME": "gemini-2.5-flash", **os.environ, "TRACE_LOG": "0"}
+
+    def child(*flags):
+        done = subprocess.run([sys.executable, *flags, "-c", STARTUP_SCRIPT], cwd=backend, env=env,
+                              capture_output=True, text=True, check=True)
+        return json.loads(done.stdout.strip().splitlines()[-1]), done.stderr
+
+    runs = [child()[0] for _ in range(args.runs)]
+    for stage in ("import", "serving", "ready"):
+        values = [run[stage] for run in runs]
+        print(f"{stage:<8} median {percentile(values, 50) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+
+    # The direct imports of app that cost the most, cumulative
+    _, importtime = child("-X", "importtime")
+    modules = []
+    for line in importtime.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == "app":
+            break
+        if len(parts) == 3 and parts[2].startswith("   ") and not parts[2].startswith("     "):
+            modules.append((int(parts[1]), parts[2].strip()))
+    for micros, name in sorted(modules, reverse=True)[:args.top]:
+        print(f"  {name:<24} {micros / 1000:8.1f} ms")
+
+    imported = percentile([run["import"] for run in runs], 50)
+    if args.budget and imported > args.budget:
+        print(f"import app takes {imported:.2f}s, over the {args.budget:.2f}s budget")
+        sys.exit(1)
+
+
+def register(sub):
+    analytics = sub.add_parser("analytics", help="/analytics load test with fake LLM and Supabase")
+    analytics.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    analytics.add_argument("--requests", type=int, default=64)
+    analytics.add_argument("--rows", type=int, default=10_000)
+    analytics.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake model call")
+    analytics.add_argument("--db-latency", type=float, default=0.02, help="seconds per fake DB round-trip")
+    analytics.add_argument("--result-cache", action="store_true", help="answer repeated queries from the result cache")
+    analytics.add_argument("--stream", action="store_true", help="use the streaming /analytics/stream endpoint")
+    analytics.set_defaults(func=bench_analytics)
+
+    tracing_parser = sub.add_parser("tracing", help="overhead of per-request tracing and metrics")
+    tracing_parser.add_argument("--spans", type=int, default=100_000)
+    tracing_parser.add_argument("--requests", type=int, default=200)
+    tracing_parser.set_defaults(func=bench_tracing)
+
+    listings = sub.add_parser("listings", help="chat, message and graph listings against a fake PostgREST")
+    listings.add_argument("--chats", type=int, default=300)
+    listings.add_argument("--messages", type=int, default=20, help="messages per chat, every other one a plot")
+    listings.add_argument("--plot-kb", type=int, default=50, help="approximate size of each stored figure")
+    listings.add_argument("--db-latency", type=float, default=0.02, help="seconds per fake DB round-trip")
+    listings.add_argument("--bandwidth", type=float, default=50, help="fake DB throughput in MB/s")
+    listings.set_defaults(func=bench_listings)
+
+    memory_parser = sub.add_parser("memory", help="chat history from the database versus the conversation memory")
+    memory_parser.add_argument("--turns", type=int, default=200)
+    memory_parser.add_argument("--messages", type=int, default=20, help="messages in the chat, every other one a plot")
+    memory_parser.add_argument("--plot-kb", type=int, default=200, help="approximate size of each stored figure")
+    memory_parser.add_argument("--db-latency", type=float, default=0.02, help="seconds per fake DB round-trip")
+    memory_parser.add_argument("--bandwidth", type=float, default=50, help="fake DB throughput in MB/s")
+    memory_parser.set_defaults(func=bench_memory)
+
+    load = sub.add_parser("load", help="p50/p95/p99, throughput and peak RSS of the main endpoints, offline")
+    load.add_argument("--endpoints", nargs="+", choices=LOAD_ENDPOINTS, default=LOAD_ENDPOINTS)
+    load.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    load.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    load.add_argument("--requests", type=int, default=64, help="requests per endpoint, size and concurrency")
+    load.add_argument("--process-max-rows", type=int, default=100_000, help="largest payload posted to /process")
+    load.add_argument("--chats", type=int, default=50, help="seeded chats of 10 messages each")
+    load.add_argument("--plot-kb", type=int, default=50, help="approximate size of each stored figure")
+    load.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake model call")
+    load.add_argument("--db-latency", type=float, default=0.02, help="seconds per fake DB round-trip")
+    load.add_argument("--result-cache", action="store_true", help="answer repeated queries from the result cache")
+    load.add_argument("--output", help="write the results as JSON, e.g. to use as a baseline")
+    load.add_argument("--baseline", help="exit with status 1 when p95 grows beyond the tolerance of these results")
+    load.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 growth over the baseline, 0.2 = 20%%")
+    load.set_defaults(func=bench_load)
+
+    startup = sub.add_parser("startup", help="import time and time to readiness of a fresh worker")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--top", type=int, default=8, help="slowest imports to list")
+    startup.add_argument("--budget", type=float, default=1.5, help="exit with status 1 when import app takes longer, in seconds")
+    startup.set_defaults(func=bench_startup)
@@ -1,11 +1,15 @@
 import pandas as pd
 import numpy as np
+import io
 import os
+import json
 import tempfile
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-import re
+import llm
+import profiling
+import sandbox
+import texanswer
+import warnings
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -28,13 +32,82 @@ def standardize_formats(df: pd.DataFrame) -> pd.DataFrame:
             pass
     return df
 
-# 4. Remove Outliers (z-score method)
-def remove_outliers(df: pd.DataFrame) -> pd.DataFrame:
-    numeric_cols = df.select_dtypes(include=[np.number]).columns
-    for col in numeric_cols:
-        z_scores = (df[col] - df[col].mean()) / df[col].std()
-        df = df[(z_scores.abs() < 3)]
-    return df
+# 4. Remove Outliers (z-score, IQR or robust MAD)
+OUTLIER_METHODS = {"zscore": 3.0, "iqr": 1.5, "mad": 3.5}
+
+# Share of the non-blank cells of a text column that must parse as numbers for
+# it to be treated as numeric. CSV uploads send every cell as a string.
+NUMERIC_SHARE = 0.9
+
+def _as_numeric(series: pd.Series):
+    """Float values of a mostly-numeric object column, unparseable cells as NaN, or None"""
+    kind = pd.api.types.infer_dtype(series, skipna=True)
+    if kind in ("boolean", "empty"):
+        return None
+    if kind in ("integer", "floating", "mixed-integer-float"):
+        return series.to_numpy(dtype=float, na_value=np.nan)
+    # Most text columns are rejected on a sample without parsing every cell
+    sample = series.dropna().head(1000)
+    sample = sample[sample.astype(str).str.strip().ne("")]
+    if sample.empty or pd.to_numeric(sample, errors="coerce").notna().mean() < NUMERIC_SHARE:
+        return None
+    filled = series.notna() & series.astype(str).str.strip().ne("")
+    values = pd.to_numeric(series.where(filled), errors="coerce")
+    if values.notna().sum() < NUMERIC_SHARE * filled.sum():
+        return None
+    return values.to_numpy(dtype=float, na_value=np.nan)
+
+def _numeric_block(df: pd.DataFrame) -> np.ndarray:
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_numeric_dtype(series):
+            columns.append(series.to_numpy(dtype=float, na_value=np.nan))
+        elif series.dtype == object or pd.api.types.is_string_dtype(series):
+            values = _as_numeric(series)
+            if values is not None:
+                columns.append(values)
+    if not columns:
+        return np.empty((len(df), 0))
+    return np.column_stack(columns)
+
+def outlier_mask(df: pd.DataFrame, method: str = "zscore", threshold: float = None) -> np.ndarray:
+    """Boolean mask of rows to keep.
+
+    Statistics for every numeric column come from the full frame in one pass,
+    so the result does not depend on column order. Missing values and
+    constant columns never mark a row as an outlier.
+    """
+    if method not in OUTLIER_METHODS:
+        raise ValueError(f"Unknown outlier method '{method}', expected one of {list(OUTLIER_METHODS)}")
+    threshold = OUTLIER_METHODS[method] if threshold is None else float(threshold)
+    values = _numeric_block(df)
+    if values.shape[1] == 0 or values.shape[0] == 0:
+        return np.ones(len(df), dtype=bool)
+
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if method == "zscore":
+            center = np.nanmean(values, axis=0)
+            scale = np.nanstd(values, axis=0, ddof=1)
+            distance = np.abs(values - center)
+        elif method == "iqr":
+            q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+            scale = q3 - q1
+            distance = np.maximum(q1 - values, values - q3)
+        else:
+            center = np.nanmedian(values, axis=0)
+            distance = np.abs(values - center)
+            # 0.6745 makes the MAD consistent with the standard deviation
+            scale = np.nanmedian(distance, axis=0) / 0.6745
+        scale = np.where(scale > 0, scale, np.nan)
+        outliers = distance / scale > threshold
+    return ~outliers.any(axis=1)
+
+def remove_outliers(df: pd.DataFrame, method: str = "zscore", threshold: float = None) -> pd.DataFrame:
+    return df[outlier_mask(df, method, threshold)]
 
 # 5. Data Summary
 def summarize_data(df: pd.DataFrame) -> dict:
@@ -48,89 +121,255 @@ def summarize_data(df: pd.DataFrame) -> dict:
     return summary
 
 
+# Manual cleaning options from /process, applied as column operations on a
+# single frame. Values are kept as the original Python objects (dtype=object)
+# so the output matches what the row-by-row implementation produced.
+def _string_op(series: pd.Series, op):
+    # Text columns are mostly repeated labels, so run the string op once per
+    # distinct value and broadcast the result back through the codes.
+    try:
+        codes, uniques = pd.factorize(series)
+    except TypeError:
+        # Lists and dicts cannot be factorized, map every cell instead
+        try:
+            mapped = op(series.astype(object).str)
+        except AttributeError:
+            return None
+        return pd.Series(mapped.to_numpy(dtype=object), index=series.index, dtype=object)
+    if len(uniques) == 0:
+        return None
+    try:
+        mapped = op(pd.Series(uniques, dtype=object).str)
+    except AttributeError:
+        # .str refuses columns that hold no strings at all
+        return None
+    values = mapped.to_numpy(dtype=object)[codes]
+    values[codes < 0] = None
+    return pd.Series(values, index=series.index, dtype=object)
 
+def absent_mask(data: list, df: pd.DataFrame):
+    """Cells whose record had no such key, or None when every record has every column"""
+    if sum(map(len, data)) == len(df) * len(df.columns):
+        return None
+    return pd.DataFrame({col: np.fromiter((col not in row for row in data), dtype=bool, count=len(data))
+                         for col in df.columns}, index=df.index)
 
+def blank_mask(df: pd.DataFrame) -> pd.DataFrame:
+    mask = df.isna()
+    for col in df.columns:
+        stripped = _string_op(df[col], lambda s: s.strip())
+        if stripped is not None:
+            mask[col] |= stripped.eq("").to_numpy(dtype=bool)
+    return mask
 
-def agent_cleaning(file_path, instruction=None):
+def to_records(df: pd.DataFrame) -> list:
+    """Same as df.replace({np.nan: None}).to_dict('records') without per-cell boxing"""
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        columns.append(series.astype(object).where(series.notna(), None).tolist())
+    names = list(df.columns)
+    return [dict(zip(names, row)) for row in zip(*columns)]
 
+def _drop_seen(df: pd.DataFrame, seen: set) -> pd.DataFrame:
+    digests = profiling.row_digests(df)
+    keep = ~pd.Series(digests).duplicated().to_numpy()
+    keep &= np.fromiter((digest not in seen for digest in digests.tolist()), dtype=bool, count=len(digests))
+    seen.update(digests[keep].tolist())
+    return df[keep].reset_index(drop=True)
 
-    google_api_key = os.getenv("google_api_key")
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=google_api_key)
+# Stands in for keys a record did not have, so they differ from None when comparing rows
+_ABSENT = object()
 
-    # Prompt for autonomous cleaning
-    if instruction:
-        prompt = PromptTemplate(
-            input_variables=["summary", "filepath", "instruction"],
-            template="""
+def clean_frame(df: pd.DataFrame, options: dict, seen: set = None) -> pd.DataFrame:
+    """Apply the duplicate, missing value and format options to an object-dtype frame.
+
+    When `seen` is given, duplicates are tracked across calls through a set of
+    row digests so a file can be cleaned chunk by chunk.
+    """
+    return _clean_frame(df, options, seen)[0]
+
+def _clean_frame(df: pd.DataFrame, options: dict, seen: set = None, absent: pd.DataFrame = None):
+    """clean_frame() that also returns `absent` for the rows it kept.
+
+    `absent` marks the cells of records that lacked the key (see
+    absent_mask); those are left missing instead of being filled or making
+    the row count as incomplete.
+    """
+    if options.get('removeDuplicates', 0) == 1:
+        before = len(df)
+        if seen is not None:
+            df = _drop_seen(df, seen)
+        elif absent is not None:
+            keep = ~df.mask(absent, _ABSENT).duplicated().to_numpy()
+            df, absent = df[keep].reset_index(drop=True), absent[keep].reset_index(drop=True)
+        else:
+            df = df.drop_duplicates(ignore_index=True)
+        print(f"Removed {before - len(df)} duplicate rows")
+
+    if options.get('handleMissing', 0) == 1:
+        mask = blank_mask(df)
+        if absent is not None:
+            mask &= ~absent
+        if options.get('missingStrategy', 'fill') == 'remove':
+            keep = ~mask.any(axis=1).to_numpy()
+            df = df[keep].reset_index(drop=True)
+            if absent is not None:
+                absent = absent[keep].reset_index(drop=True)
+            print(f"Removed rows with missing values. Remaining: {len(df)} rows")
+        else:
+            df = df.mask(mask, '0')
+            print("Filled missing values with '0'")
+
+    if options.get('standardizeFormats', 0) == 1:
+        for col in df.columns:
+            titled = _string_op(df[col], lambda s: s.strip().str.title())
+            if titled is not None:
+                df[col] = titled.where(titled.notna(), df[col])
+        print("Standardized text formats")
+
+    return df, absent
+
+def manual_cleaning(data: list, options: dict) -> list:
+    df = pd.DataFrame(data, dtype=object)
+    df, absent = _clean_frame(df, options, absent=absent_mask(data, df))
+
+    if options.get('removeOutliers', 0) == 1:
+        method = options.get('outlierMethod', 'zscore')
+        before = len(df)
+        keep = outlier_mask(df, method, options.get('outlierThreshold'))
+        df = df[keep].reset_index(drop=True)
+        if absent is not None:
+            absent = absent[keep].reset_index(drop=True)
+        print(f"Removed {before - len(df)} outlier rows ({method})")
+
+    if absent is not None:
+        # Keys that only removed records had are dropped, as the row-by-row path did
+        df = df.loc[:, ~absent.all().to_numpy()]
+
+    return to_records(df.infer_objects())
+
+def read_chunks(file, fmt: str, chunksize: int):
+    text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    if fmt == "csv":
+        # Read every field as text so the columns hash identically in every chunk
+        return pd.read_csv(text, dtype=str, chunksize=chunksize)
+    return pd.read_json(text, lines=True, dtype=False, convert_dates=False, chunksize=chunksize)
+
+def ndjson_columns(file) -> list:
+    """Keys of every record of an NDJSON file, in order of first appearance, rewinding the file"""
+    columns = {}
+    for line in file:
+        if line.strip():
+            columns.update(dict.fromkeys(json.loads(line)))
+    file.seek(0)
+    return list(columns)
+
+def stream_cleaning(file, fmt: str, options: dict, chunksize: int = 50_000):
+    """Clean a CSV or NDJSON upload chunk by chunk, yielding cleaned frames.
+
+    Memory stays bounded by the chunk size plus one digest per distinct row.
+    Every chunk has the columns of the whole file: NDJSON keys are gathered
+    in a first pass when the file can be rewound. Outlier removal needs
+    statistics over the whole file and is not applied.
+    """
+    if options.get('removeOutliers', 0) == 1:
+        print("Outlier removal is not applied in streaming mode")
+    seen = set()
+    # SpooledTemporaryFile has no seekable() before Python 3.11, but rewinds
+    rewindable = getattr(file, "seekable", lambda: True)()
+    columns = ndjson_columns(file) if fmt != "csv" and rewindable else []
+    for chunk in read_chunks(file, fmt, chunksize):
+        columns.extend(col for col in chunk.columns if col not in columns)
+        chunk = chunk.reindex(columns=columns).astype(object)
+        yield clean_frame(chunk, options, seen)
+
+
+# How the generated code receives the dataset and hands back the result
+IN_MEMORY_IO = {
+    "source": "The dataset is already loaded as a pandas DataFrame named `df`.",
+    "load_step": "Uses the existing DataFrame `df` (do not read or write any files)",
+    "save_step": "Assigns the cleaned DataFrame to a variable named `cleaned_df`",
+}
+
+FILE_BACKED_IO = {
+    "source": "The dataset is stored as a Parquet file whose path is in the variable `input_path`.",
+    "load_step": "Loads the dataset with `pd.read_parquet(input_path)`",
+    "save_step": "Saves the cleaned dataset with `cleaned_df.to_parquet(output_path, index=False)`",
+}
+
+
+# Prompts for autonomous cleaning
+CLEANING_INSTRUCTION_PROMPT = PromptTemplate(
+    input_variables=["summary", "source", "load_step", "save_step", "instruction"],
+    template="""
         You are a data cleaning assistant.
-        The dataset is stored at {filepath}.
+        {source}
         Here is a summary of the dataset: {summary}
         The user has provided the following instruction: {instruction}
         Based on this summary and the user instruction:
         - Detect missing values, duplicates, inconsistent formats, and outliers.
         - Decide what cleaning steps are required (you choose!).
         - Write Python pandas code that:
-        1. Loads the dataset from {filepath}
+        1. {load_step}
         2. Cleans the data appropriately, taking the user instruction into account.
-        3. Saves the cleaned dataset as "output.csv" in the same directory
-        4. Prints summary stats after cleaning (rows, columns, missing counts, dtypes)
+        3. {save_step}
         Only output valid Python code.
         """
-        )
-    else:
-        prompt = PromptTemplate(
-            input_variables=["summary", "filepath"],
-            template="""
+)
+
+CLEANING_PROMPT = PromptTemplate(
+    input_variables=["summary", "source", "load_step", "save_step"],
+    template="""
         You are a data cleaning assistant.
-        The dataset is stored at {filepath}.
+        {source}
         Here is a summary of the dataset: {summary}
         Based on this summary:
         - Detect missing values, duplicates, inconsistent formats, and outliers.
         - Decide what cleaning steps are required (you choose!).
         - Write Python pandas code that:
-        1. Loads the dataset from {filepath}
+        1. {load_step}
         2. Cleans the data appropriately
-        3. Saves the cleaned dataset as "output.csv" in the same directory
-        4. Prints summary stats after cleaning (rows, columns, missing counts, dtypes)
+        3. {save_step}
         Only output valid Python code.
         """
-        )
+)
 
 
+def agent_cleaning(data, instruction=None, file_backed=False):
+    """Clean a dataset with LLM-written pandas code and return the cleaned frame.
 
-    df = pd.read_csv(file_path)
+    By default the generated code runs directly against the in-memory `df`.
+    With file_backed=True the frame is exchanged through Parquet files
+    instead. `data` may also be a path to a CSV or Parquet file.
+    """
+    if isinstance(data, pd.DataFrame):
+        df = data
+    elif str(data).endswith(".parquet"):
+        df = pd.read_parquet(data)
+    else:
+        df = pd.read_csv(data)
 
-    summary = {
-        "rows": df.shape[0],
-        "columns": df.shape[1],
-        "missing_counts": df.isnull().sum().to_dict(),
-        "duplicates": df.duplicated().sum(),
-        "dtypes": df.dtypes.astype(str).to_dict(),
-        "sample": df.head(5).replace({np.nan: None}).to_dict(orient="records")
-    }
-    print(summary)
+    summary = profiling.summarize(df, duplicates=True)
 
-    # Run LLMChain
-    chain = LLMChain(llm=llm, prompt=prompt)
+    io_parts = FILE_BACKED_IO if file_backed else IN_MEMORY_IO
     if instruction:
-        code = chain.run(summary=summary, filepath=file_path, instruction=instruction)[9:-4]
+        code = llm.invoke("cleaning", CLEANING_INSTRUCTION_PROMPT, {"summary": summary, "instruction": instruction, **io_parts})
     else:
-        code = chain.run(summary=summary, filepath=file_path)[9:-4]
-
-
-    # Temporary file for cleaned data
-    temp_fd, temp_path = tempfile.mkstemp(suffix=".csv")
-    os.close(temp_fd)
-
-    safe_code = code.replace("output.csv", temp_path)
-    safe_code = safe_code.replace("\\", "/")
-
-    safe_code = re.sub(r'["\\]([A-Z]:\[^"\\]*)["\\]', r'"\1"', safe_code)
+        code = llm.invoke("cleaning", CLEANING_PROMPT, {"summary": summary, **io_parts})
+    code = texanswer.strip_fences(code, "python")
 
-    # Execute safely
-    local_env = {"pd": pd, "input_path": file_path, "output_path": temp_path}
-    exec(safe_code, local_env)
+    if not file_backed:
+        return sandbox.execute("cleaning", code, df)
 
-    # Reload cleaned data for final summary
-    cleaned_df = pd.read_csv(temp_path)
-    return cleaned_df
\ No newline at end of file
+    input_fd, input_path = tempfile.mkstemp(suffix=".parquet")
+    output_fd, output_path = tempfile.mkstemp(suffix=".parquet")
+    os.close(input_fd)
+    os.close(output_fd)
+    try:
+        df.to_parquet(input_path, index=False)
+        sandbox.execute("cleaning", code, None, input_path, output_path)
+        return pd.read_parquet(output_path)
+    finally:
+        os.unlink(input_path)
+        os.unlink(output_path)
@@ -0,0 +1,351 @@
+import os
+import ast
+import difflib
+import inspect
+import importlib
+
+import pandas as pd
+import tracing
+from dotenv import load_dotenv
+load_dotenv()
+
+# Generated code is checked before it runs: it must parse, may not call
+# anything outside the analysis libraries, and the column names and Plotly
+# Express arguments it uses must exist. Near misses ("Reveune", "colour") are
+# repaired locally, so only genuinely broken code costs another model call.
+# CODE_CHECK=0 disables the check.
+#
+# The check catches the mistakes and misuses a model makes, it is not a
+# security boundary: Python offers too many ways to reach a function. What
+# contains generated code is the sandbox, a separate process with time,
+# memory and address space limits (see sandbox.py).
+CODE_CHECK = os.getenv("CODE_CHECK", "1") != "0"
+# How close a name must be to a column or argument to be replaced by it, 0-1
+FUZZY_CUTOFF = float(os.getenv("CODE_CHECK_CUTOFF", "0.8"))
+
+ALLOWED_IMPORTS = {"plotly", "pandas", "numpy", "math", "datetime", "statistics"}
+# Builtins generated code may not use; the same names as its own variables are fine
+FORBIDDEN_NAMES = {
+    "eval", "exec", "compile", "open", "__import__", "input", "breakpoint", "globals", "locals",
+    "vars", "exit", "quit", "help", "setattr", "delattr", "getattr", "memoryview",
+}
+# File, network and display functions of pandas, numpy and Plotly. Besides
+# these, every read_* and write_* and every to_* that is not a conversion below
+# is refused, since most of them take a path or buffer.
+FORBIDDEN_ATTRIBUTES = {
+    "show", "system", "popen", "save", "savez", "savez_compressed", "savetxt", "load", "loadtxt",
+    "genfromtxt", "fromfile", "fromregex", "tofile", "dump", "memmap", "open_memmap", "DataSource",
+    "ExcelWriter", "HDFStore",
+}
+CONVERSIONS = {
+    "to_dict", "to_list", "to_numpy", "to_frame", "to_records", "to_period", "to_timestamp", "to_datetime",
+    "to_timedelta", "to_numeric", "to_pydatetime", "to_pytimedelta", "to_series", "to_flat_index",
+    "to_offset", "to_julian_date", "to_tuples",
+}
+# Modules that pandas and numpy import themselves, e.g. pd.io.common.os, and may
+# not be reached through them
+FORBIDDEN_MODULES = {
+    "os", "sys", "subprocess", "shutil", "io", "pathlib", "socket", "builtins", "importlib", "pickle",
+    "ctypes", "tempfile", "urllib", "multiprocessing", "posix", "nt", "_io",
+}
+# Plotly Express arguments that name columns of data_frame
+COLUMN_ARGUMENTS = {
+    "x", "y", "z", "color", "size", "symbol", "facet_row", "facet_col", "hover_name", "hover_data",
+    "custom_data", "text", "names", "values", "parents", "ids", "path", "line_group", "line_dash",
+    "animation_frame", "animation_group", "error_x", "error_y", "dimensions", "lat", "lon",
+    "locations", "r", "theta", "a", "b", "c", "base", "pattern_shape",
+}
+# pandas methods whose arguments name columns, by position and keyword
+COLUMN_METHODS = {
+    "groupby": ((0,), ("by",)), "sort_values": ((0,), ("by",)), "set_index": ((0,), ("keys",)),
+    "nlargest": ((1,), ("columns",)), "nsmallest": ((1,), ("columns",)), "drop_duplicates": ((0,), ("subset",)),
+    "dropna": ((), ("subset",)), "pivot_table": ((), ("index", "columns", "values")),
+    "pivot": ((), ("index", "columns", "values")), "melt": ((), ("id_vars", "value_vars")),
+    "aggregate": ((0, 1), ("by", "column")), "drop": ((), ("columns",)),
+}
+# Methods of `df` that keep only some of its rows
+ROW_FILTERS = {"query", "head", "tail", "sample", "dropna", "drop_duplicates", "nlargest", "nsmallest", "filter"}
+
+# Columns that pandas creates, e.g. value_counts().reset_index() or agg(["sum", "mean"])
+DERIVED_COLUMNS = {"count", "index", "proportion", "size", "sum", "mean", "median", "min", "max", "std",
+                   "var", "first", "last", "nunique", "level_0", "value", "variable"}
+
+
+def _strings(node):
+    """String constants of a column argument: a name or a list of names"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node]
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return [item for item in node.elts if isinstance(item, ast.Constant) and isinstance(item.value, str)]
+    return []
+
+
+def _is_df(node):
+    return isinstance(node, ast.Name) and node.id == "df"
+
+
+def _normalize(name):
+    return "".join(name.lower().split()).replace("_", "")
+
+
+def closest(name, choices):
+    """The choice that name most likely means, or None"""
+    # Compared without case, spaces and underscores: "total sales" means "Total_Sales"
+    normalized = {_normalize(choice): choice for choice in choices}
+    match = difflib.get_close_matches(_normalize(name), list(normalized), n=1, cutoff=FUZZY_CUTOFF)
+    return normalized[match[0]] if match else None
+
+
+def _bound_names(tree):
+    """Names the snippet binds itself: variables, arguments, functions and imports"""
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.alias):
+            bound.add((node.asname or node.name).split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+    return bound
+
+
+def _references(tree):
+    """Return (columns, defined) for a parsed snippet.
+
+    columns lists the nodes that name a column of `df` itself: string
+    constants in df[...], df.method(...) column arguments and Plotly Express
+    arguments with df as data, and attributes such as df.sales. Other strings,
+    e.g. keys of a dict, are not columns. defined is the names the code
+    creates, such as new columns and aggregation outputs.
+    """
+    columns, defined = [], set(DERIVED_COLUMNS)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript):
+            names = _strings(node.slice)
+            if isinstance(node.ctx, ast.Store):
+                defined.update(name.value for name in names)
+            elif _is_df(node.value):
+                columns.extend(names)
+        elif (isinstance(node, ast.Attribute) and _is_df(node.value) and isinstance(node.ctx, ast.Load)
+              and not node.attr.startswith("_") and not hasattr(pd.DataFrame, node.attr)):
+            columns.append(node)
+        elif isinstance(node, ast.Call):
+            func = node.func
+            if not isinstance(func, ast.Attribute):
+                continue
+            for keyword in node.keywords:
+                if keyword.arg and func.attr in ("agg", "aggregate", "assign"):
+                    # Named aggregations and new columns
+                    defined.add(keyword.arg)
+                if keyword.arg in ("name", "value_name", "var_name"):
+                    defined.update(name.value for name in _strings(keyword.value))
+            if func.attr == "rename":
+                for mapping in [*node.args, *(k.value for k in node.keywords)]:
+                    if isinstance(mapping, ast.Dict):
+                        defined.update(v.value for v in mapping.values if isinstance(v, ast.Constant))
+            if isinstance(func.value, ast.Name) and func.value.id == "px":
+                data = node.args[0] if node.args else next(
+                    (k.value for k in node.keywords if k.arg == "data_frame"), None)
+                if _is_df(data):
+                    for keyword in node.keywords:
+                        if keyword.arg in COLUMN_ARGUMENTS:
+                            columns.extend(_strings(keyword.value))
+            elif func.attr in COLUMN_METHODS and _is_df(func.value):
+                positions, keywords = COLUMN_METHODS[func.attr]
+                for position in positions:
+                    if position < len(node.args):
+                        columns.extend(_strings(node.args[position]))
+                for keyword in node.keywords:
+                    if keyword.arg in keywords:
+                        columns.extend(_strings(keyword.value))
+    return columns, defined
+
+
+def _filters_rows(tree):
+    """Whether the code reassigns `df` or selects some of its rows"""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "df" and isinstance(node.ctx, ast.Store):
+            return True
+        if isinstance(node, ast.Subscript) and _is_df(node.value) and not _strings(node.slice):
+            # df[mask] rather than df['column'] or df[['a', 'b']]
+            return True
+        if isinstance(node, ast.Attribute) and _is_df(node.value) and (
+                node.attr in ("loc", "iloc") or node.attr in ROW_FILTERS):
+            return True
+    return False
+
+
+def _uses_cube(tree):
+    return any(isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "cube"
+               for node in ast.walk(tree))
+
+
+def _forbidden_attribute(name):
+    return (name.startswith("__") or name in FORBIDDEN_ATTRIBUTES or name in FORBIDDEN_MODULES
+            or name.startswith(("read_", "write_")) or (name.startswith("to_") and name not in CONVERSIONS))
+
+
+def _forbidden_object(value):
+    """Whether value is a module outside the analysis libraries or a function of one of FORBIDDEN_MODULES"""
+    if inspect.ismodule(value):
+        # px.colors lives in _plotly_utils
+        return value.__name__.split(".")[0] not in ALLOWED_IMPORTS | {"_plotly_utils"}
+    module = getattr(value, "__module__", None)
+    return isinstance(module, str) and module.split(".")[0] in FORBIDDEN_MODULES
+
+
+def _imported(tree):
+    """Objects the snippet's names refer to: pd and np as in the sandbox, and its imports"""
+    import numpy as np
+
+    objects = {"pd": pd, "np": np}
+    for node in ast.walk(tree):
+        try:
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    top = alias.name.split(".")[0]
+                    objects[alias.asname or top] = importlib.import_module(alias.name if alias.asname else top)
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                module = importlib.import_module(node.module)
+                for alias in node.names:
+                    value = getattr(module, alias.name, None)
+                    if value is None:
+                        value = importlib.import_module(f"{node.module}.{alias.name}")
+                    objects[alias.asname or alias.name] = value
+        except ImportError:
+            # The run reports it
+            continue
+    return objects
+
+
+def _resolve(node, objects):
+    """The object an attribute chain such as pd.io.common refers to, or None"""
+    if isinstance(node, ast.Name):
+        return objects.get(node.id)
+    if isinstance(node, ast.Attribute):
+        value = _resolve(node.value, objects)
+        if value is not None:
+            try:
+                return getattr(value, node.attr, None)
+            except Exception:
+                return None
+    return None
+
+
+def _check_calls(tree, fixes):
+    """Reject forbidden imports and calls, repair misspelled Plotly Express functions and arguments"""
+    import plotly.express as px
+
+    bound = _bound_names(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module or ""]
+            names = modules if isinstance(node, ast.Import) else [f"{node.module}.{alias.name}" for alias in node.names]
+            for module in modules:
+                if module.split(".")[0] not in ALLOWED_IMPORTS:
+                    raise ValueError(f"Importing '{module}' is not allowed, use only pandas, numpy and plotly")
+            for name in names:
+                if any(_forbidden_attribute(part) for part in name.split(".")):
+                    raise ValueError(f"Importing '{name}' is not allowed in generated code")
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and (
+                node.id.startswith("__") or node.id in FORBIDDEN_NAMES and node.id not in bound):
+            raise ValueError(f"Using '{node.id}' is not allowed in generated code")
+        elif isinstance(node, ast.Subscript) and any(
+                name.value.startswith("__") for name in _strings(node.slice)):
+            raise ValueError("Indexing with dunder names is not allowed in generated code")
+        elif isinstance(node, ast.Attribute):
+            if _forbidden_attribute(node.attr):
+                raise ValueError(f"Using '.{node.attr}' is not allowed in generated code")
+            if isinstance(node.value, ast.Name) and node.value.id == "px" and not hasattr(px, node.attr):
+                fixed = closest(node.attr, [name for name in dir(px) if not name.startswith("_")])
+                if fixed is None:
+                    raise ValueError(f"plotly.express has no function '{node.attr}'")
+                fixes.append((f"px.{node.attr}", f"px.{fixed}"))
+                node.attr = fixed
+    objects = _imported(tree)
+    for name, value in objects.items():
+        if _forbidden_object(value):
+            raise ValueError(f"Importing '{name}' is not allowed in generated code")
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and _forbidden_object(_resolve(node, objects)):
+            raise ValueError(f"Using '{ast.unparse(node)}' is not allowed in generated code")
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and isinstance(node.func.value, ast.Name) and node.func.value.id == "px"):
+            continue
+        function = getattr(px, node.func.attr)
+        try:
+            parameters = inspect.signature(function).parameters
+        except (TypeError, ValueError):
+            continue
+        if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values()):
+            continue
+        for keyword in node.keywords:
+            if keyword.arg is None or keyword.arg in parameters:
+                continue
+            fixed = closest(keyword.arg, list(parameters))
+            if fixed is None or any(k.arg == fixed for k in node.keywords):
+                raise ValueError(f"px.{node.func.attr}() got an unexpected keyword argument '{keyword.arg}'")
+            fixes.append((f"px.{node.func.attr}({keyword.arg}=)", f"px.{node.func.attr}({fixed}=)"))
+            keyword.arg = fixed
+
+
+def check(code, columns, cube=None):
+    """Return (code, fixes) for a generated pandas or Plotly snippet.
+
+    Misspelled column names, Plotly Express functions and arguments are
+    replaced by their closest match, and fixes lists each (old, new) pair.
+    Raises ValueError with a message for the model when the code does not
+    parse, uses forbidden imports or calls, or indexes `df` with a column
+    that does not exist.
+    """
+    if not CODE_CHECK:
+        return code, []
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        raise ValueError(f"Generated code is not valid Python: {e.msg} (line {e.lineno})")
+    fixes = []
+    _check_calls(tree, fixes)
+    if _uses_cube(tree) and _filters_rows(tree):
+        # The rollups cover every row, they would silently ignore the filter
+        raise ValueError("cube.aggregate() always covers the whole dataset; when filtering rows, "
+                         "aggregate the filtered frame with groupby instead")
+    known = {str(column) for column in columns}
+    if cube is not None:
+        known.update(name for key in cube.tables for name in key)
+    references, defined = _references(tree)
+    # Code that rebinds df may add columns the check cannot see
+    rebinds_df = any(isinstance(node, ast.Name) and node.id == "df" and isinstance(node.ctx, ast.Store)
+                     for node in ast.walk(tree))
+    for node in references:
+        attribute = isinstance(node, ast.Attribute)
+        name = node.attr if attribute else node.value
+        if name in known or name in defined:
+            continue
+        fixed = closest(name, known)
+        if fixed is not None and (not attribute or fixed.isidentifier()):
+            fixes.append((name, fixed))
+            if attribute:
+                node.attr = fixed
+            else:
+                node.value = fixed
+        elif not rebinds_df:
+            raise ValueError(f"Column '{name}' does not exist. Available columns: {[str(c) for c in columns]}")
+    if not fixes:
+        return code, fixes
+    return ast.unparse(tree), list(dict.fromkeys(fixes))
+
+
+def repair(code, df, cube=None):
+    """check() against a frame's columns, recording the repairs it made in the trace"""
+    with tracing.span("codecheck") as attrs:
+        code, fixes = check(code, df.columns, cube)
+        if fixes:
+            attrs["fixes"] = [f"{old} -> {new}" for old, new in fixes]
+            tracing.event("code_repaired")
+    return code
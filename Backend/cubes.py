@@ -0,0 +1,307 @@
+import os
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import profiling
+from dotenv import load_dotenv
+load_dotenv()
+
+# Optional group-by rollups computed once per dataset version. Most questions
+# are "sum of X by Y" over a few categorical columns; generated code can read
+# them from `cube` instead of scanning every row again. CUBES=1 enables them.
+# They are built in the background, requests use the plain frame until then.
+CUBES = os.getenv("CUBES", "0") == "1"
+# Columns with at most this many distinct values become dimensions
+CUBE_MAX_CARDINALITY = int(os.getenv("CUBE_MAX_CARDINALITY", "200"))
+# Rollups with more groups than this are not kept
+CUBE_MAX_ROWS = int(os.getenv("CUBE_MAX_ROWS", "20000"))
+# Two-dimension rollups built at most, the smallest ones first
+CUBE_MAX_PAIRS = int(os.getenv("CUBE_MAX_PAIRS", "50"))
+CUBE_CACHE_SIZE = int(os.getenv("CUBE_CACHE_SIZE", "8"))
+# Date buckets for datetime columns, coarsest first, as pandas period frequencies
+DATE_BUCKETS = {"year": "Y", "quarter": "Q", "month": "M", "week": "W", "day": "D"}
+
+_cache = OrderedDict()
+_building = set()
+_lock = threading.Lock()
+_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cubes")
+
+
+class Cube:
+    """Rollup tables of one dataset, keyed by their tuple of dimensions.
+
+    Each table is indexed by its dimensions and has a `rows` column plus
+    `<measure>_sum`, `_count`, `_min` and `_max` for every numeric column.
+    """
+
+    def __init__(self, tables, measures, buckets=None):
+        self.tables = tables
+        self.measures = measures
+        # Date bucket dimension -> (source column, period frequency)
+        self.buckets = buckets or {}
+        self.frame = None
+
+    def _key(self, by):
+        by = (by,) if isinstance(by, str) else tuple(by)
+        if by in self.tables:
+            return by, None
+        for key in self.tables:
+            if len(key) == len(by) and set(key) == set(by):
+                return key, list(by)
+        raise KeyError(f"No pre-aggregated table for {list(by)}")
+
+    def __contains__(self, by):
+        try:
+            self._key(by)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, by):
+        key, order = self._key(by)
+        table = self.tables[key]
+        # Generated code may modify what it gets, keep the stored table intact
+        return table.reorder_levels(order).sort_index() if order else table.copy()
+
+    def bind(self, df):
+        """Copy of the cube that falls back to `df` for groupings it does not hold"""
+        bound = Cube(self.tables, self.measures, self.buckets)
+        bound.frame = df
+        return bound
+
+    def _grouper(self, name):
+        """Column of the bound frame to group by, computing date buckets such as `ordered_month`"""
+        if name not in self.buckets or name in self.frame.columns:
+            return name
+        col, freq = self.buckets[name]
+        series = self.frame[col]
+        if getattr(series.dt, "tz", None) is not None:
+            series = series.dt.tz_localize(None)
+        return series.dt.to_period(freq).dt.start_time.rename(name)
+
+    def aggregate(self, by, column=None, func="sum"):
+        """Same as df.groupby(by)[column].agg(func), read from a rollup when one covers it.
+
+        func is one of sum, count, mean, min, max or size (column not needed).
+        """
+        table = self[by] if by in self else None
+        if func == "size" and table is not None:
+            return table["rows"].rename(None)
+        if table is not None and func in ("sum", "count", "mean", "min", "max") and f"{column}_sum" in table:
+            if func == "mean":
+                return (table[f"{column}_sum"] / table[f"{column}_count"].replace(0, np.nan)).rename(column)
+            return table[f"{column}_{func}"].rename(column)
+        if self.frame is None:
+            raise KeyError(f"No pre-aggregated table for {by!r} and {column!r}")
+        keys = [self._grouper(name) for name in ((by,) if isinstance(by, str) else by)]
+        groups = self.frame.groupby(keys[0] if isinstance(by, str) else keys)
+        return groups.size() if func == "size" else groups[column].agg(func)
+
+    def describe(self):
+        """Short description of the tables for prompts"""
+        return {
+            "tables": [list(key) for key in self.tables],
+            "measures": self.measures,
+        }
+
+
+def _dimensions(df):
+    """Return {name: (codes, labels, source column, bucket frequency)} for low-cardinality and date-bucket dimensions.
+
+    codes are sorted group numbers with -1 for missing values, as pd.factorize gives them.
+    """
+    dimensions = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            if getattr(series.dt, "tz", None) is not None:
+                series = series.dt.tz_localize(None)
+            for bucket, freq in DATE_BUCKETS.items():
+                codes, labels = pd.factorize(series.dt.to_period(freq), sort=True)
+                if len(labels) > CUBE_MAX_CARDINALITY:
+                    # Finer buckets only have more groups
+                    break
+                dimensions[f"{col}_{bucket}"] = (codes, labels.start_time, col, freq)
+            continue
+        if pd.api.types.is_float_dtype(series):
+            continue
+        try:
+            codes, labels = pd.factorize(series, sort=True)
+        except TypeError:
+            # Unhashable cells such as nested lists
+            continue
+        if len(labels) <= CUBE_MAX_CARDINALITY:
+            dimensions[col] = (codes, labels, col, None)
+    return dimensions
+
+
+def _measures(df, dimensions):
+    """Numeric columns to aggregate, leaving out identifiers such as row ids"""
+    measures = []
+    for col in df.select_dtypes(include=[np.number]).columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series) and col not in dimensions and series.is_unique:
+            continue
+        measures.append(col)
+    return measures
+
+
+def _values(series):
+    """Return (values, present) with int64 values when the column has no missing values"""
+    if pd.api.types.is_integer_dtype(series) and not series.hasnans:
+        return series.to_numpy(dtype=np.int64), None
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    present = ~np.isnan(values)
+    return values, (None if present.all() else present)
+
+
+def _rollup(dimensions, values, keys, measures):
+    """Aggregate measures by keys with numpy on combined group codes.
+
+    Equivalent to df.groupby(keys).agg(["sum", "count", "min", "max"]) with
+    rows dropped when a key is missing, but several times faster.
+    """
+    length = len(next(iter(dimensions.values()))[0])
+    group = np.zeros(length, dtype=np.int64)
+    missing = np.zeros(length, dtype=bool)
+    groups = 1
+    for key in keys:
+        codes, labels = dimensions[key][:2]
+        group = group * len(labels) + codes
+        missing |= codes < 0
+        groups *= len(labels)
+    if missing.any():
+        group = group[~missing]
+    rows = np.bincount(group, minlength=groups)
+    observed = np.flatnonzero(rows)
+    columns = {"rows": rows[observed]}
+    for col in measures:
+        column, present = values[col]
+        if missing.any():
+            column = column[~missing]
+            present = present[~missing] if present is not None else None
+        where = group if present is None else group[present]
+        column = column if present is None else column[present]
+        if column.dtype == np.int64:
+            total = np.zeros(groups, dtype=np.int64)
+            np.add.at(total, where, column)
+            low = np.full(groups, np.iinfo(np.int64).max)
+            high = np.full(groups, np.iinfo(np.int64).min)
+        else:
+            total = np.bincount(where, weights=column, minlength=groups)
+            low = np.full(groups, np.inf)
+            high = np.full(groups, -np.inf)
+        np.minimum.at(low, where, column)
+        np.maximum.at(high, where, column)
+        count = np.bincount(where, minlength=groups)[observed]
+        empty = count == 0
+        low, high = low[observed], high[observed]
+        if empty.any():
+            low, high = np.where(empty, np.nan, low), np.where(empty, np.nan, high)
+        columns.update({f"{col}_sum": total[observed], f"{col}_count": count,
+                        f"{col}_min": low, f"{col}_max": high})
+    levels, remainder = [], observed
+    for key in reversed(keys):
+        labels = dimensions[key][1]
+        remainder, position = np.divmod(remainder, len(labels))
+        levels.insert(0, labels.take(position))
+    if len(keys) == 1:
+        index = pd.Index(levels[0], name=keys[0])
+    else:
+        index = pd.MultiIndex.from_arrays(levels, names=list(keys))
+    return pd.DataFrame(columns, index=index)
+
+
+def build(df):
+    """Compute the rollups for every dimension and the smallest pairs of dimensions"""
+    dimensions = _dimensions(df)
+    if not dimensions:
+        return Cube({}, [])
+    measures = _measures(df, dimensions)
+    values = {col: _values(df[col]) for col in measures}
+    buckets = {name: (col, freq) for name, (_, _, col, freq) in dimensions.items() if freq is not None}
+    tables = {}
+    for key in dimensions:
+        table = _rollup(dimensions, values, [key], [col for col in measures if col != key])
+        if len(table) <= CUBE_MAX_ROWS:
+            tables[(key,)] = table
+    pairs = []
+    for keys in itertools.combinations([key for (key,) in tables], 2):
+        # Buckets of the same date column roll up into each other
+        if dimensions[keys[0]][2] == dimensions[keys[1]][2]:
+            continue
+        groups = len(tables[keys[:1]]) * len(tables[keys[1:]])
+        if groups <= CUBE_MAX_ROWS:
+            pairs.append((groups, keys))
+    # Wide frames have quadratically many pairs
+    for _, keys in sorted(pairs)[:CUBE_MAX_PAIRS]:
+        tables[keys] = _rollup(dimensions, values, list(keys), [col for col in measures if col not in keys])
+    return Cube(tables, measures, buckets)
+
+
+def _build(key, df):
+    try:
+        cube = build(df)
+    except Exception as e:
+        print(f"Could not build rollups for {key}: {e}")
+        cube = None
+    with _lock:
+        if key not in _building:
+            # The dataset was replaced or deleted meanwhile
+            return
+        _building.discard(key)
+        if cube is not None:
+            _cache[key] = cube
+            _cache.move_to_end(key)
+            while len(_cache) > CUBE_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+
+def prepare(key, df):
+    """Start building the cube of a dataset version in the background, e.g. when it is registered.
+
+    Returns the future of the build, or None when cubes are disabled or the
+    cube is already built or being built.
+    """
+    if not CUBES:
+        return None
+    with _lock:
+        if key in _cache or key in _building:
+            return None
+        _building.add(key)
+    return _builder.submit(_build, key, df)
+
+
+def for_frame(df):
+    """Cube of a frame when it has been built, otherwise None and its build is started.
+
+    None too when cubes are disabled or the frame cannot be fingerprinted.
+    """
+    if not CUBES:
+        return None
+    key = profiling.fingerprint(df)
+    if key is None:
+        return None
+    with _lock:
+        cube = _cache.get(key)
+        if cube is not None:
+            _cache.move_to_end(key)
+            return cube
+    prepare(key, df)
+    return None
+
+
+def describe(cube):
+    return cube.describe() if cube is not None else "not available"
+
+
+def invalidate(key):
+    with _lock:
+        _cache.pop(key, None)
+        _building.discard(key)
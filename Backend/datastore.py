@@ -0,0 +1,208 @@
+import os
+import re
+import uuid
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import cubes
+import profiling
+import resultcache
+from dotenv import load_dotenv
+load_dotenv()
+
+# Registered datasets live on local disk as Parquet; the most recently used
+# frames are also kept in memory so a chat turn does not touch the disk.
+DATASET_DIR = os.getenv("DATASET_DIR", os.path.join(tempfile.gettempdir(), "analytica_datasets"))
+CACHE_SIZE = int(os.getenv("DATASET_CACHE_SIZE", "8"))
+
+_cache = OrderedDict()
+_handles = {}
+_lock = threading.Lock()
+
+
+def _path(dataset_id, ext):
+    if not re.fullmatch(r"[0-9a-f]{32}", dataset_id or ""):
+        raise KeyError(dataset_id)
+    return os.path.join(DATASET_DIR, f"{dataset_id}.{ext}")
+
+
+def _write(df, dataset_id):
+    os.makedirs(DATASET_DIR, exist_ok=True)
+    try:
+        df.to_parquet(_path(dataset_id, "parquet"), index=False)
+    except Exception as e:
+        # Mixed-type object columns cannot always be represented in Arrow,
+        # keep those as a pickle rather than coercing the values.
+        print(f"Parquet write failed for {dataset_id}, storing as pickle: {e}")
+        df.to_pickle(_path(dataset_id, "pkl"))
+
+
+def _read(dataset_id):
+    parquet_path = _path(dataset_id, "parquet")
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path)
+    pickle_path = _path(dataset_id, "pkl")
+    if os.path.exists(pickle_path):
+        return pd.read_pickle(pickle_path)
+    raise KeyError(dataset_id)
+
+
+def _remember(dataset_id, df):
+    _cache[dataset_id] = df
+    _cache.move_to_end(dataset_id)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def _delete(dataset_id):
+    _cache.pop(dataset_id, None)
+    resultcache.invalidate(dataset_id)
+    cubes.invalidate(dataset_id)
+    for ext in ("parquet", "pkl"):
+        path = _path(dataset_id, ext)
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def register(c_id, df):
+    """Store a dataset for a chat and return its handle.
+
+    Uploading again for the same chat replaces the previous dataset.
+    """
+    dataset_id = uuid.uuid4().hex
+    _write(df, dataset_id)
+    cubes.prepare(dataset_id, df)
+    with _lock:
+        previous = _handles.get(c_id)
+        _handles[c_id] = dataset_id
+        _remember(dataset_id, df)
+        if previous:
+            _delete(previous)
+    return dataset_id
+
+
+# Column types of a streamed upload, from narrowest to widest. CSV fields
+# arrive as text, so each column is typed from the values of the whole file
+# before anything is written and every chunk is stored with that one schema.
+ARROW_TYPES = {"bool": pa.bool_(), "int": pa.int64(), "float": pa.float64(), "text": pa.string()}
+
+
+def _kind(values):
+    """Narrowest type holding every non-missing value of a column chunk, or None if there are none"""
+    values = values.dropna()
+    if values.empty:
+        return None
+    inferred = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred == "boolean":
+        return "bool"
+    # "mixed" covers numbers next to the '0' that filled their missing values
+    if inferred not in ("string", "integer", "floating", "mixed-integer-float", "decimal", "mixed"):
+        return "text"
+    try:
+        numbers = pd.to_numeric(values, errors="coerce")
+    except (TypeError, ValueError):
+        # Lists and dicts
+        return "text"
+    if numbers.isna().any():
+        return "text"
+    return "int" if numbers.dtype.kind == "i" else "float"
+
+
+def _widen(kind, other):
+    if kind is None or kind == other:
+        return other
+    if other is None:
+        return kind
+    if {kind, other} == {"int", "float"}:
+        return "float"
+    return "text"
+
+
+def _typed(chunk, kinds, nullable):
+    """Chunk with every column converted to its file-wide type"""
+    chunk = chunk.reindex(columns=list(kinds))
+    for col, kind in kinds.items():
+        values = chunk[col]
+        if kind == "text":
+            chunk[col] = values.astype(object).map(str, na_action="ignore")
+        elif kind == "bool":
+            chunk[col] = values.astype("boolean" if nullable[col] else bool)
+        else:
+            numbers = pd.to_numeric(values, errors="coerce")
+            # Integers with gaps become floats, as pd.read_csv would type them
+            chunk[col] = numbers.astype("int64" if kind == "int" and not nullable[col] else "float64")
+    return chunk
+
+
+def register_chunks(c_id, chunks):
+    """Store a dataset arriving as a sequence of frames without holding it all in memory.
+
+    The chunks are spilled to disk while the column types of the whole file
+    are worked out, then written to Parquet with one schema covering every
+    column any chunk had. Returns the handle and the number of rows written.
+    The rollup cube is built when the dataset is first loaded.
+    """
+    dataset_id = uuid.uuid4().hex
+    path = _path(dataset_id, "parquet")
+    os.makedirs(DATASET_DIR, exist_ok=True)
+    spill = tempfile.mkdtemp(dir=DATASET_DIR)
+    kinds, nullable, pieces = {}, {}, []
+    rows = 0
+    try:
+        for chunk in chunks:
+            for col in chunk.columns:
+                kinds[col] = _widen(kinds.get(col), _kind(chunk[col]))
+                nullable[col] = nullable.get(col, bool(pieces)) or bool(chunk[col].isna().any())
+            # Columns first seen in this chunk were missing from the earlier ones
+            for col in kinds.keys() - set(chunk.columns):
+                nullable[col] = True
+            piece = os.path.join(spill, f"{len(pieces)}.pkl")
+            chunk.to_pickle(piece)
+            pieces.append(piece)
+            rows += len(chunk)
+        if not pieces:
+            raise ValueError("Uploaded file contains no rows")
+        kinds = {col: kind or "text" for col, kind in kinds.items()}
+        schema = pa.schema([pa.field(str(col), ARROW_TYPES[kind]) for col, kind in kinds.items()])
+        with pq.ParquetWriter(path, schema) as writer:
+            for piece in pieces:
+                chunk = _typed(pd.read_pickle(piece), kinds, nullable)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                os.unlink(piece)
+    except Exception:
+        if os.path.exists(path):
+            os.unlink(path)
+        raise
+    finally:
+        shutil.rmtree(spill, ignore_errors=True)
+    with _lock:
+        previous = _handles.get(c_id)
+        _handles[c_id] = dataset_id
+        if previous:
+            _delete(previous)
+    return dataset_id, rows
+
+
+def handle_for(c_id):
+    return _handles.get(c_id)
+
+
+def load(dataset_id):
+    """Return a copy of a registered dataset, raising KeyError if unknown."""
+    with _lock:
+        df = _cache.get(dataset_id)
+        if df is not None:
+            _cache.move_to_end(dataset_id)
+    if df is None:
+        df = _read(dataset_id)
+        with _lock:
+            _remember(dataset_id, df)
+    # Generated code may add or overwrite columns, so never hand out the cached frame.
+    df = df.copy()
+    profiling.tag(df, dataset_id)
+    return df
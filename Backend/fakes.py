@@ -0,0 +1,197 @@
+"""In-memory stand-ins for external services, used by the benchmarks and tests."""
+import asyncio
+import itertools
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from langchain_core.language_models.chat_models import SimpleChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _value(row, path):
+    """Value of a column or of a path in a JSON column, as in PostgREST.
+
+    "column->a->b" gives JSON, "column->a->>b" gives the last value as text.
+    """
+    *keys, last = path.split("->")
+    as_text = last.startswith(">")
+    keys.append(last.lstrip(">"))
+    value = row.get(keys[0])
+    for key in keys[1:]:
+        value = value.get(key) if isinstance(value, dict) else None
+    if not as_text:
+        return value
+    return value if value is None or isinstance(value, str) else json.dumps(value)
+
+
+class FakeQuery:
+    """Supports the subset of the PostgREST query builder the app uses."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.op = "select"
+        self.payload = None
+        self.columns = "*"
+        self.filters = []
+        self.sort = []
+        self.max_rows = None
+
+    def select(self, columns="*", *args, **kwargs):
+        self.op = "select"
+        self.columns = columns
+        return self
+
+    def insert(self, row):
+        self.op = "insert"
+        self.payload = row
+        return self
+
+    def update(self, values):
+        self.op = "update"
+        self.payload = values
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: _value(row, column) == value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: _value(row, column) is not None and _value(row, column) < value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: _value(row, column) in values)
+        return self
+
+    def order(self, column, desc=False):
+        # Later calls break ties of earlier ones, as in postgrest
+        self.sort.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.max_rows = count
+        return self
+
+    def _project(self, row):
+        if self.columns == "*":
+            return dict(row)
+        projected = {}
+        for name in self.columns.split(","):
+            alias, _, path = name.strip().rpartition(":")
+            projected[alias or path.rpartition("->")[2].lstrip(">")] = _value(row, path)
+        return projected
+
+    def _run(self):
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.op == "insert":
+            row = self.db.new_row(self.table, self.payload)
+            rows.append(row)
+            return [dict(row)]
+        matched = [row for row in rows if all(check(row) for check in self.filters)]
+        if self.op == "update":
+            for row in matched:
+                row.update(self.payload)
+            return [dict(row) for row in matched]
+        for column, desc in reversed(self.sort):
+            matched = sorted(matched, key=lambda row: row.get(column), reverse=desc)
+        if self.max_rows is not None:
+            matched = matched[:self.max_rows]
+        return [self._project(row) for row in matched]
+
+    async def execute(self):
+        data = self._run()
+        delay = self.db.latency
+        if self.db.bandwidth:
+            # Rows travel as JSON, big payloads take longer to send and parse
+            delay += len(json.dumps(data, default=str)) / self.db.bandwidth
+        if delay:
+            await asyncio.sleep(delay)
+        return FakeResponse(data)
+
+
+class FakeSupabase:
+    """Async Supabase client backed by Python lists.
+
+    Each query costs a fixed round-trip latency plus, when bandwidth (bytes
+    per second) is set, the time to transfer its result.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.tables = {}
+        self._ids = itertools.count(1)
+        self._clock = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def new_row(self, table, payload):
+        row = dict(payload)
+        row_id = next(self._ids)
+        if table == "Chat":
+            row.setdefault("c_id", str(uuid.UUID(int=row_id)))
+        else:
+            row.setdefault("id", row_id)
+        row.setdefault("created_at", (self._clock + timedelta(milliseconds=row_id)).isoformat())
+        return row
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeChatModel(SimpleChatModel):
+    """Offline stand-in for a provider model, used for tests and benchmarks.
+
+    A call takes latency seconds plus a cost per prompt token and per
+    response token, a rough model of a provider's time to first token and
+    generation speed.
+    """
+
+    respond: Callable[[str], str]
+    latency: float = 0.0
+    input_token_latency: float = 0.0
+    output_token_latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _respond(self, prompt):
+        self.calls += 1
+        text = self.respond(prompt)
+        # About 4 characters per token
+        return text, self.latency + len(prompt) / 4 * self.input_token_latency, len(text) / 4 * self.output_token_latency
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        text, first, rest = self._respond(messages[-1].content)
+        if first + rest:
+            time.sleep(first + rest)
+        return text
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, first, rest = self._respond(messages[-1].content)
+        if first + rest:
+            await asyncio.sleep(first + rest)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, first, rest = self._respond(messages[-1].content)
+        if first:
+            await asyncio.sleep(first)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if rest:
+                await asyncio.sleep(rest / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
@@ -0,0 +1,333 @@
+import os
+import json
+import math
+import base64
+
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+from dotenv import load_dotenv
+load_dotenv()
+
+# Plot answers are encoded once, in the sandbox worker, into compact JSON:
+# numeric arrays become Plotly typed arrays ({"dtype", "bdata"} base64),
+# dates on x/y become epoch milliseconds on a date axis, and scatter/line
+# traces denser than FIGURE_MAX_POINTS are downsampled (0 keeps every
+# point). The encoded text is sent as the response body as-is and parsed
+# once for storage.
+FIGURE_MAX_POINTS = int(os.getenv("FIGURE_MAX_POINTS", "20000"))
+
+# Shorter arrays stay plain lists, the base64 overhead is not worth it
+MIN_TYPED_LENGTH = 16
+TYPED_CODES = {
+    "int8": "i1", "uint8": "u1", "int16": "i2", "uint16": "u2",
+    "int32": "i4", "uint32": "u4", "float32": "f4", "float64": "f8",
+}
+SMALL_INTS = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+# Trace types that are downsampled or binned when they are too dense
+REDUCED_TYPES = {"scatter", "scattergl"}
+
+
+class RawJSON:
+    """JSON text embedded as-is when a response is serialized"""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def _typed(array):
+    """Typed-array spec for a numeric array, or None if it should stay as is"""
+    kind = array.dtype.kind
+    if array.ndim > 2 or kind not in "iuf" or array.size == 0:
+        return None
+    if kind in "iu":
+        low, high = array.min(), array.max()
+        for small in SMALL_INTS:
+            info = np.iinfo(small)
+            if info.min <= low and high <= info.max:
+                array = array.astype(small)
+                break
+        else:
+            # plotly.js has no 64-bit integer arrays
+            array = array.astype(np.float64)
+    elif array.dtype != np.float32:
+        array = array.astype(np.float64)
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+    spec = {"dtype": TYPED_CODES[array.dtype.name], "bdata": base64.b64encode(array.tobytes()).decode()}
+    if array.ndim == 2:
+        spec["shape"] = f"{array.shape[0]}, {array.shape[1]}"
+    return spec
+
+
+def _as_array(value):
+    """Numeric or datetime ndarray for an array-like value, otherwise None"""
+    if isinstance(value, dict):
+        if "bdata" not in value:
+            return None
+        array = np.frombuffer(base64.b64decode(value["bdata"]), dtype=np.dtype(value["dtype"]).newbyteorder("<"))
+        if "shape" in value:
+            array = array.reshape([int(n) for n in value["shape"].split(",")])
+        return array
+    if isinstance(value, np.ndarray):
+        return value
+    if isinstance(value, (list, tuple)) and len(value) >= MIN_TYPED_LENGTH:
+        first = value[0][0] if isinstance(value[0], (list, tuple)) and value[0] else value[0]
+        if isinstance(first, (int, float)) and not isinstance(first, bool):
+            try:
+                return np.asarray(value)
+            except ValueError:
+                # Ragged nested lists
+                return None
+    return None
+
+
+def _epoch_ms(array):
+    ms = array.astype("datetime64[us]").astype(np.int64) / 1000.0
+    ms[np.isnat(array)] = np.nan
+    return ms
+
+
+def _listed(array):
+    """Plain list for an array that is not sent as a typed array, with missing values as null"""
+    if array.dtype.kind == "M":
+        values = np.datetime_as_string(array, unit="auto").astype(object)
+        values[np.isnat(array)] = None
+        return values.tolist()
+    values = array.astype(object)
+    values[pd.isna(array)] = None
+    return values.tolist()
+
+
+def compact(node):
+    """Figure dict with numeric arrays as typed arrays and everything else JSON ready"""
+    if isinstance(node, dict):
+        if "bdata" in node:
+            return node
+        return {key: compact(value) for key, value in node.items()}
+    array = _as_array(node)
+    if array is not None and array.size >= MIN_TYPED_LENGTH:
+        spec = _typed(array)
+        if spec is not None:
+            return spec
+    if isinstance(node, np.ndarray):
+        return _listed(node)
+    if isinstance(node, (list, tuple)):
+        return [compact(item) for item in node]
+    if isinstance(node, float):
+        return node if math.isfinite(node) else None
+    if isinstance(node, np.generic):
+        return compact(node.item())
+    return node
+
+
+def _default(value):
+    # Timestamps, dates, decimals and the other scalars Plotly knows how to encode
+    return PlotlyJSONEncoder().default(value)
+
+
+def _date_axes(figure):
+    """Send dates on x/y as epoch milliseconds and mark their axes as date axes"""
+    layout = figure.setdefault("layout", {})
+    for trace in figure.get("data", []):
+        for axis in ("x", "y"):
+            values = trace.get(axis)
+            if not (isinstance(values, np.ndarray) and values.dtype.kind == "M" and values.size >= MIN_TYPED_LENGTH):
+                continue
+            ref = trace.get(f"{axis}axis", axis)
+            axis_layout = layout.setdefault(f"{axis}axis{ref[1:]}", {})
+            if axis_layout.get("type", "date") != "date":
+                continue
+            axis_layout["type"] = "date"
+            trace[axis] = _epoch_ms(values)
+
+
+def _per_point(trace, total):
+    """(container, key, array) for every attribute holding one value per point"""
+    found = []
+    for container in [trace] + [trace[key] for key in ("marker", "line") if isinstance(trace.get(key), dict)]:
+        for key, value in container.items():
+            if isinstance(value, dict) and "bdata" not in value:
+                continue
+            array = _as_array(value)
+            if array is None and isinstance(value, (list, tuple)) and len(value) == total:
+                array = np.asarray(value, dtype=object)
+            if array is not None and array.ndim >= 1 and len(array) == total:
+                found.append((container, key, array))
+    return found
+
+
+def _minmax(y, buckets):
+    """Indices of the smallest and largest value in each of `buckets` equal runs"""
+    size = -(-len(y) // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:len(y)] = y
+    runs = padded.reshape(buckets, size)
+    filled = ~np.isnan(runs).all(axis=1)
+    offsets = np.arange(buckets)[filled] * size
+    low = np.nanargmin(runs[filled], axis=1) + offsets
+    high = np.nanargmax(runs[filled], axis=1) + offsets
+    return np.unique(np.concatenate([low, high]))
+
+
+def _lttb(x, y, target):
+    """Largest-Triangle-Three-Buckets selection, returns positions into x/y"""
+    n = len(x)
+    if n <= target:
+        return np.arange(n)
+    every = (n - 2) / (target - 2)
+    cx, cy = np.concatenate([[0], np.cumsum(x)]), np.concatenate([[0], np.cumsum(y)])
+    x, y = x.tolist(), y.tolist()
+    selected = [0]
+    a = 0
+    for i in range(target - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        if next_end <= end:
+            next_end = n
+        count = next_end - end
+        avg_x, avg_y = (cx[next_end] - cx[end]) / count, (cy[next_end] - cy[end]) / count
+        ax, ay = x[a], y[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (y[j] - ay) - (ax - x[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return np.asarray(selected)
+
+
+def _reduce_line(trace, total, max_points):
+    y = _as_array(trace.get("y"))
+    if y is None or y.dtype.kind not in "iuf":
+        return None
+    y = y.astype(np.float64)
+    x = _as_array(trace.get("x"))
+    x = x.astype(np.float64) if x is not None and x.dtype.kind in "iuf" else np.arange(total, dtype=np.float64)
+    finite = np.flatnonzero(np.isfinite(y) & np.isfinite(x))
+    if len(finite) < 3:
+        return None
+    # Min-max keeps every peak, LTTB then picks the points that shape the curve
+    candidates = finite[_minmax(y[finite], min(len(finite), 2 * max_points))] if len(finite) > 4 * max_points else finite
+    keep = candidates[_lttb(x[candidates], y[candidates], max_points)]
+    keep = np.union1d(keep, [finite[0], finite[-1]])
+    # One missing point per run of missing values keeps the gaps in the line
+    missing = np.flatnonzero(~np.isfinite(y))
+    if len(missing):
+        gaps = missing[np.concatenate([[True], np.diff(missing) > 1])]
+        keep = np.union1d(keep, gaps)
+    for container, key, array in _per_point(trace, total):
+        container[key] = array[keep]
+    return {"method": "lttb", "points": total, "kept": len(keep)}
+
+
+def _bin_codes(values, bins):
+    """Bin index per value for a numeric axis, or a category code otherwise"""
+    if values.dtype.kind in "iuf":
+        values = values.astype(np.float64)
+        low, high = np.nanmin(values), np.nanmax(values)
+        span = (high - low) or 1.0
+        return np.clip(((values - low) / span * bins).astype(np.int64), 0, bins - 1), bins
+    codes, uniques = pd.factorize(values)
+    return codes, max(len(uniques), 1)
+
+
+def _reduce_markers(trace, total, max_points):
+    x, y = _as_array(trace.get("x")), _as_array(trace.get("y"))
+    if x is None or y is None or len(x) != total or len(y) != total:
+        return None
+    numeric = [axis.dtype.kind in "iuf" for axis in (x, y)]
+    if not any(numeric):
+        return None
+    valid = np.ones(total, dtype=bool)
+    for axis, is_numeric in zip((x, y), numeric):
+        valid &= np.isfinite(axis.astype(np.float64)) if is_numeric else ~pd.isna(axis)
+    x, y = x[valid], y[valid]
+    if all(numeric):
+        bins = int(max_points ** 0.5)
+    else:
+        # Split the numeric axis finer when the other one is categorical
+        categories = pd.unique(y if numeric[0] else x).size
+        bins = max(max_points // max(categories, 1), 1)
+    x_codes, _ = _bin_codes(x, bins)
+    y_codes, y_bins = _bin_codes(y, bins)
+    groups, cells = pd.factorize(x_codes * y_bins + y_codes)
+    if len(cells) >= len(groups):
+        return None
+    counts = np.bincount(groups)
+    _, first = np.unique(groups, return_index=True)
+    for container, key, array in _per_point(trace, total):
+        if container is trace and key in ("customdata", "hovertext", "text", "ids", "selectedpoints"):
+            del container[key]
+            continue
+        array = array[valid]
+        # Numeric attributes (including x/y) become cell means, others the cell's first value
+        if array.dtype.kind in "iuf" and array.ndim == 1:
+            container[key] = np.bincount(groups, weights=array) / counts
+        else:
+            container[key] = array[first]
+    for key in ("error_x", "error_y"):
+        trace.pop(key, None)
+    marker = trace.setdefault("marker", {})
+    if not isinstance(marker.get("opacity"), (np.ndarray, list)):
+        # Denser cells are drawn more opaque
+        weight = np.log1p(counts) / np.log1p(counts.max())
+        marker["opacity"] = np.round(0.25 + 0.75 * weight * (marker.get("opacity") or 1.0), 3)
+    trace["customdata"] = counts
+    name = trace.get("name") or ""
+    trace["hovertemplate"] = f"{name}<br>x=%{{x}}<br>y=%{{y}}<br>%{{customdata}} points<extra></extra>"
+    return {"method": "binned", "points": total, "kept": len(counts)}
+
+
+def reduce(trace, max_points):
+    """Shrink a scatter trace with more than max_points points.
+
+    Lines are downsampled with min-max preselection followed by LTTB, markers
+    are binned on a grid and drawn once per non-empty cell. Returns what was
+    done, or None if the trace was kept whole.
+    """
+    if trace.get("type", "scatter") not in REDUCED_TYPES or max_points < 3:
+        return None
+    lengths = [len(array) for array in (_as_array(trace.get(axis)) for axis in ("x", "y")) if array is not None]
+    if not lengths or max(lengths) <= max_points:
+        return None
+    total = max(lengths)
+    mode = trace.get("mode") or "lines"
+    if "lines" in mode:
+        return _reduce_line(trace, total, max_points)
+    return _reduce_markers(trace, total, max_points)
+
+
+def encode(fig, max_points=None):
+    """Serialize a figure once into compact JSON text.
+
+    Returns the encoded figure and a list describing each reduced trace.
+    """
+    max_points = FIGURE_MAX_POINTS if max_points is None else max_points
+    figure = fig.to_plotly_json()
+    _date_axes(figure)
+    reduced = []
+    if max_points:
+        for index, trace in enumerate(figure.get("data", [])):
+            done = reduce(trace, max_points)
+            if done:
+                reduced.append({"trace": index, "name": trace.get("name") or "", **done})
+    return RawJSON(json.dumps(compact(figure), separators=(",", ":"), default=_default)), reduced
+
+
+def dumps(response):
+    """Serialize a response dict, embedding RawJSON values without re-encoding them"""
+    plain = {key: value for key, value in response.items() if not isinstance(value, RawJSON)}
+    raw = [f"{json.dumps(key)}:{value.text}" for key, value in response.items() if isinstance(value, RawJSON)]
+    if not raw:
+        return json.dumps(plain)
+    head = json.dumps(plain)[:-1]
+    return head + ("," if plain else "") + ",".join(raw) + "}"
+
+
+def plain(response):
+    """Response with RawJSON values parsed, e.g. for storing in the database"""
+    return {key: json.loads(value.text) if isinstance(value, RawJSON) else value for key, value in response.items()}
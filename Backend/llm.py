@@ -0,0 +1,198 @@
+import os
+import time
+import asyncio
+import threading
+
+import tracing
+from dotenv import load_dotenv
+load_dotenv()
+
+# Every model the backend talks to. Clients are built once per process and
+# reused, so their HTTP connection pools stay warm between requests.
+# Limits can be overridden per model, e.g. LLM_GRAPH_CONCURRENCY=4 or
+# LLM_CLASSIFIER_TIMEOUT=10.
+MODELS = {
+    "classifier": {"provider": "groq", "model": "llama-3.3-70b-versatile", "temperature": 0, "max_tokens": 5},
+    "graph": {"provider": "google", "model": "gemini-2.5-flash"},
+    "analysis": {"provider": "google", "model": os.getenv("GOOGLE_MODEL_NAME")},
+    # Routes and writes code in one call when ANALYTICS_MODE=combined, see planner.py
+    "planner": {"provider": "google", "model": os.getenv("GOOGLE_MODEL_NAME"), "json": True},
+    "cleaning": {"provider": "google", "model": "gemini-2.0-flash"},
+}
+
+DEFAULT_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+_clients = {}
+_chains = {}
+_limits = {}
+_async_limits = {}
+_lock = threading.Lock()
+
+
+def timeout(name):
+    return float(os.getenv(f"LLM_{name.upper()}_TIMEOUT", DEFAULT_TIMEOUT))
+
+
+def concurrency(name):
+    return int(os.getenv(f"LLM_{name.upper()}_CONCURRENCY", DEFAULT_CONCURRENCY))
+
+
+def _build(name):
+    config = MODELS[name]
+    # Provider SDKs take most of the import time of the app, so they load with the first client
+    if config["provider"] == "groq":
+        from langchain_groq import ChatGroq
+        return ChatGroq(
+            model=config["model"],
+            temperature=config.get("temperature"),
+            max_tokens=config.get("max_tokens"),
+            groq_api_key=os.getenv("GROQ_API_KEY"),
+            request_timeout=timeout(name),
+        )
+    if config["provider"] == "google":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(
+            model=config["model"],
+            google_api_key=os.getenv("google_api_key"),
+            timeout=timeout(name),
+            response_mime_type="application/json" if config.get("json") else None,
+        )
+    raise ValueError(f"Unknown provider '{config['provider']}' for model '{name}'")
+
+
+def get(name):
+    """Return the shared client for a configured model, building it on first use."""
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            client = _clients[name] = _build(name)
+            _limits.setdefault(name, threading.BoundedSemaphore(concurrency(name)))
+        return client
+
+
+def chain(name, prompt):
+    """Return the cached `prompt | model` runnable for a module-level prompt."""
+    key = (name, id(prompt))
+    cached = _chains.get(key)
+    if cached is None or cached[0] is not prompt:
+        cached = _chains[key] = (prompt, prompt | get(name))
+    return cached[1]
+
+
+def _count_tokens(name, attrs, prompt, inputs, text, usage=None):
+    """Record prompt and completion tokens, as reported by the provider or estimated from the text"""
+    if not tracing.TRACING:
+        return
+    if usage:
+        attrs["prompt_tokens"], attrs["completion_tokens"] = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    else:
+        # About 4 characters per token
+        attrs["prompt_tokens"] = len(prompt.format(**inputs)) // 4 + 1
+        attrs["completion_tokens"] = len(text) // 4 + 1
+        attrs["estimated"] = True
+    tracing.LLM_TOKENS.inc(name, "prompt", amount=attrs["prompt_tokens"])
+    tracing.LLM_TOKENS.inc(name, "completion", amount=attrs["completion_tokens"])
+
+
+def invoke(name, prompt, inputs):
+    """Run a prompt on a pooled model and return the response text.
+
+    Calls beyond the model's concurrency limit wait for a free slot, up to
+    the model's timeout.
+    """
+    runnable = chain(name, prompt)
+    limit = _limits[name]
+    if not limit.acquire(timeout=timeout(name)):
+        raise TimeoutError(f"Timed out waiting for a free '{name}' model slot")
+    try:
+        with tracing.span(f"llm.{name}") as attrs:
+            result = runnable.invoke(inputs)
+            _count_tokens(name, attrs, prompt, inputs, result.content, getattr(result, "usage_metadata", None))
+        return result.content
+    finally:
+        limit.release()
+
+
+async def _acquire(name):
+    """Wait for a free slot of a model and return its semaphore"""
+    # asyncio primitives belong to one event loop, so keep one limit per loop
+    key = (name, asyncio.get_running_loop())
+    limit = _async_limits.get(key)
+    if limit is None:
+        limit = _async_limits[key] = asyncio.Semaphore(concurrency(name))
+    try:
+        await asyncio.wait_for(limit.acquire(), timeout(name))
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Timed out waiting for a free '{name}' model slot")
+    return limit
+
+
+async def ainvoke(name, prompt, inputs):
+    """Async counterpart of invoke() for use inside request handlers."""
+    runnable = chain(name, prompt)
+    limit = await _acquire(name)
+    try:
+        with tracing.span(f"llm.{name}") as attrs:
+            result = await asyncio.wait_for(runnable.ainvoke(inputs), timeout(name))
+            _count_tokens(name, attrs, prompt, inputs, result.content, getattr(result, "usage_metadata", None))
+        return result.content
+    finally:
+        limit.release()
+
+
+async def astream(name, prompt, inputs):
+    """Like ainvoke(), but yield the response text in pieces as the model produces them."""
+    runnable = chain(name, prompt)
+    limit = await _acquire(name)
+    pieces, usage = [], None
+    started = time.perf_counter()
+    # One deadline for the whole response; asyncio.timeout() would need Python 3.11
+    deadline = started + timeout(name)
+    chunks = runnable.astream(inputs).__aiter__()
+    try:
+        with tracing.span(f"llm.{name}", streamed=True) as attrs:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), deadline - time.perf_counter())
+                except StopAsyncIteration:
+                    break
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if chunk.content:
+                    if not pieces:
+                        attrs["first_token_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                    pieces.append(chunk.content)
+                    yield chunk.content
+            _count_tokens(name, attrs, prompt, inputs, "".join(pieces), usage)
+    finally:
+        limit.release()
+        await chunks.aclose()
+
+
+def use_client(name, client):
+    """Replace the client for a model, e.g. with a fakes.FakeChatModel."""
+    with _lock:
+        _clients[name] = client
+        _limits.setdefault(name, threading.BoundedSemaphore(concurrency(name)))
+        for key in [key for key in _chains if key[0] == name]:
+            del _chains[key]
+
+
+def use_fake(name, respond, latency=0.0, input_token_latency=0.0, output_token_latency=0.0):
+    from fakes import FakeChatModel
+
+    if isinstance(respond, str):
+        text = respond
+        respond = lambda prompt: text
+    fake = FakeChatModel(respond=respond, latency=latency, input_token_latency=input_token_latency,
+                         output_token_latency=output_token_latency)
+    use_client(name, fake)
+    return fake
+
+
+def warm_up():
+    for name in MODELS:
+        try:
+            get(name)
+        except Exception as e:
+            print(f"Could not initialise model '{name}': {e}")
@@ -0,0 +1,166 @@
+import os
+import asyncio
+import threading
+from collections import OrderedDict, deque
+
+import tracing
+from dotenv import load_dotenv
+load_dotenv()
+
+# Condensed chat history for prompts, kept per chat as messages are written
+# so a turn does not fetch earlier messages (and their figures) again. A chat
+# that is not in memory is rebuilt from the database without transferring
+# figure payloads.
+#
+# Memory is per process. With several workers another one may have written
+# to a chat since it was remembered here, so by default a hit first reads the
+# id of the chat's latest message (one small query) and rebuilds the chat when
+# it is not the one last seen. CHAT_MEMORY_CHECK=0 skips that query, which is
+# only safe with a single worker.
+CHAT_MEMORY_SIZE = int(os.getenv("CHAT_MEMORY_SIZE", "512"))
+# Most recent messages given to the models verbatim (condensed)
+HISTORY_MESSAGES = int(os.getenv("HISTORY_MESSAGES", "5"))
+# CHAT_SUMMARY=1 keeps a rolling summary of the questions asked before those
+CHAT_SUMMARY = os.getenv("CHAT_SUMMARY", "0") == "1"
+CHAT_MEMORY_CHECK = os.getenv("CHAT_MEMORY_CHECK", "1") == "1"
+SUMMARY_MESSAGES = 20
+SUMMARY_MAX_CHARS = 600
+TEXT_SNIPPET_CHARS = 200
+
+_chats = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stale": 0}
+
+
+def plot_title(figure):
+    title = figure.get("layout", {}).get("title") if isinstance(figure, dict) else None
+    return title.get("text") if isinstance(title, dict) else title
+
+
+def condense(user_message, response_type, content):
+    """Short role/content entries for one stored message.
+
+    content is the text of a text answer or the title of a plot.
+    """
+    entries = []
+    # Simple summarization for token efficiency
+    if user_message:
+        entries.append({"role": "user", "content": user_message})
+    ai_msg = ""
+    if response_type == 'text':
+        # Truncate long text answers
+        text_content = str(content)
+        ai_msg = text_content[:TEXT_SNIPPET_CHARS] + "..." if len(text_content) > TEXT_SNIPPET_CHARS else text_content
+    elif response_type == 'plot':
+        ai_msg = f"Generated a plot (type: {response_type}): {content or 'No title available'}"
+    if ai_msg:
+        entries.append({"role": "assistant", "content": ai_msg})
+    return entries
+
+
+def _summarize(summary, user_message):
+    """Fold a question that left the recent window into the rolling summary"""
+    questions = (summary.split(" | ") if summary else []) + [user_message[:TEXT_SNIPPET_CHARS]]
+    while len(" | ".join(questions)) > SUMMARY_MAX_CHARS and len(questions) > 1:
+        questions.pop(0)
+    return " | ".join(questions)
+
+
+def _add(chat, user_message, response_type, content):
+    if len(chat["recent"]) == HISTORY_MESSAGES and CHAT_SUMMARY:
+        oldest = chat["recent"][0]
+        if oldest["user_message"]:
+            chat["summary"] = _summarize(chat["summary"], oldest["user_message"])
+    chat["recent"].append({"user_message": user_message,
+                           "entries": condense(user_message, response_type, content)})
+
+
+def _history(chat):
+    history = []
+    if chat["summary"]:
+        history.append({"role": "system", "content": f"Earlier in this chat the user asked: {chat['summary']}"})
+    for message in chat["recent"]:
+        history.extend(message["entries"])
+    return history
+
+
+def _remember(c_id, chat):
+    _chats[c_id] = chat
+    _chats.move_to_end(c_id)
+    while len(_chats) > CHAT_MEMORY_SIZE:
+        _chats.popitem(last=False)
+
+
+async def _load(db, c_id):
+    """Rebuild a chat's memory from its latest messages, without figure payloads"""
+    window = HISTORY_MESSAGES + (SUMMARY_MESSAGES if CHAT_SUMMARY else 0)
+    rows, texts = await asyncio.gather(
+        db.table('messages').select("id,user_message,type:response->>type,title:response->data->layout->title")
+        .eq('c_id', c_id).order('id', desc=True).limit(window).execute(),
+        # The text answers of the recent window are among the latest text answers
+        db.table('messages').select("id,text:response->>data")
+        .eq('c_id', c_id).eq('response->>type', 'text').order('id', desc=True).limit(HISTORY_MESSAGES).execute(),
+    )
+    text_by_id = {row["id"]: row["text"] for row in texts.data}
+    chat = {"recent": deque(maxlen=HISTORY_MESSAGES), "summary": None,
+            "last_id": rows.data[0]["id"] if rows.data else None}
+    for row in reversed(rows.data):
+        title = row.get("title")
+        content = text_by_id.get(row["id"]) if row["type"] == "text" else plot_title({"layout": {"title": title}})
+        _add(chat, row.get("user_message"), row["type"], content)
+    return chat
+
+
+async def _latest_id(db, c_id):
+    with tracing.span("db.latest_message"):
+        response = await db.table('messages').select("id").eq('c_id', c_id).order('id', desc=True).limit(1).execute()
+    return response.data[0]["id"] if response.data else None
+
+
+async def history(db, c_id):
+    """Condensed history of a chat, oldest first, loading it from db when not in memory or stale"""
+    with _lock:
+        chat = _chats.get(c_id)
+    if chat is not None and CHAT_MEMORY_CHECK and await _latest_id(db, c_id) != chat["last_id"]:
+        with _lock:
+            _stats["stale"] += 1
+            if _chats.get(c_id) is chat:
+                del _chats[c_id]
+        chat = None
+    with _lock:
+        if chat is not None:
+            if c_id in _chats:
+                _chats.move_to_end(c_id)
+            _stats["hits"] += 1
+            tracing.event("memory_hit")
+            return _history(chat)
+        _stats["misses"] += 1
+    with tracing.span("db.history"):
+        chat = await _load(db, c_id)
+    with _lock:
+        # A message recorded while loading is already in the loaded rows or will be
+        # picked up on the next miss, keep whichever copy arrived first
+        chat = _chats.setdefault(c_id, chat)
+        _remember(c_id, chat)
+        return _history(chat)
+
+
+def record(c_id, user_message, response, message_id=None):
+    """Add a stored message to its chat's memory, if the chat is in memory
+
+    message_id is the id the database gave the message. Without it the next
+    check finds the chat stale and rebuilds it.
+    """
+    response = response if isinstance(response, dict) else {}
+    response_type = response.get('type')
+    content = plot_title(response.get('data')) if response_type == 'plot' else response.get('data')
+    with _lock:
+        chat = _chats.get(c_id)
+        if chat is not None:
+            _add(chat, user_message, response_type, content)
+            if message_id is not None:
+                chat["last_id"] = message_id
+
+
+def stats():
+    return {**_stats, "chats": len(_chats)}
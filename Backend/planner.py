@@ -0,0 +1,98 @@
+import os
+import json
+
+from langchain.prompts import PromptTemplate
+import llm
+import workers
+import profiling
+import cubes
+import tracing
+from dotenv import load_dotenv
+load_dotenv()
+
+# ANALYTICS_MODE=combined routes a question and writes its code in one model
+# call, instead of a classifier call followed by a plot or pandas code call.
+# Questions answered with the SQL engine keep the separate calls.
+ANALYTICS_MODE = os.getenv("ANALYTICS_MODE", "split")
+ROUTES = {"plot": "yes", "text": "no"}
+
+PLAN_PROMPT = PromptTemplate(
+    input_variables=["query", "columns", "summary", "cube", "chat_history"],
+    template="""You are Analytica-AI, a data analysis assistant. Decide whether the user's request is best
+        answered with a chart or with text, and write the Python code that produces it.
+
+        **Dataset Info:**
+        Columns: {columns}
+        Summary: {summary}
+        Pre-aggregated tables: {cube}
+
+        **Recent Context (for reference only - do NOT repeat previous errors):**
+        {chat_history}
+
+        **Routing:**
+        - "plot" if the request asks for trends, comparisons, correlations, distributions, patterns, or
+          anything best shown with a chart/graph.
+        - "text" if it can be answered directly with text, a number, a fact, or a short explanation.
+
+        **Code for "plot":**
+        - The dataframe is available as `df`; do not create, reload or modify it, and only use the columns above.
+        - Import `plotly.express as px` and assign a Plotly Express figure to `fig`.
+        - Use `fig.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
+          margin=dict(l=0, r=0, t=40, b=0), title=dict(text="...", x=0.5))`, hide grid lines with
+          `fig.update_xaxes(showgrid=False)` and `fig.update_yaxes(showgrid=False)`, and add axis labels.
+        - Do not call `fig.show()`.
+
+        **Code for "text":**
+        - Generate pandas code using `df` and assign the final output to `result` (DataFrame, Series, scalar,
+          list or dict). For greetings or questions about capabilities assign a friendly string to `result`.
+        - For unclear requests raise a `ValueError` with a helpful suggestion.
+
+        **Both:**
+        - When pre-aggregated tables are available, compute sum, count, mean, min, max or size of a column
+          grouped by one or two of their dimensions with `cube.aggregate(by, column, func)` (add
+          `.reset_index()` for charts) instead of aggregating `df`. The tables always cover every row, so
+          when the question filters rows, group the filtered frame instead. Datetime columns have
+          `<column>_year`, `_quarter`, `_month`, `_week` and `_day` bucket dimensions.
+        - NO print statements, NO comments, NO markdown.
+
+        **Output:** a JSON object and nothing else:
+        {{"route": "plot" or "text", "code": "<python code>"}}
+
+        **Current User Query:** {query}
+        """
+)
+
+
+def parse(text):
+    """Return ("yes" | "no", code) from the model's JSON, "yes" meaning a chart"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").strip()
+        if text.lower().startswith("json"):
+            text = text[4:]
+    plan = json.loads(text)
+    if not isinstance(plan, dict):
+        raise ValueError(f"Unexpected plan: {text[:200]}")
+    route = ROUTES.get(str(plan.get("route", "")).lower())
+    code = plan.get("code")
+    if route is None or not isinstance(code, str) or not code.strip():
+        raise ValueError(f"Unexpected plan: {text[:200]}")
+    return route, code.strip()
+
+
+async def plan(df, query, chat_history=None):
+    """Route a question and write its code with a single model call"""
+    with tracing.span("plan") as attrs:
+        summary = await workers.run(profiling.summarize, df)
+        cube = await workers.run(cubes.for_frame, df)
+        text = await llm.ainvoke("planner", PLAN_PROMPT, {
+            "query": query,
+            "columns": list(df.columns),
+            "summary": summary,
+            "cube": cubes.describe(cube),
+            "chat_history": chat_history if chat_history else "No prior conversation.",
+        })
+        route, code = parse(text)
+        attrs["answer"] = route
+        tracing.code(attrs, code)
+    return route, code
@@ -0,0 +1,150 @@
+import os
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+load_dotenv()
+
+# Dataset summaries used in prompts, computed once per dataset version and
+# shared by graphgen, texanswer and cleaning (and across generation retries).
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "32"))
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+# id(frame) -> (weakref to the frame, version, layout when tagged)
+_tags = {}
+
+
+def _address(values):
+    return values.__array_interface__["data"][0] if isinstance(values, np.ndarray) else id(values)
+
+
+def _layout(df):
+    """Shape, columns, dtypes and the array behind every column.
+
+    Adding, dropping or reassigning columns or rows changes it; writing
+    single values in place (df.loc[0, "a"] = 1) does not.
+    """
+    return (df.shape, tuple(df.columns), tuple(map(str, df.dtypes)),
+            tuple(_address(df.iloc[:, i].values) for i in range(df.shape[1])))
+
+
+def tag(df, version):
+    """Mark a frame as an unmodified copy of a known dataset version.
+
+    The mark belongs to this object: it is dropped when the frame is
+    collected, so a new frame at the same address never inherits it, and
+    ignored once the frame's layout changes.
+    """
+    key = id(df)
+    # Runs during garbage collection, so no lock; a dict pop is atomic
+    ref = weakref.ref(df, lambda dead: _tags.pop(key, None) if _tags.get(key, (None,))[0] is dead else None)
+    _tags[key] = (ref, version, _layout(df))
+
+
+def _tagged(df):
+    entry = _tags.get(id(df))
+    if entry is not None and entry[0]() is df and entry[2] == _layout(df):
+        return entry[1]
+    return None
+
+
+def _cell_key(value):
+    """Text standing in for a non-string object cell when hashing rows"""
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)):
+        # Equal numbers match whatever their type, as they do when comparing rows
+        return f"\x01n{float(value)!r}"
+    return f"\x01{type(value).__name__}{value!r}"
+
+
+def row_digests(df):
+    """One 64-bit digest per row.
+
+    hash_pandas_object hashes object cells by their text and cannot hash
+    lists, so object columns holding anything but strings are hashed
+    through keys that also carry the cell type: 1 and '1' stay different.
+    """
+    keyed = {}
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i]
+        if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty"):
+            values = values.map(_cell_key)
+        keyed[i] = values
+    return pd.util.hash_pandas_object(pd.DataFrame(keyed, index=df.index), index=False).to_numpy()
+
+
+def fingerprint(df):
+    """Content fingerprint of a frame, or None if it cannot be hashed.
+
+    Frames from the dataset registry are tagged with their handle and are
+    not hashed. The hash is remembered for the frame so retries within a
+    request do not hash again.
+    """
+    version = _tagged(df)
+    if version is not None:
+        return version
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((df.shape, list(df.columns), [str(t) for t in df.dtypes])).encode())
+    try:
+        digest.update(row_digests(df).tobytes())
+        digest.update(pd.util.hash_pandas_object(df.index).to_numpy().tobytes())
+    except TypeError:
+        # Unhashable index labels
+        return None
+    tag(df, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def _python(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if hasattr(value, "item") else value
+
+
+def _profile(df, duplicates):
+    summary = {
+        "rows": df.shape[0],
+        "columns": df.shape[1],
+        "missing_values": df.isnull().sum().to_dict(),
+        "dtypes": df.dtypes.astype(str).to_dict(),
+        "sample": df.head(5).replace({np.nan: None}).to_dict(orient="records"),
+    }
+    try:
+        summary["cardinality"] = df.nunique().to_dict()
+    except TypeError:
+        pass
+    ranged = df.select_dtypes(include=[np.number, "datetime"])
+    ranged = ranged.loc[:, [not pd.api.types.is_bool_dtype(t) for t in ranged.dtypes]]
+    if not ranged.empty:
+        minimum, maximum = ranged.min(), ranged.max()
+        summary["range"] = {col: [_python(minimum[col]), _python(maximum[col])] for col in ranged.columns}
+    if duplicates:
+        summary["duplicates"] = int(df.duplicated().sum())
+    return summary
+
+
+def summarize(df, duplicates=False):
+    """Summary of a dataset for prompts, cached by content fingerprint with LRU eviction"""
+    key = fingerprint(df)
+    if key is None:
+        return _profile(df, duplicates)
+    key = (key, duplicates)
+    with _lock:
+        summary = _cache.get(key)
+        if summary is not None:
+            _cache.move_to_end(key)
+            return summary
+    summary = _profile(df, duplicates)
+    with _lock:
+        _cache[key] = summary
+        while len(_cache) > PROFILE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return summary
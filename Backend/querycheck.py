@@ -1,22 +1,13 @@
-from langchain_groq import ChatGroq
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
 import os
-from dotenv import load_dotenv
-load_dotenv()
-def pool(query,chat_history=None):
-    groq_api_key = os.getenv("GROQ_API_KEY")
-    llm = ChatGroq(
-        model="llama-3.3-70b-versatile",  
-        temperature=0,               
-        max_tokens=5,
-        groq_api_key=groq_api_key
-    )
-
-
-    prompt = PromptTemplate(
-        input_variables=["query","chat_history"],
-        template="""
+import re
+import time
+from langchain.prompts import PromptTemplate
+import llm
+import tracing
+
+POOL_PROMPT = PromptTemplate(
+    input_variables=["query","chat_history"],
+    template="""
     You are a strict classifier for data queries.
     Previous conversation context:
     {chat_history}
@@ -29,13 +20,80 @@ def pool(query,chat_history=None):
     User query: {query}
     Answer:
     """
-    )
+)
+
+# Tiered routing: obvious queries are answered locally and only ambiguous
+# ones pay for the LLM round-trip. Set FAST_CLASSIFIER=0 to always use the LLM.
+FAST_CLASSIFIER = os.getenv("FAST_CLASSIFIER", "1") != "0"
+
+# Tier 1: explicit wording. A request for a chart wins over everything else.
+GRAPH_RULE = re.compile(
+    r"\b(plot|chart|graph|visuali[sz]e|visuali[sz]ation|histogram|heat ?map|scatter|pie|"
+    r"box ?plot|diagram)s?\b"
+    r"|\bdistribution (of|for|across)\b|\btrends? (over|in|of|for|across|by)\b|\bover time\b"
+)
+TEXT_RULE = re.compile(
+    r"^\s*(hi|hello|hey|thanks|thank you|who are you|what can you do)\b"
+    r"|\bhow many\b|\bhow much\b"
+    r"|\bwhat (is|was|are) the (average|mean|median|total|sum|count|number|maximum|minimum|max|min|highest|lowest)\b"
+    r"|\b(list|name) (all|the)\b|\bwhich (row|rows|column|columns)\b|\bmissing values?\b"
+)
+
+# Tier 2: a small linear model over words. Positive weights lean towards a
+# chart, negative towards a text answer.
+LOCAL_WEIGHTS = {
+    "trend": 2, "trends": 2, "distribution": 2, "correlation": 1.5, "correlate": 1.5,
+    "relationship": 1.5, "pattern": 1.5, "patterns": 1.5, "compare": 1.5, "comparison": 1.5,
+    "versus": 1.5, "vs": 1.5, "breakdown": 1, "share": 1, "proportion": 1, "monthly": 1,
+    "yearly": 1, "weekly": 1, "daily": 1, "growth": 1, "across": 0.5, "by": 0.5, "per": 0.5,
+    "show": 0.5, "over": 0.5,
+    "what": -1, "which": -1, "who": -1, "when": -1, "list": -1.5, "count": -1, "number": -1,
+    "total": -1, "average": -1, "mean": -1, "median": -1, "maximum": -1, "minimum": -1,
+    "max": -1, "min": -1, "top": -0.5, "rows": -1, "columns": -1.5, "null": -1,
+    "describe": -1, "summary": -1.5, "summarize": -1.5, "explain": -1.5, "is": -0.5,
+    "are": -0.5, "does": -0.5, "many": -1,
+}
+LOCAL_THRESHOLD = 2.0
+
+_stats = {tier: {"hits": 0, "seconds": 0.0} for tier in ("rules", "local", "llm")}
+
 
+def classify_local(query):
+    """Return ("yes" | "no", tier) when the query is unambiguous, otherwise (None, None)"""
+    text = query.lower()
+    if GRAPH_RULE.search(text):
+        return "yes", "rules"
+    if TEXT_RULE.search(text):
+        return "no", "rules"
+    score = sum(LOCAL_WEIGHTS.get(word, 0) for word in re.findall(r"[a-z]+", text))
+    if score >= LOCAL_THRESHOLD:
+        return "yes", "local"
+    if score <= -LOCAL_THRESHOLD:
+        return "no", "local"
+    return None, None
 
 
-    chain = LLMChain(llm=llm, prompt=prompt)
+def stats():
+    """Hit rate and mean latency of each routing tier since startup"""
+    total = sum(tier["hits"] for tier in _stats.values())
+    return {
+        name: {
+            "hits": tier["hits"],
+            "hit_rate": tier["hits"] / total if total else 0.0,
+            "avg_ms": tier["seconds"] / tier["hits"] * 1000 if tier["hits"] else 0.0,
+        }
+        for name, tier in _stats.items()
+    }
 
 
-    result = chain.run({"query": query, "chat_history": chat_history if chat_history else "No prior conversation."})
-    print("Classifier result:", result.strip().lower())
-    return result.strip().lower()
+async def pool(query,chat_history=None):
+    start = time.perf_counter()
+    with tracing.span("classify") as attrs:
+        answer, tier = classify_local(query) if FAST_CLASSIFIER else (None, None)
+        if answer is None:
+            result = await llm.ainvoke("classifier", POOL_PROMPT, {"query": query, "chat_history": chat_history if chat_history else "No prior conversation."})
+            answer, tier = result.strip().lower(), "llm"
+        attrs.update(answer=answer, tier=tier)
+    _stats[tier]["hits"] += 1
+    _stats[tier]["seconds"] += time.perf_counter() - start
+    return answer
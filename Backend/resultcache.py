@@ -0,0 +1,130 @@
+import os
+import re
+import zlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import figures
+from dotenv import load_dotenv
+load_dotenv()
+
+# Answers to questions already asked about the same dataset version. Entries
+# are keyed on (dataset fingerprint, column schema, normalized query) and hold
+# the generated code that ran successfully plus the response it produced.
+RESULT_CACHE_MB = float(os.getenv("RESULT_CACHE_MB", "64"))
+# Cosine similarity above which a differently worded query reuses an entry
+# (0 disables near-duplicate matching)
+RESULT_CACHE_SIMILARITY = float(os.getenv("RESULT_CACHE_SIMILARITY", "0"))
+EMBEDDING_DIMS = 256
+
+FILLER_WORDS = {
+    "show", "me", "please", "the", "a", "an", "of", "can", "you", "could", "would", "give",
+    "display", "what", "is", "are", "for", "each", "all", "i", "want", "to", "see", "get",
+    "find", "tell", "about", "my", "data", "dataset", "us", "let", "lets", "some",
+}
+SYNONYMS = {
+    "per": "by", "across": "by", "vs": "versus", "avg": "average", "mean": "average",
+    "graph": "chart", "plot": "chart", "visualize": "chart", "visualise": "chart",
+    "visualization": "chart", "visualisation": "chart",
+}
+# Follow-ups that depend on the conversation rather than the dataset alone
+CONTEXTUAL = re.compile(r"\b(it|that|this|those|these|them|same|previous|again|instead|above|last one)\b")
+
+_entries = OrderedDict()
+_sizes = {}
+_total_bytes = 0
+_lock = threading.Lock()
+_stats = {"hits": 0, "near_hits": 0, "misses": 0, "bypassed": 0}
+
+
+def normalize(query):
+    words = re.findall(r"[a-z0-9_]+", query.lower())
+    words = [SYNONYMS.get(word, word) for word in words]
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+def embed(text):
+    """Hashed bag of words and character trigrams, L2-normalized"""
+    vector = np.zeros(EMBEDDING_DIMS)
+    for word in text.split():
+        padded = f"#{word}#"
+        for feature in [word] + [padded[i:i + 3] for i in range(len(padded) - 2)]:
+            bucket = zlib.crc32(feature.encode())
+            vector[bucket % EMBEDDING_DIMS] += 1.0 if bucket & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def schema_of(df):
+    return tuple(zip(map(str, df.columns), map(str, df.dtypes)))
+
+
+def cacheable(query):
+    return not CONTEXTUAL.search(query.lower())
+
+
+def _drop(key):
+    global _total_bytes
+    del _entries[key]
+    _total_bytes -= _sizes.pop(key)
+
+
+def _evict():
+    limit = RESULT_CACHE_MB * 1024 * 1024
+    while _entries and _total_bytes > limit:
+        _drop(next(iter(_entries)))
+
+
+def lookup(fingerprint, schema, query):
+    """Return the cached entry for a query, or None"""
+    if fingerprint is None or not cacheable(query):
+        _stats["bypassed"] += 1
+        return None
+    key = (fingerprint, schema, normalize(query))
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return entry
+        if RESULT_CACHE_SIMILARITY > 0:
+            candidates = [(k, e) for k, e in _entries.items() if k[:2] == key[:2]]
+            if candidates:
+                vector = embed(key[2])
+                scores = np.stack([e["embedding"] for _, e in candidates]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= RESULT_CACHE_SIMILARITY:
+                    _entries.move_to_end(candidates[best][0])
+                    _stats["near_hits"] += 1
+                    return candidates[best][1]
+        _stats["misses"] += 1
+    return None
+
+
+def store(fingerprint, schema, query, code, response):
+    """Remember the code and response of a successful answer"""
+    global _total_bytes
+    if fingerprint is None or not cacheable(query):
+        return
+    key = (fingerprint, schema, normalize(query))
+    entry = {"code": code, "response": response, "embedding": embed(key[2])}
+    size = len(figures.dumps(response)) + len(code or "")
+    with _lock:
+        if key in _entries:
+            _drop(key)
+        _entries[key] = entry
+        _sizes[key] = size
+        _total_bytes += size
+        _evict()
+
+
+def invalidate(fingerprint):
+    """Drop every entry for a dataset version, e.g. when it is replaced"""
+    with _lock:
+        for key in [key for key in _entries if key[0] == fingerprint]:
+            _drop(key)
+
+
+def stats():
+    return {**_stats, "entries": len(_entries), "bytes": _total_bytes}
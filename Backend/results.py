@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+load_dotenv()
+
+# Query results are pasted into the interpretation prompt. Small results go
+# in whole; larger ones are replaced by a bounded summary (shape, head and
+# tail, top values and describe() statistics) so the prompt, and the latency
+# of the interpretation call, stay about the same size whatever the query
+# returned.
+RESULT_MAX_TOKENS = int(os.getenv("RESULT_MAX_TOKENS", "1500"))
+# Results with at most this many rows are sent whole when they fit the budget
+RESULT_FULL_ROWS = int(os.getenv("RESULT_FULL_ROWS", "50"))
+# Text cells and labels longer than this are cut, so a few long strings
+# cannot blow the budget on their own
+RESULT_CELL_CHARS = int(os.getenv("RESULT_CELL_CHARS", "200"))
+PREVIEW_ROWS = 5
+TOP_K = 5
+# Rough size of a token in characters for English text and numbers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(value):
+    text = value if isinstance(value, str) else str(value)
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _clip(value):
+    if isinstance(value, (list, tuple, set, dict, bytes)):
+        value = str(value)
+    if isinstance(value, str) and len(value) > RESULT_CELL_CHARS:
+        return value[:RESULT_CELL_CHARS] + f"... [{len(value)} characters]"
+    return value
+
+
+def _clipped(plain):
+    """to_dict() output with long cells and labels cut to RESULT_CELL_CHARS"""
+    return {_clip(key): _clipped(value) if isinstance(value, dict) else _clip(value) for key, value in plain.items()}
+
+
+def _plain(frame):
+    return _clipped(frame.replace({np.nan: None}).to_dict())
+
+
+def _stats(frame):
+    numeric = frame.select_dtypes(include=[np.number])
+    numeric = numeric.loc[:, [not pd.api.types.is_bool_dtype(t) for t in numeric.dtypes]]
+    if numeric.empty:
+        return None
+    return _plain(numeric.describe().round(4))
+
+
+def _top(frame):
+    """Most frequent values of the text-like columns"""
+    top = {}
+    for col in frame.columns:
+        series = frame[col]
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+            continue
+        try:
+            counts = series.value_counts().head(TOP_K)
+        except TypeError:
+            # Unhashable cells such as nested lists
+            continue
+        top[col] = {_clip(str(k)): int(v) for k, v in counts.items()}
+    return top or None
+
+
+def _summary(value, columns):
+    frame = value.to_frame() if isinstance(value, pd.Series) else value
+    frame = frame.iloc[:, :columns]
+    summary = {
+        "note": f"Result too large to show in full, summarized from {len(value)} rows",
+        "shape": list(value.shape),
+        "dtypes": frame.dtypes.astype(str).to_dict(),
+        "head": _plain(frame.head(PREVIEW_ROWS)),
+        "tail": _plain(frame.tail(PREVIEW_ROWS)),
+    }
+    if isinstance(value, pd.Series) and pd.api.types.is_numeric_dtype(value) \
+            and not pd.api.types.is_bool_dtype(value):
+        summary["largest"] = _plain(value.nlargest(TOP_K))
+        summary["smallest"] = _plain(value.nsmallest(TOP_K))
+    stats = _stats(frame)
+    if stats:
+        summary["describe"] = stats
+    top = _top(frame)
+    if top:
+        summary["top_values"] = top
+    if frame.shape[1] < (value.shape[1] if value.ndim == 2 else 1):
+        summary["note"] += f", first {frame.shape[1]} of {value.shape[1]} columns"
+    return summary
+
+
+def _outline(value, max_tokens):
+    """Shape and column names only, for results whose summary is still over budget"""
+    names = [_clip(str(col)) for col in value.columns] if value.ndim == 2 else [_clip(str(value.name))]
+    shown = len(names)
+    while True:
+        outline = {
+            "note": f"Result too large to show, {len(value)} rows",
+            "shape": list(value.shape),
+            "columns": names[:shown],
+        }
+        if shown < len(names):
+            outline["note"] += f", first {shown} of {len(names)} column names"
+        if shown == 0 or estimate_tokens(outline) <= max_tokens:
+            return outline
+        shown //= 2
+
+
+def is_summary(result):
+    return isinstance(result, dict) and "note" in result and "shape" in result
+
+
+def shape_of(result):
+    """Shape of the original result behind a compact() value, None for scalars and text"""
+    if is_summary(result):
+        return result["shape"]
+    if not isinstance(result, dict):
+        return None
+    inner = [value for value in result.values() if isinstance(value, dict)]
+    if inner and len(inner) == len(result):
+        # DataFrame.to_dict() is keyed by column, then by row
+        return [len(inner[0]), len(result)]
+    return [len(result)]
+
+
+def compact(value, max_tokens=None):
+    """JSON-friendly form of a query result that fits within about max_tokens"""
+    max_tokens = RESULT_MAX_TOKENS if max_tokens is None else max_tokens
+    if isinstance(value, (list, tuple, set, np.ndarray)) and len(value) > RESULT_FULL_ROWS:
+        value = pd.Series(list(value))
+    elif isinstance(value, dict) and len(value) > RESULT_FULL_ROWS:
+        value = pd.Series(value)
+    elif isinstance(value, (list, tuple)):
+        value = type(value)(_clip(item) for item in value)
+    elif isinstance(value, dict):
+        value = _clipped(value)
+    if not hasattr(value, "to_dict"):
+        text = str(value)
+        suffix = f"... [truncated, {len(text)} characters in total]"
+        limit = max_tokens * CHARS_PER_TOKEN - len(suffix)
+        if len(text) > limit + len(suffix):
+            text = text[:max(limit, 0)] + suffix
+        return text
+    if len(value) <= RESULT_FULL_ROWS:
+        full = _plain(value)
+        if estimate_tokens(full) <= max_tokens:
+            return full
+    # Wide results drop columns until the summary fits
+    columns = value.shape[1] if value.ndim == 2 else 1
+    while True:
+        summary = _summary(value, columns)
+        if estimate_tokens(summary) <= max_tokens:
+            return summary
+        if columns <= 1:
+            return _outline(value, max_tokens)
+        columns = max(1, columns // 2)
@@ -0,0 +1,509 @@
+import os
+import sys
+import time
+import queue
+import pickle
+import importlib
+import atexit
+import asyncio
+import threading
+import functools
+import contextvars
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import profiling
+import figures
+import results
+import workers
+import tracing
+from dotenv import load_dotenv
+load_dotenv()
+
+try:
+    import duckdb
+except ImportError:
+    # Only needed for the SQL engine of text answers
+    duckdb = None
+
+# LLM-generated code runs in a pool of pre-warmed worker processes, so a
+# runaway loop or a crash cannot stall the API process. Each run has a
+# wall-clock and a memory limit; a worker that exceeds one is killed and
+# replaced. Datasets reach the workers through shared memory as Arrow IPC
+# buffers. SANDBOX=0 runs snippets in-process instead.
+SANDBOX = os.getenv("SANDBOX", "1") != "0"
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "30"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))
+# Address space a worker may add after startup, enforced by the kernel. It
+# counts mapped datasets and reserved but untouched memory, so it is larger
+# than the RSS limit that is polled during a run (0 = no hard cap).
+SANDBOX_ADDRESS_SPACE_MB = int(os.getenv("SANDBOX_ADDRESS_SPACE_MB", str(4 * SANDBOX_MEMORY_MB)))
+# Started workers kept in reserve to replace killed ones
+SANDBOX_SPARES = int(os.getenv("SANDBOX_SPARES", "1"))
+# Datasets kept in shared memory between runs
+SANDBOX_SHARED_DATASETS = int(os.getenv("SANDBOX_SHARED_DATASETS", "4"))
+# forkserver forks workers from a process that already imported pandas and
+# plotly, so starting a worker does not pay for those imports
+SANDBOX_START_METHOD = os.getenv("SANDBOX_START_METHOD",
+                                 "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+PRELOAD = ["sandbox", "plotly.express", "plotly.graph_objects"]
+
+# Graph and query code on large datasets first runs on the first DRY_RUN_ROWS
+# rows, so mistakes that do not depend on the data fail in milliseconds
+# instead of after a full pass. DRY_RUN_ROWS=0 disables the dry run.
+DRY_RUN_ROWS = int(os.getenv("DRY_RUN_ROWS", "1000"))
+DRY_RUN_MIN_ROWS = 20 * DRY_RUN_ROWS
+DRY_RUN_TASKS = ("graph", "query")
+# Errors on the sample that the whole dataset would raise too; others, even
+# AttributeError or TypeError (e.g. .str on a column that is empty in the
+# sample), may depend on the rows left out, so the full run decides
+DRY_RUN_ERRORS = (NameError, ImportError, SyntaxError)
+
+POLL_SECONDS = 0.05
+# Decoded datasets each worker keeps between runs
+WORKER_FRAMES = 2
+# With copy-on-write (pandas 3) a shallow copy already keeps a cached frame intact
+SHALLOW_COPY = int(pd.__version__.split(".")[0]) >= 3
+
+
+def graph_task(code, df, cube=None):
+    """Run generated Plotly code and return (encoded figure, reduced traces), or None if no figure was made"""
+    exec_globals = {'pd': pd, 'df': df, 'cube': cube.bind(df) if cube is not None else None, 'go': None, 'px': None, 'fig': None}
+    exec(code, exec_globals)
+    fig = exec_globals.get('fig')
+    if not fig:
+        return None
+    return figures.encode(fig)
+
+
+def query_task(code, df, cube=None):
+    """Run generated pandas code and return its `result` in a bounded, JSON friendly form"""
+    local_env = {"pd": pd, "df": df, "cube": cube.bind(df) if cube is not None else None}
+    exec(code, local_env)
+    return results.compact(local_env.get("result"))
+
+
+_database = None
+
+
+def _sql_connection():
+    """New connection to a per-process in-memory database, opening it takes ~15 ms"""
+    global _database
+    if _database is None:
+        # No file, network or extension access, queries only see the frame
+        _database = duckdb.connect(config={"enable_external_access": False})
+    # Each cursor has its own registered views, so concurrent runs do not clash
+    return _database.cursor()
+
+
+def sql_task(code, df, cube=None):
+    """Run a generated DuckDB query over `df` and return its result in the same form as query_task"""
+    if duckdb is None:
+        raise RuntimeError("The SQL engine needs the duckdb package")
+    connection = _sql_connection()
+    try:
+        statements = connection.extract_statements(code)
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            raise ValueError("Generated SQL must be a single SELECT statement")
+        try:
+            # DuckDB scans Arrow without converting pandas string columns row by row
+            connection.register("df", pa.Table.from_pandas(df, preserve_index=False))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            connection.register("df", df)
+        result = connection.execute(code).df()
+    finally:
+        connection.close()
+    # A single value reads like a pandas scalar, anything else like a DataFrame
+    if result.shape == (1, 1):
+        result = result.iat[0, 0]
+    return results.compact(result)
+
+
+def cleaning_task(code, df, input_path=None, output_path=None):
+    """Run generated cleaning code against `df`, or against Parquet files when paths are given"""
+    if input_path:
+        exec(code, {"pd": pd, "np": np, "input_path": input_path, "output_path": output_path})
+        return None
+    local_env = {"pd": pd, "np": np, "df": df}
+    exec(code, local_env)
+    cleaned_df = local_env.get("cleaned_df", local_env.get("df"))
+    if not isinstance(cleaned_df, pd.DataFrame):
+        raise ValueError("Generated cleaning code did not produce a DataFrame")
+    return cleaned_df
+
+
+TASKS = {"graph": graph_task, "query": query_task, "sql": sql_task, "cleaning": cleaning_task}
+
+
+def _run_task(task, code, df, args):
+    """Run a task, after a dry run on a sample of a large dataset"""
+    if DRY_RUN_ROWS and task in DRY_RUN_TASKS and df is not None and len(df) >= DRY_RUN_MIN_ROWS:
+        try:
+            TASKS[task](code, df.head(DRY_RUN_ROWS), *args)
+        except DRY_RUN_ERRORS:
+            raise
+        except Exception:
+            pass
+    return TASKS[task](code, df, *args)
+
+
+def _encode(df):
+    """Serialize a frame into a shared memory block, as Arrow IPC when possible"""
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed-type object columns cannot be stored as Arrow
+        payload = pickle.dumps(df, protocol=5)
+        block = shared_memory.SharedMemory(create=True, size=max(len(payload), 1))
+        block.buf[:len(payload)] = payload
+        return block, "pickle", len(payload)
+    sizer = pa.MockOutputStream()
+    with pa.ipc.new_stream(sizer, table.schema) as writer:
+        writer.write_table(table)
+    size = sizer.size()
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    # Arrow writes straight into the shared block
+    sink = pa.FixedSizeBufferWriter(pa.py_buffer(block.buf))
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    sink.close()
+    del sink
+    return block, "arrow", size
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 there is no track flag. Workers share the parent's
+        # resource tracker, so the registration goes away when the parent unlinks.
+        return shared_memory.SharedMemory(name=name)
+
+
+def _decode(name, fmt, size):
+    """Return (frame, block) for a shared dataset.
+
+    Arrow-backed columns keep pointing into the block, so it stays open for
+    as long as the frame is used.
+    """
+    block = _attach(name)
+    if fmt == "arrow":
+        df = pa.ipc.open_stream(pa.py_buffer(block.buf[:size])).read_all().to_pandas()
+    else:
+        df = pickle.loads(block.buf[:size])
+    return df, block
+
+
+def _forget(entry):
+    """Drop a decoded frame, then unmap its shared block"""
+    block = entry.pop()
+    entry.clear()
+    try:
+        block.close()
+    except BufferError:
+        # Still referenced elsewhere, the mapping goes away with the last reference
+        pass
+
+
+def _generated_exit(e):
+    return RuntimeError(f"Generated code raised {type(e).__name__}: {e}")
+
+
+def _limit_address_space():
+    """Hard memory cap for the worker on top of what it uses after startup.
+
+    Polling RSS can miss an allocation that grows faster than the poll
+    interval, the kernel refuses it instead and the code gets a MemoryError.
+    """
+    if resource is None or SANDBOX_ADDRESS_SPACE_MB <= 0:
+        return
+    try:
+        with open("/proc/self/statm") as f:
+            baseline = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return
+    limit = baseline + SANDBOX_ADDRESS_SPACE_MB * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        print(f"Could not limit sandbox worker memory: {e}")
+
+
+def _serve(conn):
+    """Worker process loop: receive (task, code, dataset, args), send back (ok, value)"""
+    # Import plotting once at startup rather than in the first run
+    for module in PRELOAD:
+        importlib.import_module(module)
+    _limit_address_space()
+    frames = OrderedDict()
+    conn.send("ready")
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            message = None
+        if message is None:
+            for entry in frames.values():
+                _forget(entry)
+            return
+        task, code, dataset, args = message
+        try:
+            df = None
+            if dataset is not None:
+                name, fmt, size = dataset
+                if name not in frames:
+                    frames[name] = list(_decode(name, fmt, size))
+                    while len(frames) > WORKER_FRAMES:
+                        _forget(frames.popitem(last=False)[1])
+                frames.move_to_end(name)
+                df = frames[name][0]
+                # Generated code may modify df, keep the cached frame intact
+                df = df.copy(deep=not SHALLOW_COPY)
+            reply = (True, _run_task(task, code, df, args))
+        except Exception as e:
+            reply = (False, e)
+        except BaseException as e:
+            # SystemExit and the like would get past the callers' retry on Exception
+            reply = (False, _generated_exit(e))
+        try:
+            conn.send(reply)
+        except Exception:
+            conn.send((False, RuntimeError(f"{type(reply[1]).__name__}: {reply[1]}")))
+        # An exception's traceback would keep the dataset alive
+        df = reply = None
+
+
+def _rss_mb(pid):
+    """Resident memory of a process in MB, or None where /proc is not available"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Worker:
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def wait_ready(self):
+        try:
+            started = self.conn.poll(SANDBOX_TIMEOUT * 4) and self.conn.recv() == "ready"
+        except (EOFError, OSError) as e:
+            # The worker died during startup
+            raise RuntimeError("Sandbox worker did not start") from e
+        if not started:
+            raise RuntimeError("Sandbox worker did not start")
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+
+class Pool:
+    def __init__(self, size=SANDBOX_WORKERS):
+        self.size = size
+        self.context = multiprocessing.get_context(SANDBOX_START_METHOD)
+        if SANDBOX_START_METHOD == "forkserver":
+            self.context.set_forkserver_preload(PRELOAD)
+        self.idle = queue.Queue()
+        self.spares = queue.Queue()
+        self.segments = OrderedDict()
+        self.lock = threading.Lock()
+        self.replaced = 0
+        self.closed = False
+        if sys.platform != "linux":
+            print("Sandbox memory limit is only enforced on Linux")
+        starting = [Worker(self.context) for _ in range(size)]
+        for worker in starting:
+            worker.wait_ready()
+            self.idle.put(worker)
+        for _ in range(SANDBOX_SPARES):
+            self._spawn(self.spares)
+
+    def _spawn(self, target):
+        """Start a worker in the background and put it on `target` once it is ready"""
+        def spawn():
+            while not self.closed:
+                fresh = Worker(self.context)
+                try:
+                    fresh.wait_ready()
+                except Exception as e:
+                    fresh.kill()
+                    if not self.closed:
+                        print(f"Could not start sandbox worker: {e!r}")
+                        time.sleep(1)
+                    continue
+                if self.closed:
+                    fresh.kill()
+                else:
+                    target.put(fresh)
+                return
+
+        threading.Thread(target=spawn, daemon=True).start()
+
+    def _replace(self, worker):
+        worker.kill()
+        self.replaced += 1
+        # A ready spare takes over at once; starting a worker can take seconds
+        try:
+            self.idle.put(self.spares.get_nowait())
+            self._spawn(self.spares)
+        except queue.Empty:
+            self._spawn(self.idle)
+
+    def _share(self, df):
+        """Return (key, entry) for the shared block holding df; key is None for a one-off block"""
+        key = profiling.fingerprint(df)
+        with self.lock:
+            entry = self.segments.get(key) if key is not None else None
+            if entry is not None:
+                self.segments.move_to_end(key)
+                entry["users"] += 1
+                return key, entry
+        block, fmt, size = _encode(df)
+        entry = {"block": block, "dataset": (block.name, fmt, size), "users": 1}
+        if key is None:
+            return None, entry
+        with self.lock:
+            existing = self.segments.get(key)
+            if existing is not None:
+                # Another request shared the same dataset meanwhile
+                block.close()
+                block.unlink()
+                existing["users"] += 1
+                return key, existing
+            self.segments[key] = entry
+            idle = [k for k, e in self.segments.items() if e["users"] == 0]
+            while len(self.segments) > SANDBOX_SHARED_DATASETS and idle:
+                stale = self.segments.pop(idle.pop(0))
+                stale["block"].close()
+                stale["block"].unlink()
+        return key, entry
+
+    def _release(self, key, entry):
+        with self.lock:
+            entry["users"] -= 1
+            if key is None:
+                entry["block"].close()
+                entry["block"].unlink()
+
+    def execute(self, task, code, df=None, *args, timeout=None, memory_mb=None):
+        timeout = SANDBOX_TIMEOUT if timeout is None else timeout
+        memory_mb = SANDBOX_MEMORY_MB if memory_mb is None else memory_mb
+        shared = self._share(df) if df is not None else None
+        try:
+            worker = self.idle.get()
+            dataset = shared[1]["dataset"] if shared else None
+            deadline = time.monotonic() + timeout
+            try:
+                worker.conn.send((task, code, dataset, args))
+                while not worker.conn.poll(POLL_SECONDS):
+                    if not worker.process.is_alive():
+                        raise RuntimeError(f"Sandbox worker exited with code {worker.process.exitcode} while running generated code")
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Generated code did not finish within {timeout:g} seconds")
+                    rss = _rss_mb(worker.process.pid)
+                    if rss is not None and rss > memory_mb:
+                        raise MemoryError(f"Generated code used more than {memory_mb} MB of memory")
+                ok, value = worker.conn.recv()
+            except (TimeoutError, MemoryError, RuntimeError):
+                self._replace(worker)
+                raise
+            except (EOFError, OSError) as e:
+                self._replace(worker)
+                raise RuntimeError("Sandbox worker crashed while running generated code") from e
+            self.idle.put(worker)
+        finally:
+            if shared:
+                self._release(*shared)
+        if not ok:
+            raise value
+        return value
+
+    def close(self):
+        self.closed = True
+        for workers_queue in (self.idle, self.spares):
+            while True:
+                try:
+                    worker = workers_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.kill()
+        with self.lock:
+            for entry in self.segments.values():
+                entry["block"].close()
+                entry["block"].unlink()
+            self.segments.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# One waiting thread per worker, further runs queue without holding a thread
+_waiters = ThreadPoolExecutor(max_workers=SANDBOX_WORKERS, thread_name_prefix="sandbox")
+
+
+def start():
+    """Start the worker pool, e.g. at application startup. Safe to call more than once."""
+    global _pool
+    with _pool_lock:
+        if _pool is None and SANDBOX:
+            _pool = Pool()
+    return _pool
+
+
+def stop():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+# Shared memory blocks outlive the process unless they are unlinked
+atexit.register(stop)
+
+
+def execute(task, code, df=None, *args, **limits):
+    """Run a snippet task ("graph", "query", "sql" or "cleaning") and return its result.
+
+    Errors raised by the generated code are re-raised here. Exceeding the
+    time or memory limit raises TimeoutError or MemoryError.
+    """
+    with tracing.span(f"sandbox.{task}", rows=len(df) if df is not None else None):
+        if not SANDBOX:
+            try:
+                return _run_task(task, code, df, args)
+            except SystemExit as e:
+                raise _generated_exit(e)
+        return start().execute(task, code, df, *args, **limits)
+
+
+async def run(task, code, df=None, *args, **limits):
+    """Async counterpart of execute() for use inside request handlers."""
+    if not SANDBOX:
+        return await workers.run(execute, task, code, df, *args, **limits)
+    loop = asyncio.get_running_loop()
+    # Keep the request's context, e.g. its trace, in the waiting thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_waiters, functools.partial(context.run, execute, task, code, df, *args, **limits))
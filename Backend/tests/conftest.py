@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The backend is a flat set of modules run from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "offline")
+os.environ.setdefault("TRACE_LOG", "0")
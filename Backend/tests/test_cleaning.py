@@ -0,0 +1,74 @@
+import pandas as pd
+
+import cleaning
+import llm
+import sandbox
+
+
+FILL = {"handleMissing": 1, "standardizeFormats": 1}
+REMOVE = {"handleMissing": 1, "missingStrategy": "remove"}
+
+
+def test_list_and_dict_cells_are_kept():
+    data = [{"a": " x ", "b": [1, 2]}, {"a": "", "b": {"k": 1}}]
+    assert cleaning.manual_cleaning(data, FILL) == [{"a": "X", "b": [1, 2]}, {"a": "0", "b": {"k": 1}}]
+
+
+def test_missing_keys_are_not_filled():
+    data = [{"a": "x", "b": None}, {"a": "y"}]
+    assert cleaning.manual_cleaning(data, FILL) == [{"a": "X", "b": "0"}, {"a": "Y", "b": None}]
+
+
+def test_missing_keys_do_not_remove_rows():
+    data = [{"a": "x", "b": ""}, {"a": "y"}]
+    assert cleaning.manual_cleaning(data, REMOVE) == [{"a": "y"}]
+
+
+def test_missing_key_differs_from_none_for_duplicates():
+    data = [{"a": "y"}, {"a": "y", "b": None}, {"a": "y"}]
+    result = cleaning.manual_cleaning(data, {"removeDuplicates": 1})
+    assert result == [{"a": "y", "b": None}, {"a": "y", "b": None}]
+
+
+def _string_records(values):
+    # What CleaningPage.jsx posts: Papa.parse without dynamicTyping yields strings only
+    return [{"name": "row", "value": value} for value in values]
+
+
+def test_outliers_removed_from_string_numbers():
+    data = _string_records([str(i % 10 + 1) for i in range(200)] + ["100000"])
+    for method in cleaning.OUTLIER_METHODS:
+        result = cleaning.manual_cleaning(data, {"removeOutliers": 1, "outlierMethod": method})
+        assert len(result) == 200
+        assert all(row["value"] != "100000" for row in result)
+
+
+def test_outliers_removed_among_blanks_and_filled_zeros():
+    values = [str(i % 10 + 1) if i % 5 else "" for i in range(200)] + ["100000"]
+    data = _string_records(values)
+    assert len(cleaning.manual_cleaning(data, {"removeOutliers": 1})) == 200
+    filled = cleaning.manual_cleaning(data, {"handleMissing": 1, "removeOutliers": 1})
+    assert len(filled) == 200
+    assert sum(row["value"] == "0" for row in filled) == 40
+
+
+def test_text_columns_are_not_numeric():
+    data = _string_records(["a", "b", "c"] * 10 + ["100000"])
+    assert len(cleaning.manual_cleaning(data, {"removeOutliers": 1})) == 31
+
+
+def test_keys_only_removed_records_had_are_dropped():
+    data = [{"a": "x", "b": ""}, {"a": "y"}, {"a": "z", "c": "w"}]
+    assert cleaning.manual_cleaning(data, REMOVE) == [{"a": "y", "c": None}, {"a": "z", "c": "w"}]
+    # A key that is present but empty in every kept record stays
+    data = [{"a": "x", "b": None}, {"a": "x", "b": None}]
+    assert cleaning.manual_cleaning(data, {"removeDuplicates": 1}) == [{"a": "x", "b": None}]
+
+
+def test_generated_cleaning_code_mentioning_python_runs_whole(monkeypatch):
+    monkeypatch.setattr(llm, "_clients", dict(llm._clients))
+    monkeypatch.setattr(sandbox, "SANDBOX", False)
+    code = "```python\n# plain python, no files\ncleaned_df = df.drop_duplicates()\ncleaned_df['n'] = 1\n```"
+    llm.use_fake("cleaning", code)
+    df = pd.DataFrame({"a": [1, 1, 2]})
+    assert cleaning.agent_cleaning(df).to_dict("records") == [{"a": 1, "n": 1}, {"a": 2, "n": 1}]
@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+
+import codecheck
+import results
+import sandbox
+
+COLUMNS = ["region", "Total_Sales", "channel"]
+
+
+def test_misspelled_columns_on_df_are_repaired():
+    code, fixes = codecheck.check("result = df.groupby('Region')[df['total sales'] > 0].size()", COLUMNS)
+    assert "df.groupby('region')[df['Total_Sales'] > 0]" in code
+    assert ("Region", "region") in fixes
+
+
+def test_misspelled_attribute_column_is_repaired():
+    code, _ = codecheck.check("result = df.chanel.value_counts()", COLUMNS)
+    assert "df.channel.value_counts()" in code
+
+
+def test_dict_keys_are_not_rewritten():
+    code = "labels = {'regoin': 'Region'}\nresult = labels['regoin']"
+    assert codecheck.check(code, COLUMNS) == (code, [])
+
+
+def test_missing_column_on_df_is_rejected():
+    with pytest.raises(ValueError, match="does not exist"):
+        codecheck.check("result = df['profit'].mean()", COLUMNS)
+
+
+@pytest.mark.parametrize("name", ["open", "input", "vars"])
+def test_local_variables_may_use_builtin_names(name):
+    code = f"{name} = df['region'].nunique()\nresult = {name} + 1"
+    assert codecheck.check(code, COLUMNS) == (code, [])
+
+
+@pytest.mark.parametrize("code", ["result = open('/etc/passwd').read()", "f = eval\nresult = f('1')",
+                                  "result = vars()"])
+def test_forbidden_builtins_are_rejected(code):
+    with pytest.raises(ValueError, match="not allowed"):
+        codecheck.check(code, COLUMNS)
+
+
+@pytest.mark.parametrize("code", [
+    "result = __builtins__['open']('/etc/passwd').read()",
+    "result = getattr(pd, 'read_' + 'csv')('/etc/passwd')",
+    "result = pd.io.common.os.listdir('/')",
+    "df.to_json('/tmp/out.json')\nresult = 1",
+    "import numpy as np\nnp.save('/tmp/out.npy', df.to_numpy())\nresult = 1",
+])
+def test_known_bypasses_are_rejected(code):
+    with pytest.raises(ValueError, match="not allowed"):
+        codecheck.check(code, COLUMNS)
+
+
+@pytest.mark.parametrize("code", [
+    "from pandas.io.common import os", "import pandas.core.frame as frame\nresult = frame.sys",
+    "result = pd.core.common.inspect", "result = {}['__class__']", "result = df.to_string('/tmp/out')",
+])
+def test_modules_and_io_reached_other_ways_are_rejected(code):
+    with pytest.raises(ValueError, match="not allowed"):
+        codecheck.check(code, COLUMNS)
+
+
+@pytest.mark.parametrize("code", [
+    "result = df.groupby('region')['Total_Sales'].sum().to_dict()",
+    "import numpy as np\nresult = np.sum(df['Total_Sales'].to_numpy())",
+    "import plotly.express as px\nfig = px.pie(df, names='region', color_discrete_sequence=px.colors.qualitative.Plotly)",
+])
+def test_conversions_and_plotly_colors_are_allowed(code):
+    assert codecheck.check(code, COLUMNS) == (code, [])
+
+
+def test_dry_run_does_not_reject_data_dependent_errors(monkeypatch):
+    monkeypatch.setattr(sandbox, "DRY_RUN_ROWS", 10)
+    monkeypatch.setattr(sandbox, "DRY_RUN_MIN_ROWS", 20)
+    # The sample has no text in `name`, so .str raises AttributeError there only
+    df = pd.DataFrame({"name": [None] * 10 + ["a"] * 20})
+    result = sandbox._run_task("query", "result = int(df['name'].dropna().str.len().sum())", df, ())
+    assert result == results.compact(20)
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import codecheck
+import cubes
+
+
+@pytest.fixture
+def sales():
+    rng = np.random.default_rng(0)
+    rows = 2000
+    return pd.DataFrame({
+        "region": rng.choice(["north", "south", "east", "west"], rows),
+        "product": rng.choice(["a", "b", "c"], rows),
+        "ordered": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 700, rows), unit="D"),
+        "sales": rng.random(rows) * 100,
+    })
+
+
+def test_disabled_by_default():
+    assert cubes.CUBES is False
+
+
+def test_pairs_are_capped(monkeypatch):
+    monkeypatch.setattr(cubes, "CUBE_MAX_PAIRS", 3)
+    df = pd.DataFrame({f"d{i}": np.arange(100) % (i + 2) for i in range(10)})
+    df["value"] = np.arange(100) * 1.5
+    cube = cubes.build(df)
+    assert sum(len(key) == 2 for key in cube.tables) == 3
+
+
+def test_bucket_dimension_falls_back_to_the_frame(sales, monkeypatch):
+    # A cube without the table for this bucket has to group the frame itself
+    cube = cubes.build(sales)
+    partial = cubes.Cube({}, cube.measures, cube.buckets).bind(sales)
+    expected = sales.groupby(sales["ordered"].dt.to_period("M").dt.start_time)["sales"].sum()
+    result = partial.aggregate("ordered_month", "sales", "sum")
+    assert np.allclose(result.to_numpy(), expected.to_numpy())
+    assert np.allclose(cube.aggregate("ordered_month", "sales", "sum").to_numpy(), expected.to_numpy())
+
+
+def test_build_runs_in_the_background(sales, monkeypatch):
+    monkeypatch.setattr(cubes, "CUBES", True)
+    assert cubes.for_frame(sales) is None
+    for _ in range(100):
+        cube = cubes.for_frame(sales)
+        if cube is not None:
+            break
+        cubes._builder.submit(lambda: None).result()
+    assert ("region",) in cube.tables
+
+
+@pytest.mark.parametrize("code", [
+    "df = df[df['region'] == 'north']\nresult = cube.aggregate('product', 'sales')",
+    "north = df[df['region'] == 'north']\nresult = cube.aggregate('product', 'sales')",
+    "result = df.query('sales > 10') if False else cube.aggregate('product', 'sales')",
+    "part = df.loc[df['sales'] > 10]\nresult = cube.aggregate('product', 'sales')",
+])
+def test_cube_with_filtered_rows_is_rejected(sales, code):
+    with pytest.raises(ValueError, match="whole dataset"):
+        codecheck.check(code, sales.columns)
+
+
+def test_cube_with_whole_frame_is_accepted(sales):
+    code = "result = cube.aggregate('product', 'sales').sort_values().head(2)\nn = df['sales'].dropna()"
+    assert codecheck.check(code, sales.columns) == (code, [])
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import datastore
+import fakes
+
+ROWS = [{"city": "Pune", "amount": 10.5}, {"city": "Delhi", "amount": 3.0}]
+
+
+@pytest.fixture
+def http(monkeypatch, tmp_path):
+    monkeypatch.setattr(datastore, "DATASET_DIR", str(tmp_path))
+    monkeypatch.setattr(datastore, "_cache", datastore.OrderedDict())
+    monkeypatch.setattr(datastore, "_handles", {})
+    monkeypatch.setattr(app, "supabase", fakes.FakeSupabase())
+    return TestClient(app.app)
+
+
+def test_upload_returns_a_handle_to_the_stored_frame(http):
+    body = http.post("/datasets", json={"data": ROWS, "c_id": "chat"}).json()
+    assert body["rows"] == 2 and body["columns"] == ["city", "amount"]
+    assert datastore.handle_for("chat") == body["dataset_id"]
+    # Read back from disk, not from the in-memory copy
+    datastore._cache.clear()
+    pd.testing.assert_frame_equal(datastore.load(body["dataset_id"]), pd.DataFrame(ROWS))
+
+
+def test_loaded_frames_are_copies(http):
+    dataset_id = http.post("/datasets", json={"data": ROWS, "c_id": "chat"}).json()["dataset_id"]
+    df = datastore.load(dataset_id)
+    df["amount"] = 0
+    assert datastore.load(dataset_id)["amount"].tolist() == [10.5, 3.0]
+
+
+def test_uploading_again_replaces_the_chat_dataset(http):
+    first = http.post("/datasets", json={"data": ROWS, "c_id": "chat"}).json()["dataset_id"]
+    second = http.post("/datasets", json={"data": ROWS[:1], "c_id": "chat"}).json()["dataset_id"]
+    assert datastore.handle_for("chat") == second
+    with pytest.raises(KeyError):
+        datastore.load(first)
+    assert len(datastore.load(second)) == 1
+
+
+def test_unknown_or_missing_dataset(http):
+    assert http.post("/query", json={"query": "total", "dataset_id": "f" * 32}).status_code == 404
+    assert http.post("/query", json={"query": "total", "dataset_id": "../../etc/passwd"}).status_code == 404
+    assert http.post("/query", json={"query": "total"}).status_code == 400
@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+import figures
+
+
+def decoded(spec):
+    return figures._as_array(spec)
+
+
+def test_integers_use_the_smallest_typed_array():
+    spec = figures.compact(np.arange(100))
+    assert spec["dtype"] == "i1"
+    assert decoded(spec).tolist() == list(range(100))
+    # plotly.js has no 64-bit integers
+    assert figures.compact(np.arange(20, dtype=np.int64) + 2 ** 40)["dtype"] == "f8"
+
+
+def test_short_and_non_numeric_arrays_stay_lists():
+    assert figures.compact([1, 2, 3]) == [1, 2, 3]
+    assert figures.compact(np.array(["a", None], dtype=object)) == ["a", None]
+    assert figures.compact({"x": float("nan"), "y": np.float32(1.5)}) == {"x": None, "y": 1.5}
+
+
+def test_dumps_embeds_raw_json_as_is():
+    text = figures.dumps({"type": "plot", "figure": figures.RawJSON('{"data":[]}')})
+    assert json.loads(text) == {"type": "plot", "figure": {"data": []}}
+    assert figures.plain({"figure": figures.RawJSON('{"data":[]}')}) == {"figure": {"data": []}}
+
+
+def test_dates_become_epoch_milliseconds_on_a_date_axis():
+    dates = pd.date_range("2024-01-01", periods=30, freq="D")
+    raw, _ = figures.encode(go.Figure(go.Scatter(x=dates, y=np.arange(30))))
+    figure = json.loads(raw.text)
+    assert figure["layout"]["xaxis"]["type"] == "date"
+    assert decoded(figure["data"][0]["x"])[0] == pd.Timestamp("2024-01-01").value / 1e6
+
+
+def test_dense_line_keeps_its_peaks_and_ends():
+    y = np.sin(np.linspace(0, 20, 50_000))
+    y[12_345] = 10.0
+    raw, reduced = figures.encode(go.Figure(go.Scatter(y=y, mode="lines")), max_points=500)
+    trace = json.loads(raw.text)["data"][0]
+    kept = decoded(trace["y"])
+    assert reduced[0]["method"] == "lttb" and len(kept) <= 502
+    assert kept[0] == y[0] and kept[-1] == y[-1] and kept.max() == 10.0
+
+
+def test_dense_markers_are_binned_with_counts():
+    rng = np.random.default_rng(0)
+    raw, reduced = figures.encode(go.Figure(go.Scatter(x=rng.random(20_000), y=rng.random(20_000), mode="markers")),
+                                  max_points=400)
+    trace = json.loads(raw.text)["data"][0]
+    assert reduced[0]["method"] == "binned"
+    assert decoded(trace["customdata"]).sum() == 20_000
+    assert len(decoded(trace["x"])) <= 400
+
+
+def test_small_figures_are_not_reduced():
+    _, reduced = figures.encode(go.Figure(go.Scatter(y=np.arange(100))), max_points=500)
+    assert reduced == []
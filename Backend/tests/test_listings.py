@@ -0,0 +1,47 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import fakes
+
+
+@pytest.fixture
+def client(monkeypatch):
+    db = fakes.FakeSupabase()
+    monkeypatch.setattr(app, "supabase", db)
+    # Without the context manager the startup event, which connects, does not run
+    return db, TestClient(app.app)
+
+
+def test_chats_sharing_a_timestamp_are_all_listed(client):
+    db, http = client
+    for i in range(7):
+        chat = db.new_row("Chat", {"name": f"chat {i}", "userid": "u"})
+        # Three chats at each of three times
+        chat["created_at"] = f"2024-01-01T00:00:0{i // 3}+00:00"
+        db.tables.setdefault("Chat", []).append(chat)
+    seen, params = [], {"limit": 2}
+    while True:
+        body = http.get("/chats/u/page", params=params).json()
+        seen.extend(chat["c_id"] for chat in body["items"])
+        if body["next_before"] is None:
+            break
+        params = {"limit": 2, "before": body["next_before"], "before_id": body["next_before_id"]}
+    assert sorted(seen) == sorted(chat["c_id"] for chat in db.tables["Chat"])
+    assert len(seen) == len(set(seen))
+
+
+def test_message_etag(client):
+    db, http = client
+    db.tables["messages"] = [db.new_row("messages", {"c_id": "chat", "query": "q", "response": "r"})]
+    message_id = db.tables["messages"][0]["id"]
+    first = http.get(f"/message/{message_id}")
+    assert first.status_code == 200 and first.json()["response"] == "r"
+    again = http.get(f"/message/{message_id}", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+
+
+@pytest.mark.parametrize("tag", ['"message-999"', "*"])
+def test_unknown_message_is_not_found_whatever_the_client_has(client, tag):
+    _, http = client
+    assert http.get("/message/999", headers={"If-None-Match": tag}).status_code == 404
@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+from langchain.prompts import PromptTemplate
+
+import llm
+
+PROMPT = PromptTemplate(input_variables=["query"], template="{query}")
+
+
+async def _collect(name):
+    return [piece async for piece in llm.astream(name, PROMPT, {"query": "hi"})]
+
+
+def test_astream_yields_the_response():
+    llm.use_fake("analysis", "the answer is 42")
+    assert "".join(asyncio.run(_collect("analysis"))) == "the answer is 42"
+
+
+def test_astream_times_out(monkeypatch):
+    llm.use_fake("analysis", "a slow answer", latency=1.0)
+    monkeypatch.setenv("LLM_ANALYSIS_TIMEOUT", "0.05")
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(_collect("analysis"))
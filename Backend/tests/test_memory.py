@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import fakes
+import memory
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(memory, "_chats", memory.OrderedDict())
+    monkeypatch.setattr(memory, "HISTORY_MESSAGES", 3)
+    return fakes.FakeSupabase()
+
+
+def store(db, question, response, c_id="chat"):
+    """Insert a message the way app.store_message does, returning its id"""
+    inserted = asyncio.run(db.table('messages').insert(
+        {"c_id": c_id, "user_message": question, "response": response}).execute())
+    message_id = inserted.data[0]["id"]
+    memory.record(c_id, question, response, message_id)
+    return message_id
+
+
+def text(answer):
+    return {"type": "text", "data": answer}
+
+
+def history(db, c_id="chat"):
+    return asyncio.run(memory.history(db, c_id))
+
+
+def test_condense_clips_text_and_titles_plots():
+    entries = memory.condense("q", "text", "x" * 500)
+    assert entries[1]["content"] == "x" * memory.TEXT_SNIPPET_CHARS + "..."
+    plot = memory.condense("q", "plot", memory.plot_title({"layout": {"title": {"text": "Sales"}}}))
+    assert plot[1]["content"].endswith(": Sales")
+
+
+def test_recent_window_is_trimmed(db):
+    history(db)
+    for i in range(5):
+        store(db, f"q{i}", text(f"a{i}"))
+    questions = [entry["content"] for entry in history(db) if entry["role"] == "user"]
+    assert questions == ["q2", "q3", "q4"]
+
+
+def test_older_questions_are_summarised(db, monkeypatch):
+    monkeypatch.setattr(memory, "CHAT_SUMMARY", True)
+    history(db)
+    for i in range(5):
+        store(db, f"q{i}", text(f"a{i}"))
+    summary = history(db)[0]
+    assert summary == {"role": "system", "content": "Earlier in this chat the user asked: q0 | q1"}
+
+
+def test_summary_drops_the_oldest_questions_when_too_long(monkeypatch):
+    monkeypatch.setattr(memory, "SUMMARY_MAX_CHARS", 25)
+    summary = None
+    for question in ["first question", "second question", "third"]:
+        summary = memory._summarize(summary, question)
+    assert summary == "second question | third"
+
+
+def test_rebuilt_memory_matches_the_remembered_one(db, monkeypatch):
+    monkeypatch.setattr(memory, "CHAT_SUMMARY", True)
+    history(db)
+    for i in range(6):
+        store(db, f"q{i}", text(f"a{i}") if i % 2 else {"type": "plot", "data": {"layout": {"title": f"t{i}"}}})
+    remembered = history(db)
+    memory._chats.clear()
+    assert history(db) == remembered
+
+
+def test_message_written_by_another_worker_is_picked_up(db):
+    history(db)
+    store(db, "q0", text("a0"))
+    # Another worker stores a message, this process is not told
+    asyncio.run(db.table('messages').insert({"c_id": "chat", "user_message": "q1", "response": text("a1")}).execute())
+    assert [entry["content"] for entry in history(db)] == ["q0", "a0", "q1", "a1"]
+    assert memory.stats()["stale"] >= 1
+
+
+def test_hit_without_check_keeps_memory(db, monkeypatch):
+    monkeypatch.setattr(memory, "CHAT_MEMORY_CHECK", False)
+    history(db)
+    asyncio.run(db.table('messages').insert({"c_id": "chat", "user_message": "q", "response": text("a")}).execute())
+    assert history(db) == []
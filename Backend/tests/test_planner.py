@@ -0,0 +1,14 @@
+import pytest
+
+import planner
+
+
+def test_parse_plan():
+    assert planner.parse('```json\n{"route": "plot", "code": "fig = 1"}\n```') == ("yes", "fig = 1")
+
+
+@pytest.mark.parametrize("text", ['["plot", "fig = 1"]', '"plot"', "42", '{"route": "chart", "code": "x"}',
+                                  '{"route": "text", "code": ""}', "not json"])
+def test_unexpected_plans_raise_value_error(text):
+    with pytest.raises(ValueError):
+        planner.parse(text)
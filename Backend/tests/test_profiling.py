@@ -0,0 +1,67 @@
+import gc
+
+import pandas as pd
+import pytest
+
+import profiling
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(profiling, "_cache", profiling.OrderedDict())
+
+
+def frame():
+    return pd.DataFrame({"city": ["Pune", "Delhi", "Pune"], "amount": [10.5, 3.0, 7.25]})
+
+
+def test_equal_content_gives_the_same_fingerprint():
+    assert profiling.fingerprint(frame()) == profiling.fingerprint(frame())
+    assert profiling.fingerprint(frame()) != profiling.fingerprint(frame().iloc[::-1])
+
+
+def test_object_cells_of_different_types_differ():
+    assert profiling.fingerprint(pd.DataFrame({"a": [1, "x"]})) != profiling.fingerprint(pd.DataFrame({"a": ["1", "x"]}))
+    # Lists cannot be hashed by pandas
+    assert profiling.fingerprint(pd.DataFrame({"a": [[1, 2], None]})) is not None
+
+
+def test_summary_is_cached_per_content():
+    df = frame()
+    summary = profiling.summarize(df)
+    assert profiling.summarize(frame()) is summary
+    assert summary["rows"] == 3 and summary["range"]["amount"] == [3.0, 10.5]
+
+
+@pytest.mark.parametrize("mutate", [
+    lambda df: df.__setitem__("extra", 1),
+    lambda df: df.__setitem__("amount", df["amount"] * 2),
+    lambda df: df.drop(index=0, inplace=True),
+    lambda df: df.rename(columns={"city": "town"}, inplace=True),
+])
+def test_mutated_frames_are_fingerprinted_again(mutate):
+    df = frame()
+    before = profiling.fingerprint(df)
+    summary = profiling.summarize(df)
+    mutate(df)
+    assert profiling.fingerprint(df) != before
+    assert profiling.summarize(df) is not summary
+
+
+def test_tagged_version_is_used_until_the_frame_changes():
+    df = frame()
+    profiling.tag(df, "dataset-1")
+    assert profiling.fingerprint(df) == "dataset-1"
+    # Derived frames are not the tagged dataset
+    assert profiling.fingerprint(df.head(2)) != "dataset-1"
+    df["amount"] = 0.0
+    assert profiling.fingerprint(df) != "dataset-1"
+
+
+def test_tag_does_not_outlive_the_frame():
+    df = frame()
+    profiling.tag(df, "dataset-1")
+    key = id(df)
+    del df
+    gc.collect()
+    assert key not in profiling._tags
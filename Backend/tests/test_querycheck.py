@@ -0,0 +1,24 @@
+import pytest
+
+import querycheck
+from benchmarks.models import LABELED_QUERIES
+
+# Queries of LABELED_QUERIES the local tiers answer today; lower only on purpose
+MIN_ANSWERED = 26
+
+
+@pytest.mark.parametrize("query,label", LABELED_QUERIES)
+def test_local_answers_match_the_label(query, label):
+    answer, tier = querycheck.classify_local(query)
+    # None labels are left to the model
+    assert answer in (None, label)
+    assert (answer is None) == (tier is None)
+
+
+def test_local_coverage_does_not_drop():
+    answered = sum(querycheck.classify_local(query)[0] is not None for query, _ in LABELED_QUERIES)
+    assert answered >= MIN_ANSWERED
+
+
+def test_explicit_chart_request_wins():
+    assert querycheck.classify_local("what is the total, plot it as a bar chart") == ("yes", "rules")
@@ -0,0 +1,60 @@
+import pytest
+
+import resultcache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(resultcache, "_entries", resultcache.OrderedDict())
+    monkeypatch.setattr(resultcache, "_sizes", {})
+    monkeypatch.setattr(resultcache, "_total_bytes", 0)
+    monkeypatch.setattr(resultcache, "_stats", dict.fromkeys(resultcache._stats, 0))
+
+
+SCHEMA = (("region", "object"), ("sales", "float64"))
+
+
+def test_rewordings_share_an_entry():
+    assert resultcache.normalize("Show me the avg sales per region") == resultcache.normalize("average sales by region")
+    resultcache.store("v1", SCHEMA, "avg sales per region", "result = 1", {"answer": 1})
+    assert resultcache.lookup("v1", SCHEMA, "Please give the average sales by region")["code"] == "result = 1"
+
+
+def test_other_versions_and_schemas_miss():
+    resultcache.store("v1", SCHEMA, "total sales", "result = 1", {"answer": 1})
+    assert resultcache.lookup("v2", SCHEMA, "total sales") is None
+    assert resultcache.lookup("v1", SCHEMA[:1], "total sales") is None
+
+
+def test_follow_ups_bypass_the_cache():
+    resultcache.store("v1", SCHEMA, "plot that again", "result = 1", {"answer": 1})
+    assert resultcache.lookup("v1", SCHEMA, "plot that again") is None
+    assert resultcache.stats()["entries"] == 0
+    assert resultcache.stats()["bypassed"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(monkeypatch):
+    monkeypatch.setattr(resultcache, "RESULT_CACHE_MB", 250 / 1024 / 1024)
+    for query in ("total sales", "sales by region", "top regions"):
+        resultcache.store("v1", SCHEMA, query, "result = 1", {"answer": "x" * 80})
+        resultcache.lookup("v1", SCHEMA, "total sales")
+    assert resultcache.lookup("v1", SCHEMA, "total sales") is not None
+    assert resultcache.lookup("v1", SCHEMA, "sales by region") is None
+    assert resultcache.stats()["bytes"] <= 250
+
+
+def test_invalidate_drops_one_version():
+    resultcache.store("v1", SCHEMA, "total sales", "result = 1", {"answer": 1})
+    resultcache.store("v2", SCHEMA, "total sales", "result = 2", {"answer": 2})
+    resultcache.invalidate("v1")
+    assert resultcache.lookup("v1", SCHEMA, "total sales") is None
+    assert resultcache.lookup("v2", SCHEMA, "total sales")["code"] == "result = 2"
+    assert resultcache.stats()["bytes"] == resultcache._sizes[("v2", SCHEMA, "total sales")]
+
+
+def test_near_duplicates_match_only_when_enabled(monkeypatch):
+    resultcache.store("v1", SCHEMA, "total sales by region", "result = 1", {"answer": 1})
+    assert resultcache.lookup("v1", SCHEMA, "total sale by regions") is None
+    monkeypatch.setattr(resultcache, "RESULT_CACHE_SIMILARITY", 0.7)
+    assert resultcache.lookup("v1", SCHEMA, "total sale by regions")["code"] == "result = 1"
+    assert resultcache.lookup("v1", SCHEMA, "number of customers") is None
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import results
+
+LONG = "word " * 4000
+
+
+def within_budget(result):
+    return results.estimate_tokens(result) <= results.RESULT_MAX_TOKENS
+
+
+def test_small_results_are_sent_whole():
+    frame = pd.DataFrame({"region": ["north", "south"], "sales": [10.5, np.nan]})
+    assert results.compact(frame) == {"region": {0: "north", 1: "south"}, "sales": {0: 10.5, 1: None}}
+    assert results.compact(42) == "42"
+    assert results.compact({"north": LONG}) == str({"north": LONG[:results.RESULT_CELL_CHARS] + "... [20000 characters]"})
+
+
+def test_large_results_are_summarized():
+    frame = pd.DataFrame({"id": range(100_000), "city": np.tile(["Pune", "Delhi"], 50_000)})
+    summary = results.compact(frame)
+    assert results.is_summary(summary) and summary["shape"] == [100_000, 2]
+    assert summary["top_values"]["city"] == {"Pune": 50_000, "Delhi": 50_000}
+    assert within_budget(summary)
+
+
+@pytest.mark.parametrize("rows", [3, 60, 1000])
+def test_long_text_cells_are_clipped(rows):
+    texts = [f"{i} {LONG}" for i in range(rows)]
+    for value in (pd.Series(texts), pd.DataFrame({"text": texts, "id": range(rows)}), texts):
+        assert within_budget(results.compact(value))
+
+
+def test_clipped_cells_keep_their_start_and_length():
+    result = results.compact(pd.Series([LONG, "short"]))
+    assert result[0] == LONG[:results.RESULT_CELL_CHARS] + f"... [{len(LONG)} characters]"
+    assert result[1] == "short"
+
+
+def test_wide_results_fall_back_to_an_outline():
+    frame = pd.DataFrame({f"{i} {LONG[:300]}": [LONG] * 100 for i in range(300)})
+    result = results.compact(frame)
+    assert within_budget(result)
+    assert result["shape"] == [100, 300]
+    assert results.shape_of(result) == [100, 300]
+
+
+def test_long_labels_are_clipped():
+    result = results.compact(pd.Series([1, 2], index=[LONG, "short"]))
+    assert within_budget(result) and result["short"] == 2
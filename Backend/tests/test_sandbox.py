@@ -0,0 +1,35 @@
+import multiprocessing
+
+import pandas as pd
+import pytest
+
+import results
+import sandbox
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = sandbox.Pool(size=1)
+    yield pool
+    pool.close()
+
+
+def test_system_exit_is_an_ordinary_error(pool):
+    with pytest.raises(RuntimeError, match="SystemExit"):
+        pool.execute("query", "raise SystemExit(3)", pd.DataFrame({"a": [1]}))
+    # The worker is still usable
+    assert pool.execute("query", "result = int(df['a'].sum())", pd.DataFrame({"a": [1, 2]})) == results.compact(3)
+
+
+def test_large_allocation_is_refused(pool):
+    # Untouched pages do not show up in RSS, only the address space limit stops this
+    with pytest.raises(MemoryError):
+        pool.execute("query", "result = len(bytearray(64 * 1024 ** 3))")
+
+
+def test_worker_dying_at_startup_raises_runtime_error():
+    worker = sandbox.Worker.__new__(sandbox.Worker)
+    worker.conn, child = multiprocessing.Pipe()
+    child.close()
+    with pytest.raises(RuntimeError, match="did not start"):
+        worker.wait_ready()
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import fakes
+import llm
+import sandbox
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_does_not_load_plotting_or_model_libraries():
+    # A fresh interpreter, the test session has imported all of them already
+    script = ("import sys, app\n"
+              "print(','.join(m for m in ('plotly.express', 'langchain_groq', 'langchain_google_genai') "
+              "if m in sys.modules))")
+    loaded = subprocess.run([sys.executable, "-c", script], cwd=BACKEND, capture_output=True, text=True, check=True)
+    assert loaded.stdout.strip() == ""
+
+
+@pytest.fixture
+def http(monkeypatch):
+    monkeypatch.setattr(app, "supabase", fakes.FakeSupabase())
+    monkeypatch.setattr(app, "_warm", {"seconds": None, "task": None})
+    monkeypatch.setattr(app, "WARM_UP", True)
+    monkeypatch.setattr(llm, "warm_up", lambda: None)
+    monkeypatch.setattr(sandbox, "SANDBOX", False)
+    return TestClient(app.app)
+
+
+def test_ready_only_after_warm_up(http):
+    assert http.get("/health").status_code == 200
+    assert http.get("/health/ready").status_code == 503
+    app.warm_up()
+    body = http.get("/health/ready").json()
+    assert body["status"] == "ready" and body["warm_up_seconds"] is not None
+
+
+def wait_for_ready(http, timeout=5):
+    deadline = time.monotonic() + timeout
+    seen = []
+    while time.monotonic() < deadline:
+        response = http.get("/health/ready")
+        seen.append(response.json())
+        if response.status_code == 200:
+            return seen
+        time.sleep(0.02)
+    raise AssertionError(f"not ready after {timeout}s: {seen[-1]}")
+
+
+def test_failed_warm_up_is_retried(http, monkeypatch):
+    attempts = []
+
+    def start():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("no workers")
+
+    monkeypatch.setattr(sandbox, "start", start)
+    with http:
+        seen = wait_for_ready(http)
+    assert any(body.get("warm_up_error") == "no workers" for body in seen)
+    assert len(attempts) == 2
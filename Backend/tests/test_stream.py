@@ -0,0 +1,80 @@
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import cleaning
+import datastore
+import fakes
+
+DEDUPE = {"removeDuplicates": 1}
+
+
+@pytest.fixture(autouse=True)
+def dataset_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(datastore, "DATASET_DIR", str(tmp_path))
+    monkeypatch.setattr(datastore, "_cache", datastore.OrderedDict())
+    monkeypatch.setattr(datastore, "_handles", {})
+
+
+def stored(text, fmt, options, chunksize=2):
+    chunks = cleaning.stream_cleaning(io.BytesIO(text.encode()), fmt, options, chunksize=chunksize)
+    dataset_id, rows = datastore.register_chunks("chat", chunks)
+    return datastore.load(dataset_id), rows
+
+
+def ndjson(records):
+    return "".join(json.dumps(record) + "\n" for record in records)
+
+
+def test_csv_columns_get_their_types_back():
+    text = "city,amount,qty,note\n" + "".join(f"c{i},{i * 1.5},{i},\n" for i in range(7)) + "c1,,3,late\n"
+    df, rows = stored(text, "csv", {"handleMissing": 1})
+    assert rows == 8
+    assert df["amount"].dtype == "float64" and df["qty"].dtype == "int64"
+    assert df["amount"].sum() == sum(i * 1.5 for i in range(7))
+    assert df["note"].tolist() == ["0"] * 7 + ["late"]
+
+
+def test_integers_with_gaps_become_floats():
+    df, _ = stored("a,b\n1,x\n2,y\n,z\n", "csv", {})
+    assert df["a"].dtype == "float64"
+    assert df["a"].isna().tolist() == [False, False, True]
+
+
+def test_keys_first_seen_late_are_kept():
+    records = [{"a": 1}, {"a": 2}, {"a": 3}, {"a": 4, "late": "x"}, {"a": 5, "later": True}]
+    df, _ = stored(ndjson(records), "ndjson", {})
+    assert list(df.columns) == ["a", "late", "later"]
+    assert df["late"].tolist()[3] == "x" and df["later"].tolist()[4] is True
+    chunks = cleaning.stream_cleaning(io.BytesIO(ndjson(records).encode()), "ndjson", {}, chunksize=2)
+    assert all(list(chunk.columns) == ["a", "late", "later"] for chunk in chunks)
+
+
+def test_duplicates_are_removed_across_chunks():
+    records = [{"a": 1, "b": "x"}, {"a": 2}, {"a": 1, "b": "x"}, {"a": 4, "c": [1, 2]}, {"a": "1", "b": "x"},
+               {"a": 4, "c": [1, 2]}]
+    df, rows = stored(ndjson(records), "ndjson", DEDUPE)
+    # 1 and '1' differ
+    assert rows == 4
+    df, rows = stored("a,b\n1,x\n2,y\n1,x\n2,y\n3,z\n", "csv", DEDUPE)
+    assert rows == 3 and df["a"].tolist() == [1, 2, 3]
+
+
+def test_streamed_upload_is_registered(monkeypatch):
+    monkeypatch.setattr(app, "supabase", fakes.FakeSupabase())
+    text = "city,amount\nPune,10.5\nDelhi,3\n"
+    body = TestClient(app.app).post("/process/stream", files={"file": ("sales.csv", text, "text/csv")},
+                                    data={"c_id": "chat", "output": "dataset"}).json()
+    df = datastore.load(body["dataset_id"])
+    assert df["amount"].dtype == "float64" and df["amount"].sum() == 13.5
+
+
+def test_ndjson_output_has_the_same_keys_on_every_row(monkeypatch):
+    monkeypatch.setattr(app, "supabase", fakes.FakeSupabase())
+    text = ndjson([{"a": 1}, {"a": 2, "b": "x"}])
+    response = TestClient(app.app).post("/process/stream", files={"file": ("rows.ndjson", text)})
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == [{"a": 1, "b": None}, {"a": 2, "b": "x"}]
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import fakes
+import llm
+import planner
+import resultcache
+import sandbox
+
+ROWS = [{"city": "Pune", "amount": 10.5}, {"city": "Delhi", "amount": 3.0}, {"city": "Pune", "amount": 4.5}]
+GRAPH_CODE = "import plotly.express as px\nfig = px.bar(df, x='city', y='amount')"
+
+
+@pytest.fixture
+def http(monkeypatch):
+    monkeypatch.setattr(app, "supabase", fakes.FakeSupabase())
+    monkeypatch.setattr(llm, "_clients", dict(llm._clients))
+    monkeypatch.setattr(sandbox, "SANDBOX", False)
+    monkeypatch.setattr(planner, "ANALYTICS_MODE", "split")
+    monkeypatch.setattr(resultcache, "RESULT_CACHE_MB", 0)
+    return TestClient(app.app)
+
+
+def events(http, query):
+    response = http.post("/analytics/stream", json={"query": query, "df": ROWS, "c_id": "chat"})
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_text_answer_events(http):
+    llm.use_fake("analysis", lambda prompt: "result = df['amount'].mean()" if "Pandas query result" not in prompt
+                 else "The average amount is 6.")
+    sent = events(http, "what is the average amount")
+    assert [event["event"] for event in sent[:3]] == ["classified", "code", "executed"]
+    assert {event["event"] for event in sent[3:-1]} == {"token"}
+    assert sent[-1] == {"event": "response", "type": "text", "data": "The average amount is 6."}
+
+
+def test_chart_events_with_a_retry(http):
+    replies = iter(["import plotly.express as px\nfig = None", GRAPH_CODE])
+    llm.use_fake("graph", lambda prompt: next(replies))
+    sent = events(http, "plot amount by city")
+    assert [event["event"] for event in sent] == ["classified", "code", "retry", "code", "executed", "response"]
+    assert sent[2]["attempt"] == 1 and sent[2]["error"]
+    assert sent[3]["code"] == GRAPH_CODE
+    assert sent[-1]["type"] == "plot" and sent[-1]["data"]["data"][0]["type"] == "bar"
+
+
+def test_chart_that_never_renders(http):
+    llm.use_fake("graph", "fig = None")
+    sent = events(http, "plot amount by city")
+    assert [event["event"] for event in sent] == ["classified", "code", "retry", "code", "retry", "code", "response"]
+    assert sent[-1]["type"] == "text"
+
+
+def test_blocking_endpoint_matches(http):
+    llm.use_fake("graph", GRAPH_CODE)
+    body = http.post("/analytics", json={"query": "plot amount by city", "df": ROWS, "c_id": "chat"}).json()
+    assert body["type"] == "plot" and body["data"]["data"][0]["type"] == "bar"
@@ -0,0 +1,73 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+import llm
+import results
+import sandbox
+import texanswer
+
+SALES = pd.DataFrame({"region": ["north", "south", "north"], "sales": [10.0, 5.5, 4.5]})
+
+
+@pytest.mark.parametrize("text,language,code", [
+    ("result = 1", "python", "result = 1"),
+    ("```python\n# python code\nresult = 1\n```", "python", "# python code\nresult = 1"),
+    ("```\nresult = 1\n```", "python", "result = 1"),
+    ("```sql\nSELECT 1\n```", "sql", "SELECT 1"),
+    ("```SQL\nSELECT 'sql'\n```", "sql", "SELECT 'sql'"),
+])
+def test_strip_fences(text, language, code):
+    assert texanswer.strip_fences(text, language) == code
+
+
+def test_engine_choice(monkeypatch):
+    monkeypatch.setattr(texanswer, "SQL_ENGINE_MIN_ROWS", 3)
+    assert texanswer.choose_engine(SALES, "auto") == "sql"
+    assert texanswer.choose_engine(SALES.head(2), "auto") == "pandas"
+    assert texanswer.choose_engine(SALES, "pandas") == "pandas"
+    monkeypatch.setattr(sandbox, "duckdb", None)
+    assert texanswer.choose_engine(SALES, "sql") == "pandas"
+    with pytest.raises(ValueError):
+        texanswer.choose_engine(SALES, "spark")
+
+
+@pytest.mark.parametrize("result,answer", [
+    (1234567, "The answer is 1,234,567."),
+    (3.14159, "The answer is 3.14."),
+    (True, "Yes."),
+    (["north", "south"], "north, south."),
+    ({"north": 14.5, "south": 5.5}, "north: 14.50\nsouth: 5.50"),
+    ({"sales": {"north": 14.5}, "orders": {"north": 2}}, "north - sales: 14.50, orders: 2"),
+    ("42", "The answer is 42."),
+    ("Timestamp('2020-01-01 00:00:00')", None),
+    (list(range(20)), None),
+])
+def test_format_locally(result, answer):
+    assert texanswer.format_locally(result) == answer
+
+
+def test_summaries_are_left_to_the_model(monkeypatch):
+    monkeypatch.setattr(results, "RESULT_FULL_ROWS", 5)
+    assert texanswer.format_locally(results.compact(pd.DataFrame({"a": range(100)}))) is None
+
+
+def test_sql_task_matches_pandas():
+    pytest.importorskip("duckdb")
+    code = "SELECT region, SUM(sales) AS sales FROM df GROUP BY region ORDER BY region"
+    assert sandbox.sql_task(code, SALES) == sandbox.query_task(
+        "result = df.groupby('region', as_index=False)['sales'].sum()", SALES)
+    assert sandbox.sql_task("SELECT SUM(sales) FROM df", SALES) == results.compact(20.0)
+    with pytest.raises(ValueError):
+        sandbox.sql_task("DELETE FROM df", SALES)
+
+
+def test_analyze_answers_locally_without_the_interpretation_call(monkeypatch):
+    monkeypatch.setattr(llm, "_clients", dict(llm._clients))
+    monkeypatch.setattr(sandbox, "SANDBOX", False)
+    monkeypatch.setattr(texanswer, "LOCAL_ANSWERS", True)
+    fake = llm.use_fake("analysis", "```python\nresult = df['sales'].sum()\n```")
+    answer, code = asyncio.run(texanswer.analyze(SALES, "what is the total sales", engine="pandas"))
+    assert answer == "The answer is 20." and code == "result = df['sales'].sum()"
+    assert fake.calls == 1
@@ -0,0 +1,20 @@
+from fastapi.testclient import TestClient
+
+import app
+import tracing
+
+
+def test_tracing_is_the_outermost_middleware():
+    assert app.app.user_middleware[0].cls is tracing.Middleware
+
+
+def _preflights():
+    return sum(sum(counts) for labels, (counts, _) in tracing.REQUEST_SECONDS.values.items() if labels[0] == "OPTIONS")
+
+
+def test_cors_preflight_is_timed():
+    before = _preflights()
+    response = TestClient(app.app).options("/analytics", headers={
+        "Origin": "http://example.com", "Access-Control-Request-Method": "POST"})
+    assert response.status_code == 200
+    assert _preflights() == before + 1
@@ -1,41 +1,42 @@
-
-import pandas as pd
-import plotly.express as px
-import json
-import tempfile
-
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import PromptTemplate
+import ast
+import numbers
+import re
+
+import llm
+import workers
+import sandbox
+import profiling
+import cubes
+import codecheck
+import results
+import tracing
 import os
 from dotenv import load_dotenv
 load_dotenv()
-from supabase import create_client, Client
-import numpy as np
-
-model_name: str=os.getenv("GOOGLE_MODEL_NAME")
-url: str = os.getenv("SUPABASE_URL")
-key: str = os.getenv("SUPABASE_KEY")
-
-supabase: Client = create_client(url, key)
-def analyze(df, query, chat_history=None):
-    google_api_key = os.getenv("google_api_key")
-    llm = ChatGoogleGenerativeAI(model=model_name, google_api_key=google_api_key)
-
-    summary = {
-        "rows": df.shape[0],
-        "columns": df.shape[1],
-        "missing_values": df.isnull().sum().to_dict(),
-        "dtypes": df.dtypes.astype(str).to_dict(),
-        "sample": df.head(5).replace({np.nan: None}).to_dict(orient="records")
-    }
-
-    query_prompt = PromptTemplate(
-        input_variables=["query", "columns", "summary", "chat_history"],
-        template="""You are Analytica-AI, a data analysis assistant that generates pandas code or responds conversationally.
+
+# Text answers come from LLM-written pandas code or, with the SQL engine, from
+# a DuckDB query over the same frame (multi-threaded and vectorized). "auto"
+# uses SQL for datasets of at least SQL_ENGINE_MIN_ROWS rows when duckdb is
+# installed. A request can also ask for "pandas" or "sql" explicitly.
+TEXT_ENGINE = os.getenv("TEXT_ENGINE", "auto")
+SQL_ENGINE_MIN_ROWS = int(os.getenv("SQL_ENGINE_MIN_ROWS", "500000"))
+ENGINES = ("auto", "pandas", "sql")
+# LOCAL_ANSWERS=1 phrases simple results (a number, a short text or a few
+# values) from templates instead of making the interpretation call
+LOCAL_ANSWERS = os.getenv("LOCAL_ANSWERS", "0") == "1"
+LOCAL_MAX_ITEMS = 10
+LOCAL_MAX_COLUMNS = 3
+LOCAL_MAX_CHARS = 500
+
+QUERY_PROMPT = PromptTemplate(
+    input_variables=["query", "columns", "summary", "cube", "chat_history"],
+    template="""You are Analytica-AI, a data analysis assistant that generates pandas code or responds conversationally.
 
             **Dataset Info:**
             Columns: {columns}
             Summary: {summary}
+            Pre-aggregated tables: {cube}
 
             **Recent Context (for reference only - do NOT repeat previous errors):**
             {chat_history}
@@ -59,6 +60,12 @@ def analyze(df, query, chat_history=None):
                 * Validate data types before operations
             - NO print statements, NO comments, NO explanations
             - NO markdown formatting, NO code fences
+            - When pre-aggregated tables are available, compute sum, count, mean, min, max or size of a
+              column grouped by one or two of their dimensions with `cube.aggregate(by, column, func)`
+              instead of `df.groupby`. It returns the same Series and does not scan `df`. The tables
+              always cover every row, so when the question filters rows, group the filtered frame
+              instead. Datetime columns have `<column>_year`, `_quarter`, `_month`, `_week` and `_day`
+              bucket dimensions.
             
             Example patterns:
             ```python
@@ -67,6 +74,9 @@ def analyze(df, query, chat_history=None):
             
             # Aggregation
             result = df.groupby('category')['sales'].sum().sort_values(ascending=False)
+
+            # Aggregation from the pre-aggregated tables
+            result = cube.aggregate('category', 'sales', 'sum').sort_values(ascending=False)
             
             # Top N with safety check
             result = df.nlargest(5, 'sales') if 'sales' in df.columns else df.head()
@@ -99,32 +109,59 @@ def analyze(df, query, chat_history=None):
 
             **Current query to process:** {query}
             """
-            )
+)
 
+SQL_PROMPT = PromptTemplate(
+    input_variables=["query", "columns", "summary", "chat_history"],
+    template="""You are Analytica-AI, a data analysis assistant that answers questions with DuckDB SQL.
 
-    chain_query = query_prompt | llm
-    query_code = chain_query.invoke({
-        "query": query,
-        "columns": list(df.columns),
-        "summary": summary,
-        "chat_history": chat_history if chat_history else "No prior conversation."
-    }).content.strip()
-
-    if query_code.startswith("```"):
-        query_code = query_code.strip("`")
-        query_code = query_code.split("python")[-1].strip()
-    print("Generated Query Code:\n", query_code)
-    local_env = {"pd": pd, "df": df}
-    exec(query_code, local_env)
-    result_df = local_env.get("result")
-    if hasattr(result_df, "to_dict"):
-        result_for_llm = result_df.replace({np.nan: None}).to_dict()
-    else:
-        result_for_llm = str(result_df)
+            **Dataset Info:**
+            The data is in a table named `df`.
+            Columns: {columns}
+            Summary: {summary}
+
+            **Recent Context (for reference only - do NOT repeat previous errors):**
+            {chat_history}
+            **Never repeat same thing twice!**
+            **Current User Query:** {query}
+
+            **Critical Rules:**
+
+            1. FOR DATA ANALYSIS REQUESTS:
+            - Write ONE DuckDB SELECT statement over `df` that computes the answer
+            - Quote column names with double quotes, e.g. "Unit Price"
+            - Return a single value when the question asks for one number or fact
+            - Only use columns listed above; NO DDL, NO INSERT/UPDATE/DELETE, NO file functions
+            - NO comments, NO explanations, NO markdown formatting, NO code fences
+
+            Example patterns:
+            ```sql
+            SELECT "category", SUM("sales") AS "sales" FROM df GROUP BY "category" ORDER BY "sales" DESC
+            SELECT AVG("price") FROM df WHERE "region" = 'north'
+            SELECT * FROM df ORDER BY "sales" DESC LIMIT 5
+            ```
+
+            2. FOR CONVERSATIONAL QUERIES (greetings, questions about capabilities):
+            - Select a friendly string
+            ```sql
+            SELECT 'Hi! I''m Analytica-AI. I can analyze your data and answer questions about your dataset. What would you like to explore?'
+            ```
+
+            3. FOR UNCLEAR/INVALID REQUESTS:
+            ```sql
+            SELECT error('I couldn''t understand that. Try: ''average sales by region'' or ''top 5 rows by revenue''')
+            ```
+
+            **Output Format:**
+            - Return ONLY the SQL statement
+
+            **Current query to process:** {query}
+            """
+)
 
-    text_prompt = PromptTemplate(
-        input_variables=["query", "result"],
-        template="""
+TEXT_PROMPT = PromptTemplate(
+    input_variables=["query", "result"],
+    template="""
         You are a data interpretation assistant.
 
         User request: {query}
@@ -132,10 +169,197 @@ def analyze(df, query, chat_history=None):
 
         Provide a short, clear answer (max 3 sentences).
         """
+)
+
+def choose_engine(df, engine=None):
+    """Resolve "auto" and fall back to pandas when duckdb is missing"""
+    engine = engine or TEXT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown text engine {engine!r}, expected one of {ENGINES}")
+    if engine == "auto":
+        engine = "sql" if len(df) >= SQL_ENGINE_MIN_ROWS else "pandas"
+    if engine == "sql" and sandbox.duckdb is None:
+        print("duckdb is not installed, answering with pandas")
+        engine = "pandas"
+    return engine
+
+
+def strip_fences(code, language):
+    code = code.strip()
+    if code.startswith("```"):
+        code = code.strip("`").strip()
+        if code.lower().startswith(language):
+            code = code[len(language):]
+    return code.strip()
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, numbers.Integral):
+        return f"{value:,}"
+    if isinstance(value, numbers.Real):
+        if value != value:
+            return "missing"
+        if float(value).is_integer():
+            return f"{int(value):,}"
+        return f"{value:,.2f}" if abs(value) >= 1 else f"{value:.4g}"
+    return str(value)
+
+
+def _scalar(value):
+    return value is None or isinstance(value, (str, numbers.Number))
+
+
+def format_locally(result):
+    """Answer text for a simple query result, or None when it needs the model.
+
+    result is what the sandbox returns, see results.compact.
+    """
+    if results.is_summary(result):
+        return None
+    if isinstance(result, str):
+        if "[truncated" in result or len(result) > LOCAL_MAX_CHARS:
+            return None
+        try:
+            # Scalars, lists and tuples come back as their repr
+            result = ast.literal_eval(result)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            # Reprs such as Timestamp('2020-01-01') read better in the model's words
+            return None if re.match(r"^[\w.]+\(.*\)$", result.strip(), re.S) else result.strip() or None
+        if isinstance(result, str):
+            return result.strip() or None
+    if isinstance(result, bool):
+        return "Yes." if result else "No."
+    if isinstance(result, numbers.Number):
+        return f"The answer is {_format_value(result)}."
+    if isinstance(result, (list, tuple, set)):
+        items = list(result)
+        if not items or len(items) > LOCAL_MAX_ITEMS or not all(_scalar(item) for item in items):
+            return None
+        return ", ".join(_format_value(item) for item in items) + "."
+    if not isinstance(result, dict) or not result or len(result) > LOCAL_MAX_ITEMS:
+        return None
+    if all(_scalar(value) for value in result.values()):
+        # A Series, keyed by its index
+        return "\n".join(f"{key}: {_format_value(value)}" for key, value in result.items())
+    columns = list(result.values())
+    if len(columns) > LOCAL_MAX_COLUMNS or not all(isinstance(column, dict) for column in columns):
+        return None
+    # A DataFrame, keyed by column and then by row
+    rows = list(columns[0])
+    if len(rows) > LOCAL_MAX_ITEMS or not all(list(column) == rows and all(_scalar(v) for v in column.values())
+                                               for column in columns):
+        return None
+    return "\n".join(
+        f"{row} - " + ", ".join(f"{name}: {_format_value(column[row])}" for name, column in result.items())
+        for row in rows
     )
-    chain_text = text_prompt | llm
-    answer = chain_text.invoke({
+
+
+async def write_code(df, query, chat_history=None, engine=None):
+    """Generate the code for a text answer, returning (engine, code, cube)"""
+    with tracing.span("codegen.text") as attrs:
+        engine, query_code, cube = await _write_code(df, query, chat_history, engine)
+        attrs["engine"] = engine
+        tracing.code(attrs, query_code)
+    return engine, query_code, cube
+
+
+async def _write_code(df, query, chat_history=None, engine=None):
+    engine = choose_engine(df, engine)
+    summary = await workers.run(profiling.summarize, df)
+    chat_history = chat_history if chat_history else "No prior conversation."
+
+    if engine == "sql":
+        query_code = await llm.ainvoke("analysis", SQL_PROMPT, {
+            "query": query,
+            "columns": list(df.columns),
+            "summary": summary,
+            "chat_history": chat_history,
+        })
+        query_code = strip_fences(query_code, "sql")
+        return engine, query_code, None
+
+    cube = await workers.run(cubes.for_frame, df)
+    query_code = await llm.ainvoke("analysis", QUERY_PROMPT, {
         "query": query,
-        "result": result_for_llm
-    }).content.strip()
+        "columns": list(df.columns),
+        "summary": summary,
+        "cube": cubes.describe(cube),
+        "chat_history": chat_history,
+    })
+    query_code = strip_fences(query_code, "python")
+    return engine, query_code, cube
+
+
+async def prepare_code(df, query, chat_history=None, engine=None, code=None):
+    """write_code(), or the pandas code already written by planner.plan(), checked before it runs"""
+    if code is None:
+        engine, code, cube = await write_code(df, query, chat_history, engine)
+    else:
+        engine, cube = "pandas", await workers.run(cubes.for_frame, df)
+    if engine == "pandas":
+        code = codecheck.repair(code, df, cube)
+    return engine, code, cube
+
+
+async def run_code(engine, query_code, df, cube=None):
+    """Run generated code and return its result for the interpretation prompt"""
+    if engine == "sql":
+        result_for_llm = await sandbox.run("sql", query_code, df)
+    else:
+        result_for_llm = await sandbox.run("query", query_code, df, cube)
+    # Large results were already summarized by the sandbox task, see results.compact
+    tracing.payload("query_result", len(str(result_for_llm)))
+    return result_for_llm
+
+
+def local_answer(result_for_llm):
+    if not LOCAL_ANSWERS:
+        return None
+    answer = format_locally(result_for_llm)
+    if answer is not None:
+        tracing.event("local_answer")
     return answer
+
+
+async def analyze(df, query, chat_history=None, engine=None, code=None):
+    """Answer a question in text, returning the answer and the code that computed it.
+
+    code is pandas code from planner.plan(), written here when not given.
+    """
+    engine, query_code, cube = await prepare_code(df, query, chat_history, engine, code)
+    result_for_llm = await run_code(engine, query_code, df, cube)
+    answer = local_answer(result_for_llm)
+    if answer is None:
+        answer = await llm.ainvoke("analysis", TEXT_PROMPT, {
+            "query": query,
+            "result": result_for_llm
+        })
+    return answer.strip(), query_code
+
+
+async def analyze_stream(df, query, chat_history=None, engine=None, code=None):
+    """Like analyze(), but yield progress events while the answer is produced.
+
+    Yields {"event": "code"}, then {"event": "executed"} with the result shape,
+    then {"event": "token"} for each piece of the answer as the model writes
+    it (the whole answer when it was formatted locally), and finally
+    {"event": "answer"} with the whole answer and the code.
+    """
+    engine, query_code, cube = await prepare_code(df, query, chat_history, engine, code)
+    yield {"event": "code", "engine": engine, "code": query_code}
+    result_for_llm = await run_code(engine, query_code, df, cube)
+    yield {"event": "executed", "shape": results.shape_of(result_for_llm),
+           "summarized": results.is_summary(result_for_llm)}
+    answer = local_answer(result_for_llm)
+    if answer is not None:
+        yield {"event": "token", "text": answer}
+        yield {"event": "answer", "data": answer, "code": query_code}
+        return
+    pieces = []
+    async for piece in llm.astream("analysis", TEXT_PROMPT, {"query": query, "result": result_for_llm}):
+        pieces.append(piece)
+        yield {"event": "token", "text": piece}
+    yield {"event": "answer", "data": "".join(pieces).strip(), "code": query_code}
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Per-request traces and Prometheus metrics. Each stage of a request (loading
+# the dataset, classification, code generation, the sandbox run, model calls,
+# database writes) is a span; its duration goes into a latency histogram
+# served at /metrics, and the spans of a request are printed as one JSON line
+# when it finishes. A span costs a few microseconds. TRACING=0 turns it all
+# off, TRACE_LOG=0 keeps the metrics but drops the log lines.
+TRACING = os.getenv("TRACING", "1") != "0"
+TRACE_LOG = os.getenv("TRACE_LOG", "1") != "0"
+# TRACE_VERBOSE=1 also logs the generated code
+TRACE_VERBOSE = os.getenv("TRACE_VERBOSE", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+_registry = []
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # labels -> [count per bucket (+Inf last), sum]
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels((*self.labels, 'le'), (*labels, bound))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+REQUEST_SECONDS = Histogram("analytica_request_seconds", "Time until the last response byte", ("method", "route", "status"))
+RESPONSE_BYTES = Histogram("analytica_response_bytes", "Response body size", ("route",), SIZE_BUCKETS)
+STAGE_SECONDS = Histogram("analytica_stage_seconds", "Duration of a pipeline stage", ("stage",))
+STAGE_ERRORS = Counter("analytica_stage_errors_total", "Stages that raised", ("stage",))
+PAYLOAD_BYTES = Histogram("analytica_payload_bytes", "Size of payloads passed between stages", ("stage",), SIZE_BUCKETS)
+LLM_TOKENS = Counter("analytica_llm_tokens_total", "Model tokens, reported by the provider or estimated", ("model", "kind"))
+RETRIES = Counter("analytica_retries_total", "Attempts repeated after a failure", ("stage",))
+EVENTS = Counter("analytica_events_total", "Notable outcomes such as cache hits and local repairs", ("event",))
+
+
+class Trace:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.spans = []
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Time a stage of the current request; the yielded dict takes extra attributes for the log"""
+    if not TRACING:
+        yield attrs
+        return
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        trace = _current.get()
+        if trace is not None:
+            trace.spans.append({"stage": stage, "at_ms": round((start - trace.start) * 1000, 2),
+                                "ms": round(elapsed * 1000, 2), **attrs})
+
+
+async def traced(stage, awaitable, **attrs):
+    """Await inside a span, e.g. for one of several coroutines passed to asyncio.gather"""
+    with span(stage, **attrs):
+        return await awaitable
+
+
+def payload(stage, size):
+    if TRACING and size is not None:
+        PAYLOAD_BYTES.observe(size, stage)
+
+
+def code(attrs, source):
+    """Record generated code in a span: its size, and the code itself with TRACE_VERBOSE"""
+    attrs["code_chars"] = len(source)
+    if TRACE_VERBOSE:
+        attrs["code"] = source
+
+
+def event(name, amount=1):
+    if TRACING:
+        EVENTS.inc(name, amount=amount)
+
+
+def metrics():
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(line for metric in _registry for line in metric.lines()) + "\n"
+
+
+class Middleware:
+    """ASGI middleware that opens a trace per HTTP request and records its latency and size"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING:
+            return await self.app(scope, receive, send)
+        trace = Trace()
+        token = _current.set(trace)
+        response = {"status": 500, "bytes": 0, "end": None}
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+                if not message.get("more_body"):
+                    response["end"] = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            _current.reset(token)
+            # Background tasks run after the last byte, their spans still join the trace
+            end = response["end"] or time.perf_counter()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(end - trace.start, scope["method"], route, response["status"])
+            RESPONSE_BYTES.observe(response["bytes"], route)
+            if TRACE_LOG and trace.spans:
+                print(json.dumps({"trace": trace.id, "method": scope["method"], "route": route,
+                                  "status": response["status"], "ms": round((end - trace.start) * 1000, 2),
+                                  "bytes": response["bytes"], "spans": trace.spans}, default=str))
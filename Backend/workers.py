@@ -0,0 +1,21 @@
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+
+# CPU-bound pandas work and exec of generated code run here so the event loop
+# stays free to overlap other requests while they wait on the LLM or the DB.
+EXEC_WORKERS = int(os.getenv("EXEC_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=EXEC_WORKERS, thread_name_prefix="analytics")
+
+
+async def run(fn, *args, **kwargs):
+    """Run a blocking function on the bounded executor and await its result."""
+    loop = asyncio.get_running_loop()
+    # Keep the request's context, e.g. its trace, in the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, fn, *args, **kwargs))